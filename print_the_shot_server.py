@@ -19,8 +19,27 @@ import signal
 import sys
 import platform
 import urllib.parse
+import re
+import hashlib
+import unicodedata
+import math
+import bisect
+import heapq
+import zipfile
+import tarfile
+import argparse
+import contextlib
+import cProfile
+import pstats
+import random
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
 from datetime import datetime
-from io import BytesIO
+from io import BytesIO, StringIO
 
 # 第三方库导入 / Third-party library imports
 try:
@@ -28,7 +47,7 @@ try:
     matplotlib.use('Agg')  # 使用非交互式后端 / Use non-interactive backend
     import matplotlib.pyplot as plt
     import numpy as np
-    from PIL import Image
+    from PIL import Image, ImageChops, ImageDraw, ImageFont
 except ImportError as e:
     print(f"❌ 缺少必要的库 / Missing required libraries: {e}")
     print("💡 请安装 / Please install: pip install matplotlib pillow numpy")
@@ -41,6 +60,43 @@ IMAGE_DIR = "shots_images"
 PRINT_ENABLED = True  # 默认启用打印 / Default enable printing
 BEAN_INFO_ENABLED = True
 MAX_USERS = 5  # 最大并发用户数 / Max concurrent users
+RENDER_VERSION = "2"  # 图表布局版本，修改 create_coffee_plot 布局时递增 / Bump when the receipt layout changes
+RENDERER = 'matplotlib'  # 小票渲染引擎：matplotlib，或更轻量的 pillow / Receipt renderer: matplotlib, or the lighter pillow
+RENDERERS = ('matplotlib', 'pillow')
+RENDER_MANIFEST_FILE = "render_manifest.json"  # 位于 IMAGE_DIR 中 / Lives in IMAGE_DIR
+SHOT_INDEX_FILE = "shots_index.jsonl"  # 位于 DATA_DIR 中 / Lives in DATA_DIR
+SHOT_FEATURES_FILE = "shot_features"  # 位于 DATA_DIR 中，.f32 + .names / Lives in DATA_DIR, .f32 + .names
+BASELINES_FILE = "profile_baselines.json"  # 位于 DATA_DIR 中 / Lives in DATA_DIR
+PRINT_RASTER_SUFFIX = "_print"  # 与图表同目录的1位打印位图：<冲泡>_print_<纸张>.png / 1-bit print raster next to the chart: <shot>_print_<paper>.png
+# 纸张规格：可打印点数、分辨率、纸宽、单页最大长度、是否带切刀
+# Paper profiles: printable dots, resolution, paper width, max page length, cutter support
+PAPER_PROFILES = {
+    '80mm': {'width_mm': 80, 'dots': 576, 'dpi': 203, 'max_length_mm': 1000, 'cutter': True},
+    '58mm': {'width_mm': 58, 'dots': 384, 'dpi': 203, 'max_length_mm': 1000, 'cutter': False},
+}
+PAPER_PROFILE = '80mm'  # 默认纸张，可在 printers.json 中按打印机覆盖 / Default paper, overridable per printer in printers.json
+PRINT_MIN_INTERVAL = 2.0  # 同一打印机两次任务的最小间隔（秒），约等于打印一张小票的时间 / Min seconds between jobs on one printer, about one receipt
+PRINT_PRIORITY_MANUAL = 0  # 数值越小越先打印 / Lower prints first
+PRINT_PRIORITY_AUTO = 10
+PRINT_JOBS_FILE = "print_jobs.jsonl"  # 位于 DATA_DIR 中，已完成打印任务的记录 / Lives in DATA_DIR, log of finished print jobs
+PRINT_MAX_RETRIES = 2  # 没有其他打印机可切换时的重试次数 / Retries when there is no other printer to fail over to
+PRINT_RETRY_DELAY = 5.0  # 重试间隔（秒），按次数递增 / Seconds before a retry, multiplied by the retry number
+PRINT_TRACK_INTERVAL = 2.0  # 轮询CUPS任务状态的间隔（秒）/ Seconds between CUPS job status polls
+PRINTERS_FILE = "printers.json"  # 打印机池配置，不存在时使用系统默认打印机 / Printer pool config; the system default printer is used without it
+PRINTER_FAILURE_THRESHOLD = 2  # 连续失败多少次后断路器打开 / Consecutive failures before the circuit breaker opens
+PRINTER_RETRY_AFTER = 60  # 断路器打开多少秒后放行一个试探任务 / Seconds before an open breaker lets a trial job through
+PRINTER_PROBE_INTERVAL = 30  # 打印机健康探测间隔（秒）/ Seconds between printer health probes
+PRINTER_PROBE_TIMEOUT = 3  # 网络打印机探测的连接超时（秒）/ Connect timeout when probing a network printer
+PRINT_SUBMIT_TIMEOUT = 30  # lp/lpr 提交超时（秒）/ Timeout for lp/lpr submissions (seconds)
+STAGE_TIMINGS_WINDOW = 500  # 每个阶段用于滚动分位数的最近样本数 / Recent samples per stage behind the rolling percentiles
+STAGE_TIMINGS_SHOTS = 50  # 保留逐阶段明细的最近冲泡数 / Recent shots whose per-stage breakdown is kept
+SLOW_STAGE_SECONDS = 0  # 阶段耗时超过此秒数时记录日志，0为关闭 / Log any stage slower than this many seconds, 0 turns it off
+PROFILE_DIR = "profiles"  # cProfile 结果目录 / Directory for cProfile results
+PROFILE_KEEP = 50  # 最多保留的剖析文件数，超出时删除最旧的 / Profiles kept before the oldest are deleted
+PROFILE_ENV = "PRINTTHESHOT_PROFILE"  # 启动时的剖析设置，如 "render:5,request:0.1" / Profiling at startup, e.g. "render:5,request:0.1"
+RENDER_WORKERS = 0  # 上传渲染的进程数，曲线和打印位图经共享内存传递；0为在处理线程中渲染 / Render processes for uploads, curves and rasters pass through shared memory; 0 renders in the handler thread
+RENDER_TIMEOUT = 60  # 等待渲染进程的秒数，超时后改为在处理线程中渲染 / Seconds to wait for a render process before rendering in the handler thread
+CUPS_QUERY_TIMEOUT = 5  # lpstat/cancel 超时（秒），避免卡住的cupsd阻塞服务器 / Timeout for lpstat/cancel so a wedged cupsd cannot block the server
 received_shots = []
 server_start_time = datetime.now()
 
@@ -115,7 +171,33 @@ LANGUAGES = {
         'chart_bean_info': 'Bean Info',
         'chart_profile_info': 'Profile Info', 
         'chart_tasting_note': 'Tasting Note',
-        'chart_machine_id_label': ''
+        'chart_machine_id_label': '',
+        'export_data': '📦 Export Shots',
+        'export_from': 'From',
+        'export_to': 'To',
+        'export_machine': 'Machine ID',
+        'export_include_images': 'Include charts (ZIP only)',
+        'export_download': 'Download Export',
+        'profiling': '🔬 Profiling',
+        'profile_renders': 'Renders',
+        'profile_requests': 'Requests',
+        'profile_next': 'Next',
+        'profile_sample': 'Sample rate',
+        'profile_apply': 'Apply',
+        'profile_none': 'No profiles yet',
+        'similar_shots': 'Similar Shots',
+        'print_selected': 'Print Selected as One Receipt',
+        'cut_marks': 'Cut marks',
+        'select_shots': 'Select shots to print first',
+        'chart_anomaly': 'Unusual shot',
+        'anomaly_pressure_curve': 'pressure',
+        'anomaly_flow_curve': 'flow',
+        'anomaly_weight_curve': 'coffee flow',
+        'anomaly_duration': 'time',
+        'anomaly_peak_pressure': 'peak pressure',
+        'anomaly_mean_flow': 'mean flow',
+        'anomaly_yield': 'yield',
+        'anomaly_start_temp': 'temp'
     },
     'zh': {
         'queue_status_with_count': '打印队列状态: {} 个任务',
@@ -186,7 +268,33 @@ LANGUAGES = {
         'chart_bean_info': '咖啡豆信息',
         'chart_profile_info': '冲煮方案信息',
         'chart_tasting_note': '品鉴感受',
-        'chart_machine_id_label': ''
+        'chart_machine_id_label': '',
+        'export_data': '📦 导出冲泡数据',
+        'export_from': '开始日期',
+        'export_to': '结束日期',
+        'export_machine': '机器ID',
+        'export_include_images': '包含图表（仅ZIP）',
+        'export_download': '下载导出文件',
+        'profiling': '🔬 性能剖析',
+        'profile_renders': '渲染',
+        'profile_requests': '请求',
+        'profile_next': '接下来',
+        'profile_sample': '抽样比例',
+        'profile_apply': '应用',
+        'profile_none': '暂无剖析结果',
+        'similar_shots': '相似冲泡',
+        'print_selected': '合并打印所选冲泡',
+        'cut_marks': '裁切标记',
+        'select_shots': '请先选择要打印的冲泡',
+        'chart_anomaly': '异常冲泡',
+        'anomaly_pressure_curve': '压力',
+        'anomaly_flow_curve': '流速',
+        'anomaly_weight_curve': '咖啡流速',
+        'anomaly_duration': '时间',
+        'anomaly_peak_pressure': '峰值压力',
+        'anomaly_mean_flow': '平均流速',
+        'anomaly_yield': '出液量',
+        'anomaly_start_temp': '温度'
     }
 }
 
@@ -407,12 +515,12 @@ def install_chinese_fonts_auto(distro_info):
             print("正在安装文泉驿字体...")
             result = subprocess.run(
                 ['sudo', 'apt-get', 'update'],
-                capture_output=True, text=True
+                capture_output=True, text=True, timeout=600
             )
             result = subprocess.run(
                 ['sudo', 'apt-get', 'install', '-y', 
                  'fonts-wqy-microhei', 'fonts-wqy-zenhei', 'fonts-noto-cjk'],
-                capture_output=True, text=True
+                capture_output=True, text=True, timeout=600
             )
             success = result.returncode == 0
             
@@ -421,7 +529,7 @@ def install_chinese_fonts_auto(distro_info):
             result = subprocess.run(
                 ['sudo', 'yum', 'install', '-y',
                  'wqy-microhei-fonts', 'wqy-zenhei-fonts', 'google-noto-sans-cjk-fonts'],
-                capture_output=True, text=True
+                capture_output=True, text=True, timeout=600
             )
             success = result.returncode == 0
             
@@ -430,7 +538,7 @@ def install_chinese_fonts_auto(distro_info):
             result = subprocess.run(
                 ['sudo', 'dnf', 'install', '-y',
                  'wqy-microhei-fonts', 'wqy-zenhei-fonts', 'google-noto-sans-cjk-fonts'],
-                capture_output=True, text=True
+                capture_output=True, text=True, timeout=600
             )
             success = result.returncode == 0
             
@@ -439,7 +547,7 @@ def install_chinese_fonts_auto(distro_info):
             result = subprocess.run(
                 ['sudo', 'pacman', '-S', '--noconfirm',
                  'wqy-microhei', 'wqy-zenhei', 'noto-fonts-cjk'],
-                capture_output=True, text=True
+                capture_output=True, text=True, timeout=600
             )
             success = result.returncode == 0
             
@@ -466,7 +574,7 @@ def install_chinese_fonts_auto(distro_info):
             
             if success:
                 # 更新字体缓存
-                subprocess.run(['fc-cache', '-fv'], capture_output=True)
+                subprocess.run(['fc-cache', '-fv'], capture_output=True, timeout=600)
         
         if success:
             print("✅ 中文字体安装成功！")
@@ -720,6 +828,33 @@ def get_text(key):
         text = text.replace('{VERSION}', VERSION)
     return text
 
+def is_shot_file(filename):
+    """
+    DATA_DIR 中的文件是否为冲泡（排除同目录下的基线文件）
+    Whether a DATA_DIR file is a shot, excluding the baselines file stored alongside
+    """
+    return filename.endswith('.json') and filename != BASELINES_FILE
+
+def new_shot_filename(timestamp, shot_id):
+    """
+    生成并占用不与已有文件冲突的冲泡文件名（同一秒内多次上传时追加序号）
+    Build and reserve a shot filename that does not clash with an existing file (adds a counter for uploads within
+    the same second)
+    
+    文件用 O_CREAT | O_EXCL 原子地创建，并发上传不会选中同一个名字；调用方随后写入这个已占用的文件
+    The file is created atomically with O_CREAT | O_EXCL, so concurrent uploads cannot pick the same name;
+    the caller then writes into the reserved file
+    """
+    filename = f"shot_{timestamp}_{shot_id}.json"
+    suffix = 1
+    while True:
+        try:
+            os.close(os.open(os.path.join(DATA_DIR, filename), os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            return filename
+        except FileExistsError:
+            filename = f"shot_{timestamp}_{shot_id}_{suffix}.json"
+            suffix += 1
+
 def parse_multipart_form_data(post_data, content_type):
     """解析 multipart/form-data 数据，替代弃用的 cgi 模块"""
     """Parse multipart/form-data, replacement for deprecated cgi module"""
@@ -749,152 +884,4295 @@ def parse_multipart_form_data(post_data, content_type):
     except Exception as e:
         raise ValueError(f"Error parsing multipart data: {str(e)}")
 
-class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.semaphore = threading.Semaphore(MAX_USERS)
-        super().__init__(*args, **kwargs)
+def find_chart_font():
+    """查找图表使用的中文字体文件 / Find the CJK-capable font file used for charts"""
+    import matplotlib.font_manager as fm
     
-    def download_json_file(self):
-      """提供JSON文件下载 / Serve JSON file download"""
-      try:
-          # 从URL路径中提取文件名
-          filename = self.path.split('/download/json/')[-1]
-          # 确保是JSON文件
-          if not filename.endswith('.json'):
-              self.send_error(400, "Invalid file type")
-              return
-          
-          filepath = os.path.join(DATA_DIR, filename)
-          
-          if os.path.exists(filepath):
-              self.send_response(200)
-              self.send_header('Content-type', 'application/json')
-              self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-              self.send_header('Content-Length', str(os.path.getsize(filepath)))
-              self.end_headers()
-              
-              with open(filepath, 'rb') as f:
-                  # 分块发送文件，避免内存问题
-                  while chunk := f.read(8192):
-                      self.wfile.write(chunk)
-              print(f"✅ JSON文件已下载: {filename}")
-          else:
-              self.send_error(404, "JSON file not found")
-              
-      except Exception as e:
-          print(f"❌ 下载JSON文件时出错: {e}")
-          self.send_error(500, f"Error downloading JSON file: {str(e)}")
+    # 尝试使用跨平台字体 / Try to use cross-platform fonts
+    font_found = False
+    font_path = None
     
-    def do_GET(self):
-        """处理 GET 请求 - 显示服务状态和管理界面"""
-        """Handle GET requests - show service status and management interface"""
-        with self.semaphore:
-            if self.path == '/':
-                self.show_management_interface()
-            elif self.path == '/api/status':
-                self.send_api_status()
-            elif self.path == '/api/queue':
-                self.send_queue_status()
-            elif self.path.startswith('/images/'):
-                self.serve_image()
-            elif self.path == '/api/shots':
-                self.send_shots_list()
-            elif self.path == '/api/language':
-                self.handle_language_change()
-            elif self.path == '/plugin/plugin.tcl':
-                self.serve_plugin_file()
-            elif self.path == '/api/settings':
-                self.send_settings()
-            elif self.path.startswith('/download/json/'):
-                self.download_json_file()
-            else:
-                super().do_GET()
+    # 常见的中文字体在不同平台的路径 / Common Chinese font paths on different platforms
+    font_candidates = [
+        # Windows 字体 / Windows fonts
+        "C:\\Windows\\Fonts\\simhei.ttf",  # 黑体 / HeiTi
+        "C:\\Windows\\Fonts\\msyh.ttc",    # 微软雅黑 / Microsoft YaHei
+        "C:\\Windows\\Fonts\\simsun.ttc",  # 宋体 / SongTi
+        
+        # macOS 字体 / macOS fonts
+        "/System/Library/Fonts/PingFang.ttc",      # 苹方 / PingFang
+        "/System/Library/Fonts/STHeiti Light.ttc", # 黑体-简 / HeiTi Simplified
+        "/System/Library/Fonts/STHeiti Medium.ttc",
+        
+        # Linux 字体 / Linux fonts (usually install WenQuanYi)
+        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",  # 文泉驿微米黑
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",  # Noto Sans CJK
+        
+        # 尝试更通用的路径 / Try more general paths
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # 备用字体，至少显示方框 / Fallback font
+    ]
+    
+    # 首先尝试找到可用的中文字体 / First try to find available Chinese font
+    for candidate in font_candidates:
+        if os.path.exists(candidate):
+            font_path = candidate
+            font_found = True
+            print(f"✅ Found font file: {candidate}")
+            break
+    
+    # 如果没找到字体文件，尝试使用系统默认字体 / If no font found, try system default fonts
+    if not font_found:
+        try:
+            # 查找系统中可用的中文字体 / Find available Chinese fonts in system
+            fonts = [f for f in fm.findSystemFonts() if any(keyword in f.lower() for keyword in ['chinese', 'cjk', 'hei', 'song', 'msyh', 'pingfang', 'noto'])]
+            if fonts:
+                font_path = fonts[0]
+                font_found = True
+                print(f"✅ Found system font: {font_path}")
+        except:
+            pass
+    
+    return font_path if font_found else None
 
-    def do_POST(self):
-        """处理 POST 请求 - 接收上传的冲泡数据"""
-        """Handle POST requests - receive uploaded shot data"""
-        with self.semaphore:
-            if self.path == '/upload' or self.path.startswith('/upload'):
-                try:
-                    content_type = self.headers.get('Content-Type', '')
-                    content_length = int(self.headers.get('Content-Length', 0))
-                    post_data = self.rfile.read(content_length)
-                    
-                    if 'application/json' in content_type:
-                        self.handle_json_upload(post_data)
-                    elif 'multipart/form-data' in content_type:
-                        self.handle_multipart_upload(post_data, content_type)
-                    else:
-                        self.send_error(400, "Unsupported content type")
-                        
-                except Exception as e:
-                    print(f"❌ 处理上传时出错 / Error processing upload: {e}")
-                    self.send_error(500, f"Server error: {str(e)}")
-                    
-            elif self.path == '/api/print':
-                self.handle_print_control()
-            elif self.path == '/api/language':
-                self.handle_language_change()
-            elif self.path == '/api/settings/beaninfo':
-                self.handle_beaninfo_setting()
-            else:
-                self.send_error(404, "Endpoint not found")
+TEXT_WRAP_MAX_LINES = 12  # 每段文字最多行数，超出以"..."结尾 / Max lines per wrapped text, "..." marks the cut
+TEXT_WRAP_CACHE_SIZE = 512  # 每个排版器记忆的换行结果数（LRU）/ Wrap results memoized per layout (LRU)
 
-    def do_DELETE(self):
-        """处理DELETE请求 - 清空打印队列"""
-        """Handle DELETE requests - clear print queue"""
-        with self.semaphore:
-            if self.path == '/api/queue':
-                self.handle_clear_queue()
+# 可逐字断行的中日韩字符，以及不能出现在行首/行尾的标点
+# CJK characters that may break anywhere, and punctuation that must not start / end a line
+CJK_CHARS = '\u2e80-\u2fff\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef'
+TEXT_TOKEN_RE = re.compile(f"\\n|[^\\S\\n]+|[{CJK_CHARS}]|[^\\s{CJK_CHARS}-]+-*|-+")
+NO_LINE_START = set('，。、；：！？）」』】》〉,.;:!?)]}%')
+NO_LINE_END = set('（「『【《〈([{')
+
+class TextLayout:
+    """
+    按字体真实字宽换行的排版器，每个 (字体, 字号) 一个实例
+    Line breaker driven by the font's real advance widths, one instance per (font, size)
+    
+    字宽按字符缓存，换行结果按 (文本, 列, 语言) 记忆在有上限的LRU中，重复的方案和豆子文字几乎不耗时
+    Advance widths are cached per character and wraps are memoized per (text, column, language) in a bounded
+    LRU, so repeated profile and bean text costs next to nothing
+    """
+    def __init__(self, font_path, size_px):
+        from matplotlib.ft2font import FT2Font
+        self.font = FT2Font(font_path)
+        self.font.set_size(size_px, 72)  # 72 dpi 时点数即像素 / At 72 dpi points are pixels
+        self.size_px = size_px
+        self.widths = {}
+        self.wraps = OrderedDict()
+        self.wraps_lock = threading.Lock()
+        self.lock = threading.Lock()  # FT2Font 不是线程安全的 / FT2Font is not thread-safe
+    
+    def measure(self, text):
+        """文字的前进宽度（像素）/ Advance width of a string in pixels"""
+        width = 0.0
+        for char in text:
+            advance = self.widths.get(char)
+            if advance is None:
+                with self.lock:
+                    index = self.font.get_char_index(ord(char))
+                    advance = self.font.load_glyph(index).linearHoriAdvance / 65536
+                if index == 0 and unicodedata.east_asian_width(char) in ('W', 'F'):
+                    # 字体缺字时由后备字体绘制，全角字符按一个字号宽计算
+                    # Missing glyphs are drawn by a fallback font; full-width characters take one em
+                    advance = self.size_px
+                self.widths[char] = advance
+            width += advance
+        return width
+    
+    def _tokens(self, text):
+        """切分为可断行的片段，并按避头尾规则粘连标点 / Split into breakable pieces, gluing punctuation by line-start/end rules"""
+        tokens = []
+        for piece in TEXT_TOKEN_RE.findall(text):
+            previous = tokens[-1] if tokens else ''
+            if previous and not previous.isspace() and (piece[0] in NO_LINE_START or previous[-1] in NO_LINE_END) \
+                    and not piece.isspace():
+                tokens[-1] = previous + piece
             else:
-                self.send_error(404, "Endpoint not found")
+                tokens.append(piece)
+        return tokens
+    
+    def _wrap(self, text, max_width):
+        lines = []
+        line, width = '', 0.0
+        space = self.measure(' ')
+        for token in self._tokens(text):
+            if token == '\n':
+                lines.append(line.rstrip())
+                line, width = '', 0.0
+                continue
+            if token.isspace():
+                if line:
+                    line, width = line + ' ', width + space
+                continue
+            token_width = self.measure(token)
+            if line.strip() and width + token_width > max_width:
+                lines.append(line.rstrip())
+                line, width = '', 0.0
+            if token_width > max_width:
+                # 超宽的单词按字符断开 / Break an over-wide word by character
+                for char in token:
+                    char_width = self.measure(char)
+                    if line.strip() and width + char_width > max_width:
+                        lines.append(line.rstrip())
+                        line, width = '', 0.0
+                    line, width = line + char, width + char_width
+            else:
+                line, width = line + token, width + token_width
+        if line.strip():
+            lines.append(line.rstrip())
+        if len(lines) > TEXT_WRAP_MAX_LINES:
+            lines = lines[:TEXT_WRAP_MAX_LINES] + ['...']
+        return lines
+    
+    def wrap(self, text, max_width, column=None, language=None):
+        """
+        把文字按像素宽度断行 / Break text into lines that fit max_width pixels
+        
+        结果按 (文本, 列, 语言, 宽度) 记忆，最多 TEXT_WRAP_CACHE_SIZE 条，淘汰最久未用的
+        Results are memoized per (text, column, language, width), up to TEXT_WRAP_CACHE_SIZE entries with the
+        least recently used evicted first
+        """
+        if not text:
+            return []
+        key = (text, column, language, round(max_width))
+        with self.wraps_lock:
+            lines = self.wraps.get(key)
+            if lines is not None:
+                self.wraps.move_to_end(key)
+        if lines is None:
+            lines = self._wrap(str(text), max_width)
+            with self.wraps_lock:
+                self.wraps[key] = lines
+                if len(self.wraps) > TEXT_WRAP_CACHE_SIZE:
+                    self.wraps.popitem(last=False)
+        return list(lines)
 
-    def handle_language_change(self):
-        """处理语言切换请求 / Handle language change requests"""
-        global current_language
+text_layouts = {}
+text_layouts_lock = threading.Lock()
+
+def get_text_layout(font_path, size_px):
+    """获取 (字体, 字号) 对应的排版器（缓存）/ Get the cached layout engine for a (font, size)"""
+    key = (font_path, round(size_px, 2))
+    with text_layouts_lock:
+        layout = text_layouts.get(key)
+        if layout is None:
+            layout = text_layouts[key] = TextLayout(font_path, size_px)
+        return layout
+
+# ============ 两个渲染引擎共用的小票布局 ============
+# Receipt layout shared by both rendering engines
+RECEIPT_COLUMN_RATIOS = [0.65, 0.12, 0.23]  # 曲线图、冲煮信息、豆子/方案信息 / Chart, brew info, bean/profile info
+RECEIPT_COLUMN_SPACE = 0.2
+# matplotlib 默认的子图边距（图宽/图高的比例）/ matplotlib's default subplot margins, as fractions of the figure
+RECEIPT_MARGINS = {'left': 0.125, 'right': 0.9, 'bottom': 0.11, 'top': 0.88}
+RECEIPT_LINE_HEIGHT = 0.05  # 文字列行距（列高的比例）/ Text column line spacing, as a fraction of the column height
+RECEIPT_SEPARATOR = "──────"
+TASTING_NOTE_FROM_JSON = "Tasting Note (from JSON):"
+
+def receipt_columns():
+    """
+    按 GridSpec 的算法计算三列的 (x0, 宽度)，与 matplotlib 布局逐像素一致
+    (x0, width) of the three columns, computed the way GridSpec does so both engines agree to the pixel
+    """
+    n = len(RECEIPT_COLUMN_RATIOS)
+    cell = (RECEIPT_MARGINS['right'] - RECEIPT_MARGINS['left']) / (n + RECEIPT_COLUMN_SPACE * (n - 1))
+    norm = cell * n / sum(RECEIPT_COLUMN_RATIOS)
+    columns = []
+    x0 = RECEIPT_MARGINS['left']
+    for ratio in RECEIPT_COLUMN_RATIOS:
+        columns.append((x0, ratio * norm))
+        x0 += ratio * norm + RECEIPT_COLUMN_SPACE * cell
+    return columns
+
+def receipt_column_widths(fig_width, pad):
+    """
+    两个文字列可用于换行的像素宽度：第一列到第二列起点为止，第二列到图边为止
+    Wrap widths in pixels: column 1 ends where column 2 begins, column 2 at the figure edge
+    """
+    _, (col1_x0, col1_width), (col2_x0, col2_width) = receipt_columns()
+    return {
+        1: (col2_x0 - col1_x0 - 0.05 * col1_width) * fig_width - pad,
+        2: (1 - col2_x0 - 0.01 * col2_width) * fig_width - pad
+    }
+
+def receipt_chart_texts():
+    """当前语言的图表文本 / Chart text for the current language"""
+    return {
+        'pressure_label': f"{get_text('chart_pressure')} ({get_text('chart_pressure_unit')})",
+        'flow_label': f"{get_text('chart_flow')} ({get_text('chart_flow_unit')})",
+        'temp_label': f"{get_text('chart_temperature')} ({get_text('chart_temperature_unit')})",
+        'water_flow': get_text('chart_water_flow'),
+        'coffee_flow': get_text('chart_coffee_flow'),
+        'pressure': get_text('chart_pressure'),
+        'basket_temp': get_text('chart_temperature'),
+        'date_time_title': get_text('chart_date_time'),
+        'profile_title': get_text('chart_profile'),
+        'extraction_title': get_text('chart_extraction'),
+        'grinder_temp_title': get_text('chart_grinder_temp'),
+        'in_weight_label': get_text('chart_in_weight'),
+        'out_weight_label': get_text('chart_out_weight'),
+        'shot_time_label': get_text('chart_shot_time'),
+        'grind_label': get_text('chart_grind_setting'),
+        'initial_temp_label': get_text('chart_initial_temp'),
+        'unknown_profile': get_text('chart_unknown_profile'),
+        'na': get_text('chart_na'),
+        'time_label': f"{get_text('chart_time')} ({get_text('chart_time_unit')})",
+        'bean_info': get_text('chart_bean_info'),
+        'profile_info': get_text('chart_profile_info'),  # 新增
+        'tasting_note': get_text('chart_tasting_note'),
+    }
+
+def receipt_series(data, series=None):
+    """
+    提取并对齐曲线数据，返回NumPy数组 / Extract the curves as NumPy arrays, trimmed to a common length
+
+    series: 上传时已由 load_shot_series 转换好的曲线，避免重复转换
+    Curves already converted by load_shot_series at upload, so they are not converted again
+    """
+    if series is None:
+        series = load_shot_series(data)
+    return (series['elapsed'], series['pressure'], series['flow'], series['flow_by_weight'], series['basket_temp'])
+
+def receipt_bean_info(data):
+    """
+    智能判断是否显示豆子信息，返回 (是否有豆子信息, 豆子数据)
+    Decide whether bean info can be shown; returns (has_bean_info, bean_data)
+    """
+    has_bean_info = False
+    bean_data = {}
+
+    try:
+        bean_data = data.get('meta', {}).get('bean', {})
+        # 检查是否有有效的豆子信息（至少包含brand、type或notes字段）
+        # Check if valid bean info exists (at least contains brand, type or notes field)
+        if (bean_data and
+            (bean_data.get('brand') or bean_data.get('type') or bean_data.get('notes'))):
+            has_bean_info = True
+            print(f"✅ Found bean info in JSON: {bean_data.get('brand', 'Unknown')}")
+    except Exception as e:
+        print(f"⚠️ Error checking bean info: {e}")
+        has_bean_info = False
+
+    # 记录日志以便调试 / Log for debugging
+    if BEAN_INFO_ENABLED and not has_bean_info:
+        print(f"⚠️ Bean info setting is enabled but no bean data found in JSON")
+    elif has_bean_info and not BEAN_INFO_ENABLED:
+        print(f"ℹ️ Bean data exists but global setting is disabled")
+    elif BEAN_INFO_ENABLED and has_bean_info:
+        print(f"✅ Will display bean info from JSON")
+    return has_bean_info, bean_data
+
+def receipt_text_columns(data, chart_texts, basket_temp, wrap_text):
+    """
+    构建两个文字列的内容，wrap_text(text, column_num) 按列宽换行
+    Build the lines of both text columns; wrap_text(text, column_num) wraps to a column's width
+
+    返回 / Returns: (text_content1, text_content2)
+    """
+    has_bean_info, bean_data = receipt_bean_info(data)
+
+    # ============ 第一列文本处理（冲煮方案等） ============
+    # First column text processing (brew profile etc.)
+    # 获取冲煮方案名称 / Get profile name
+    profile_title = data['profile'].get('title', 'Unknown Profile')
+    # 使用智能换行 / Use smart wrapping
+    profile_lines = wrap_text(profile_title, column_num=1)
+
+    # 获取冲泡参数 / Get brew parameters
+    in_weight = data['meta'].get('in', 'N/A')
+    out_weight = data['meta'].get('out', 'N/A')
+    shot_time = data['meta'].get('time', 'N/A')
+    grinder_setting = data['meta'].get('grinder', {}).get('setting', 'N/A')
+
+    # 日期时间处理 / Date time processing
+    date_str = data.get('date', '')
+    timestamp = data.get('timestamp', '')
+
+    if timestamp:
+        try:
+            date_obj = datetime.fromtimestamp(float(timestamp))
+            formatted_date = date_obj.strftime('%Y-%m-%d')
+            formatted_time = date_obj.strftime('%H:%M:%S')
+        except:
+            formatted_date = 'N/A'
+            formatted_time = 'N/A'
+    elif date_str:
+        try:
+            date_obj = datetime.strptime(date_str, '%a %b %d %H:%M:%S %Y')
+            formatted_date = date_obj.strftime('%Y-%m-%d')
+            formatted_time = date_obj.strftime('%H:%M:%S')
+        except:
+            formatted_date = 'N/A'
+            formatted_time = 'N/A'
+    else:
+        formatted_date = 'N/A'
+        formatted_time = 'N/A'
+
+    initial_basket_temp = basket_temp[0]
+
+    # 构建第一列文本内容 / Build first column text content
+    text_content1 = []
+    text_content1.append(chart_texts['date_time_title'])
+    text_content1.append(RECEIPT_SEPARATOR)
+    text_content1.append(formatted_date)
+    text_content1.append(formatted_time)
+    text_content1.append("")
+    text_content1.append(chart_texts['profile_title'])
+    text_content1.append(RECEIPT_SEPARATOR)
+
+    # 添加冲煮方案（可能有多行）/ Add profile (may have multiple lines)
+    if profile_lines:
+        for line in profile_lines:
+            text_content1.append(line)
+    else:
+        text_content1.append(profile_title[:12])
+    text_content1.append("")
+
+    text_content1.append(chart_texts['extraction_title'])
+    text_content1.append(RECEIPT_SEPARATOR)
+    text_content1.append(f"{chart_texts['in_weight_label']}: {in_weight}g")
+    text_content1.append(f"{chart_texts['out_weight_label']}: {out_weight}g")
+    text_content1.append(f"{chart_texts['shot_time_label']}: {shot_time}s")
+    text_content1.append("")
+
+    text_content1.append(chart_texts['grinder_temp_title'])
+    text_content1.append(RECEIPT_SEPARATOR)
+    text_content1.append(f"{chart_texts['grind_label']}: {grinder_setting}")
+    text_content1.append(f"{chart_texts['initial_temp_label']}: {initial_basket_temp:.1f}°C")
+
+    # ============ 第二列文本处理（智能选择豆子信息或方案信息） ============
+    # Second column text processing (intelligent choice between bean info or profile info)
+    text_content2 = []
+
+    if has_bean_info:
+        # 有豆子信息：显示Bean Info / Has bean info: display Bean Info
+        title = chart_texts['bean_info']
+        print(f"📝 Displaying bean info: {bean_data.get('brand', 'Unknown')}")
+    else:
+        # 没有豆子信息：显示Profile Info / No bean info: display Profile Info
+        title = chart_texts['profile_info']
+        print(f"📝 No bean info found, displaying profile info")
+
+    text_content2.append(title)
+    text_content2.append(RECEIPT_SEPARATOR)
+
+    if has_bean_info:
+        # 构建豆子信息显示行 / Build bean info display lines
+        # 第一行：品牌和品种 / Line 1: Brand and type
+        brand = bean_data.get('brand', '')
+        bean_type = bean_data.get('type', '')
+        if brand and bean_type:
+            line1 = f"{brand} - {bean_type}"
+        elif brand:
+            line1 = brand
+        elif bean_type:
+            line1 = bean_type
+        else:
+            line1 = ""
+
+        # 第二行：风味描述 / Line 2: Flavor notes
+        line2 = bean_data.get('notes', '')
+
+        # 第三行：烘焙度和日期 / Line 3: Roast level and date
+        roast_info = []
+        if bean_data.get('roast_level'):
+            roast_info.append(bean_data['roast_level'])
+        if bean_data.get('roast_date'):
+            roast_date = bean_data['roast_date']
+            # 格式化日期：YYYYMMDD -> YYYY-MM-DD / Format date: YYYYMMDD -> YYYY-MM-DD
+            if len(roast_date) == 8 and roast_date.isdigit():
+                formatted_date = f"{roast_date[:4]}-{roast_date[4:6]}-{roast_date[6:8]}"
+                roast_info.append(formatted_date)
+        line3 = ' '.join(roast_info)
+
+        # 处理每一行文本（使用智能换行）/ Process each line (using smart wrapping)
+        for line in [line1, line2, line3]:
+            if line:  # 只处理非空行 / Only process non-empty lines
+                wrapped_lines = wrap_text(line, column_num=2)
+                for wrapped_line in wrapped_lines:
+                    text_content2.append(wrapped_line)
+                # text_content2.append("")  # 行间空行 / Empty line between lines
+
+        # 检查是否有JSON提供的品尝笔记 / Check if there are tasting notes from JSON
+        shot_data = data.get('meta', {}).get('shot', {})
+        shot_notes = shot_data.get('notes', '')
+
+        if shot_notes:
+            # 如果有JSON提供的品尝笔记，也添加到豆子信息部分
+            # If there are tasting notes from JSON, also add them to bean info section
+            text_content2.append(TASTING_NOTE_FROM_JSON)
+            text_content2.append(RECEIPT_SEPARATOR)
+            tasting_lines = wrap_text(shot_notes, column_num=2)
+            for tasting_line in tasting_lines:
+                text_content2.append(tasting_line)
+            text_content2.append("")  # 空行分隔 / Empty line separator
+
+    else:
+        # 显示方案信息（profile notes）/ Display profile info (profile notes)
+        notes = data['profile'].get('notes', '')
+
+        if notes:
+            # 处理profile notes（使用智能换行）/ Process profile notes (using smart wrapping)
+            notes_lines = wrap_text(notes, column_num=2)
+
+            for line in notes_lines:
+                text_content2.append(line)
+        else:
+            text_content2.append(chart_texts['na'])
+
+    # ============ 固定添加品尝笔记区域（供用户手写） ============
+    # Fixed add tasting note area (for user to write manually)
+    text_content2.append("")  # 空行分隔 / Empty line separator
+    text_content2.append(chart_texts['tasting_note'])
+    text_content2.append(RECEIPT_SEPARATOR)
+    # 留出空白行供用户填写 / Leave blank lines for user to fill in
+    text_content2.append("")  # 空白行1 / Blank line 1
+    text_content2.append("")  # 空白行2 / Blank line 2
+    text_content2.append("")  # 空白行3 / Blank line 3
+    text_content2.append("")  # 空白行4 / Blank line 4
+    return text_content1, text_content2
+
+def receipt_text_rows(lines, headings):
+    """
+    逐行给出 (文本, 列内纵坐标, 是否标题)，纵坐标为列高比例，从顶部 0.98 开始
+    Yield (text, y, is_heading) per line; y is a fraction of the column height, starting at 0.98 from the top
+    """
+    y_position = 0.98
+    for text in lines:
+        if text == RECEIPT_SEPARATOR:
+            y_position -= RECEIPT_LINE_HEIGHT * 0.5  # 分隔线后的间距小一些 / Smaller spacing after separator
+        elif text == "":
+            y_position -= RECEIPT_LINE_HEIGHT * 0.3  # 空行间距 / Empty line spacing
+        yield text, y_position, text in headings
+        y_position -= RECEIPT_LINE_HEIGHT
+
+def create_coffee_plot(input_file, output_file, machine_id='UNKNOWN', anomaly=None, raster_file=None, paper=None,
+                       renderer=None, data=None, series=None):
+    """
+    Create black and white bitmap suitable for receipt printer from Decent espresso machine JSON data
+    从Decent咖啡机JSON数据创建适合小票打印机的黑白位图
+    
+    anomaly: 异常原因列表，非空时在图表上标记 / List of anomaly reasons, flagged on the chart when non-empty
+    raster_file: 同时按打印机原生点宽输出1位打印位图 / Also write the 1-bit print raster at the printer's native dot width
+    paper: 纸张规格名，默认 PAPER_PROFILE / Paper profile name, PAPER_PROFILE by default
+    output_file 为 None 时只生成打印位图 / Only the print raster is written when output_file is None
+    renderer: 渲染引擎，默认 RENDERER / Rendering engine, RENDERER by default
+    data, series: 上传时已解析的冲泡和曲线数组（见 parse_shot_upload），提供时不再读取 input_file
+                  Shot and curve arrays already parsed at upload (see parse_shot_upload); input_file is not re-read when given
+    """
+    if (renderer or RENDERER) == 'pillow':
+        return create_coffee_plot_pillow(input_file, output_file, machine_id, anomaly, raster_file, paper, data, series)
+    # pyplot 的当前图形和 rcParams 是进程全局的，多个线程同时渲染会互相破坏
+    # pyplot's current figure and rcParams are process-wide, so concurrent renders in several threads corrupt each other
+    with pyplot_lock:
+        return create_coffee_plot_matplotlib(input_file, output_file, machine_id, anomaly, raster_file, paper,
+                                             data, series)
+
+pyplot_lock = threading.Lock()
+
+def create_coffee_plot_matplotlib(input_file, output_file, machine_id='UNKNOWN', anomaly=None, raster_file=None,
+                                  paper=None, data=None, series=None):
+    """
+    matplotlib 渲染引擎，调用者持有 pyplot_lock（见 create_coffee_plot）
+    The matplotlib engine; the caller holds pyplot_lock (see create_coffee_plot)
+    """
+    try:
+        clock = StageClock()
+        matplotlib.rcdefaults()
+        print(f"📊 Generating chart: {input_file}")
         
-        if self.command == 'GET':
-            # 返回当前语言设置
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'language': current_language}).encode('utf-8'))
-            
-        elif self.command == 'POST':
-            # 切换语言
+        # ============ 设置图表文本（根据当前语言） ============
+        # Set chart text (based on current language)
+        chart_texts = receipt_chart_texts()
+        
+        # ============ 设置中文字体支持 ============
+        # Setup Chinese font support
+        import matplotlib.font_manager as fm
+        
+        font_path = find_chart_font()
+        font_found = font_path is not None
+        
+        if data is None:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        
+        # 数据提取和处理（保持不变） / Data extraction and processing (unchanged)
+        elapsed, pressure, flow, flow_by_weight, basket_temp = receipt_series(data, series)
+        min_length = len(elapsed)
+        clock.lap('render.load')
+        
+        # 在创建图表之前设置字体（重要！）/ Set font before creating chart (important!)
+        if font_found and font_path:
             try:
-                content_length = int(self.headers.get('Content-Length', 0))
-                post_data = self.rfile.read(content_length)
-                request_data = json.loads(post_data.decode('utf-8'))
+                # 添加字体到matplotlib / Add font to matplotlib
+                fm.fontManager.addfont(font_path)
+                font_prop = fm.FontProperties(fname=font_path)
+                font_name = font_prop.get_name()
                 
-                lang = request_data.get('language', 'zh')
-                if lang in LANGUAGES:
-                    current_language = lang
-                    
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    'success': True, 
-                    'language': current_language
-                }).encode('utf-8'))
+                # 设置matplotlib使用这个字体 / Set matplotlib to use this font
+                matplotlib.rcParams['font.sans-serif'] = [font_name]
+                matplotlib.rcParams['axes.unicode_minus'] = False
                 
+                print(f"✅ Using font: {font_name}")
             except Exception as e:
-                self.send_error(500, f"Language change error: {str(e)}")
-                
-    def send_settings(self):
-        """发送当前设置"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
+                print(f"⚠️ Font setup failed: {e}")
+                # 设置回退方案 / Setup fallback
+                matplotlib.rcParams['font.sans-serif'] = ['DejaVu Sans', 'Arial Unicode MS', 'SimHei', 'Microsoft YaHei']
+                matplotlib.rcParams['axes.unicode_minus'] = False
+        else:
+            # 回退方案：设置常见的中文字体名称 / Fallback: set common Chinese font names
+            if is_windows():
+                matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial']
+            elif platform.system() == 'Darwin':  # macOS
+                matplotlib.rcParams['font.sans-serif'] = ['PingFang TC', 'Heiti SC', 'Arial Unicode MS']
+            else:  # Linux
+                matplotlib.rcParams['font.sans-serif'] = ['WenQuanYi Micro Hei', 'DejaVu Sans', 'Arial']
+            matplotlib.rcParams['axes.unicode_minus'] = False
+        clock.lap('render.font')
         
-        settings = {
-            'bean_info_enabled': BEAN_INFO_ENABLED,
-            'print_enabled': PRINT_ENABLED,
-            'max_users': MAX_USERS
-        }
+        print(f"  Data length: {min_length} samples")
         
-        self.wfile.write(json.dumps(settings).encode('utf-8'))
+        # 图表尺寸按纸张规格计算，画布高度即打印机点宽 / Chart size from the paper profile; canvas height is the printer's dot width
+        profile = PAPER_PROFILES[paper or PAPER_PROFILE]
+        multiplier = profile['dots'] / 576
+        width_px = profile['dots']
+        height_px = int(width_px * 180 / 80)
+        dpi = profile['dpi']
+        fig_width = width_px / dpi
+        fig_height = height_px / dpi
+        
+        fig = plt.figure(figsize=(fig_height, fig_width), dpi=dpi)
+
+        font_m = 8 * multiplier
+        font_l = 10 * multiplier
+        
+        # ============ 创建图表布局 ============
+        # Create chart layout
+        # 总是创建三列网格（即使不显示豆子信息，也保留空间）
+        # Always create three-column grid (reserve space even if not displaying bean info)
+        gs = plt.GridSpec(1, 3, width_ratios=RECEIPT_COLUMN_RATIOS, wspace=RECEIPT_COLUMN_SPACE)
+        
+        ax_left = fig.add_subplot(gs[0])
+        ax_right = ax_left.twinx()
+        ax_temp = ax_left.twinx()
+        
+        # 添加机器ID标签（如果存在）/ Add machine ID label (if exists)
+        if machine_id != 'UNKNOWN':
+            machine_label = get_text('chart_machine_id_label')
+            fig.text(0.03, 0.0, f"{machine_label}: {machine_id}",
+                    fontsize=font_m * 0.8,
+                    verticalalignment='bottom',
+                    horizontalalignment='left',
+                    bbox=dict(boxstyle='round,pad=0.2', 
+                              facecolor='white', 
+                              alpha=0.7,
+                              edgecolor='black',
+                              linewidth=0.5))
+        
+        ax_text1 = fig.add_subplot(gs[1])  # 第一列文本（冲煮信息）/ First column text (brew info)
+        ax_text1.axis('off')
+        
+        # 总是创建第二列区域（豆子信息或方案信息）
+        # Always create second column area (bean info or profile info)
+        ax_text2 = fig.add_subplot(gs[2])
+        ax_text2.axis('off')
+        
+        # 设置温度轴位置 / Set temperature axis position
+        ax_temp.spines['left'].set_position(('axes', -0.10))
+        ax_temp.yaxis.set_ticks_position('left')
+        ax_temp.yaxis.set_label_position('left')
+        
+        # 绘图线条设置 / Plot line settings
+        line_width = 1.25 * multiplier
+        
+        # 绘制曲线 / Draw curves
+        ax_left.plot(elapsed, pressure, linestyle='-', linewidth=line_width, 
+                    label=chart_texts['pressure'], color='black')
+        ax_right.plot(elapsed, flow, linestyle='--', linewidth=line_width, 
+                      label=chart_texts['water_flow'], color='black')
+        ax_right.plot(elapsed, flow_by_weight, linestyle=':', linewidth=line_width, 
+                      label=chart_texts['coffee_flow'], color='black')
+        ax_temp.plot(elapsed, basket_temp, 
+                    linestyle='-.', linewidth=line_width, 
+                    label=chart_texts['basket_temp'], color='black')
+        
+        # 设置坐标轴范围和标签 / Set axis ranges and labels
+        ax_left.set_ylim(0, 10)  # 压力固定在0-10 / Pressure fixed 0-10
+        ax_left.set_ylabel(chart_texts['pressure_label'], fontsize=font_m)
+        ax_left.yaxis.set_label_coords(-0.05, 0.5)
+
+        ax_right.set_ylim(0, 10)  # 流速固定在0-10 / Flow rate fixed 0-10
+        ax_right.set_ylabel(chart_texts['flow_label'], fontsize=font_m)
+        ax_right.yaxis.set_label_coords(1.06, 0.5)
+
+        ax_temp.set_ylim(0, 100)  # 温度固定在0-100度 / Temperature fixed 0-100
+        ax_temp.set_ylabel(chart_texts['temp_label'], fontsize=font_m)
+        ax_temp.yaxis.set_label_coords(-0.18, 0.5)
+
+        # 添加图例 / Add legend
+        legend_fontsize = font_m * 0.8
+        lines_left, labels_left = ax_left.get_legend_handles_labels()
+        lines_right, labels_right = ax_right.get_legend_handles_labels()
+        lines_temp, labels_temp = ax_temp.get_legend_handles_labels()
+        
+        all_lines = lines_left + lines_right + lines_temp
+        all_labels = labels_left + labels_right + labels_temp
+        
+        ax_left.legend(all_lines, all_labels, 
+          fontsize=legend_fontsize, loc='lower center', frameon=True, 
+          fancybox=False, framealpha=0.0,
+          ncol=4,
+          bbox_to_anchor=(0.5, -0.18))
+        
+        # 添加网格 / Add grid
+        ax_left.grid(True, linestyle='--', alpha=0.6, linewidth=line_width / 2, color='black')
+        
+        # 异常冲泡标记 / Unusual shot flag
+        if anomaly:
+            reasons = ', '.join(get_text(f'anomaly_{reason}') for reason in anomaly)
+            ax_left.text(0.02, 0.97, f"!! {get_text('chart_anomaly')}: {reasons}",
+                         fontsize=font_m, weight='bold', ha='left', va='top',
+                         transform=ax_left.transAxes, zorder=10,
+                         bbox=dict(boxstyle='square,pad=0.2', facecolor='white',
+                                   edgecolor='black', linewidth=line_width))
+        
+        # 设置刻度标签大小 / Set tick label size
+        ax_left.tick_params(axis='both', which='major', labelsize=font_m)
+        ax_right.tick_params(axis='y', which='major', labelsize=font_m)
+        ax_temp.tick_params(axis='y', which='major', labelsize=font_m)
+        
+        # 设置边框线宽 / Set border line width
+        for spine in ax_left.spines.values():
+            spine.set_linewidth(line_width)
+        for spine in ax_right.spines.values():
+            spine.set_linewidth(line_width)
+        for spine in ax_temp.spines.values():
+            spine.set_linewidth(line_width)
+        
+        # ============ 按列的实际宽度换行 ============
+        # Wrap to each column's real width in pixels: column 1 ends where column 2 begins, column 2 at the figure edge
+        layout = get_text_layout(fm.findfont(fm.FontProperties()), font_m * dpi / 72)
+        column_widths = receipt_column_widths(fig.bbox.width, layout.size_px * 0.5)
+        
+        def wrap_text(text, column_num=1):
+            """按字宽换行，结果会被记忆 / Wrap by measured width; results are memoized"""
+            return layout.wrap(text, column_widths[column_num], column_num, current_language)
+        
+        text_content1, text_content2 = receipt_text_columns(data, chart_texts, basket_temp, wrap_text)
+        
+        # 绘制第一列文本 / Draw first column text
+        headings1 = {chart_texts['date_time_title'], chart_texts['profile_title'],
+                     chart_texts['extraction_title'], chart_texts['grinder_temp_title']}
+        for text, y_position, heading in receipt_text_rows(text_content1, headings1):
+            ax_text1.text(0.05, y_position, text, 
+                        fontsize=font_l if heading else font_m, ha='left', va='top',
+                        transform=ax_text1.transAxes,
+                        weight='bold' if heading else 'normal')
+        
+        # 绘制第二列文本 / Draw second column text
+        headings2 = {chart_texts['bean_info'], chart_texts['profile_info'],
+                     chart_texts['tasting_note'], TASTING_NOTE_FROM_JSON}
+        for text, y_position, heading in receipt_text_rows(text_content2, headings2):
+            ax_text2.text(0.01, y_position, text,
+                        fontsize=font_l if heading else font_m, ha='left', va='top',
+                        transform=ax_text2.transAxes,
+                        weight='bold' if heading else 'normal')
+        
+        # 保存图表 / Save chart
+        clock.lap('render.figure')
+        plt.tight_layout(pad=0.5)
+        clock.lap('render.layout')
+        if output_file:
+            plt.savefig(output_file, dpi=dpi, bbox_inches='tight', 
+                        facecolor='white', edgecolor='none',
+                        pad_inches=0.1)
+            clock.lap('render.savefig')
+        if raster_file:
+            # 直接从画布生成原生点宽的打印位图，无需再缩放；在PNG之后写入，使其不早于图表
+            # Rasterize straight from the canvas at native dot width, no rescaling; written after the PNG so it is never older
+            fig.canvas.draw()
+            canvas = Image.frombuffer('RGBA', fig.canvas.get_width_height(), fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            save_print_raster(canvas.convert('L').rotate(90, expand=True), raster_file)
+            clock.lap('render.raster')
+        plt.close(fig)
+        clock.done('render')
+        
+        print(f"✅ Chart generated: {output_file or raster_file}")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Chart generation failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+# matplotlib 的线型（以线宽为单位的点长度），Pillow 引擎按同样比例画虚线
+# matplotlib's line styles (lengths in points per point of line width), reproduced by the Pillow engine
+RECEIPT_DASHES = {'-': None, '--': (3.7, 1.6), ':': (1, 1.65), '-.': (6.4, 1.6, 1, 1.6)}
+RECEIPT_TICK_STEPS = [1, 2, 2.5, 5, 10]  # 与 matplotlib 自动刻度相同的步长 / Same steps as matplotlib's AutoLocator
+
+pillow_fonts = {}
+pillow_fonts_lock = threading.Lock()
+
+def get_pillow_font(font_path, size_px):
+    """获取缓存的 Pillow 字体 / Get a cached Pillow font"""
+    key = (font_path, round(size_px, 2))
+    with pillow_fonts_lock:
+        font = pillow_fonts.get(key)
+        if font is None:
+            font = pillow_fonts[key] = ImageFont.truetype(font_path, size_px)
+        return font
+
+receipt_font_files = {}  # 图表字体 -> (常规, 粗体) 文件 / chart font -> (regular, bold) files
+receipt_font_files_lock = threading.Lock()
+
+def receipt_font_paths():
+    """
+    图表字体及其粗体文件，与 matplotlib 引擎选用的字体相同
+    The chart font and its bold face, the same files the matplotlib engine resolves
+    """
+    import matplotlib.font_manager as fm
+
+    font_path = find_chart_font()
+    with receipt_font_files_lock:
+        paths = receipt_font_files.get(font_path)
+        if paths is None:
+            if font_path:
+                fm.fontManager.addfont(font_path)
+                family = fm.FontProperties(fname=font_path).get_name()
+            else:
+                family = 'DejaVu Sans'
+            regular = font_path or fm.findfont(fm.FontProperties(family=family))
+            paths = receipt_font_files[font_path] = (regular, fm.findfont(fm.FontProperties(family=family, weight='bold')))
+        return paths
+
+def receipt_ticks(low, high, length_px, label_px, per_label):
+    """
+    matplotlib AutoLocator 的刻度：按可容纳的标签数选择步长，只保留轴范围内的刻度
+    matplotlib's AutoLocator ticks: the step follows how many labels fit, ticks outside the axis are dropped
+    """
+    from matplotlib.ticker import MaxNLocator
+
+    nbins = min(max(int(length_px // (label_px * per_label)), 1), 9)
+    span = (high - low) * 1e-9
+    return [t for t in MaxNLocator(nbins, steps=RECEIPT_TICK_STEPS).tick_values(low, high)
+            if low - span <= t <= high + span]
+
+def draw_styled_line(draw, points, style, width, fill=0):
+    """
+    按 matplotlib 线型画折线，虚线相位沿整条线连续
+    Draw a polyline in a matplotlib line style, keeping the dash phase continuous along the whole line
+    """
+    dashes = RECEIPT_DASHES[style]
+    if dashes is None:
+        draw.line(points, fill=fill, width=max(1, round(width)), joint='curve')
+        return
+    pattern = [d * width for d in dashes]
+    index, remaining, on = 0, pattern[0], True
+    run = [points[0]]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        segment = math.hypot(x1 - x0, y1 - y0)
+        done = 0.0
+        while segment - done > remaining:
+            done += remaining
+            point = (x0 + (x1 - x0) * done / segment, y0 + (y1 - y0) * done / segment)
+            if on:
+                run.append(point)
+                draw.line(run, fill=fill, width=max(1, round(width)))
+            run = [point]
+            on = not on
+            index = (index + 1) % len(pattern)
+            remaining = pattern[index]
+        remaining -= segment - done
+        run.append((x1, y1))
+    if on and len(run) > 1:
+        draw.line(run, fill=fill, width=max(1, round(width)))
+
+def draw_receipt_text(draw, xy, text, font, ha='left', va='top', image=None):
+    """
+    按 matplotlib 的对齐方式画文字：顶部对齐以 "lp" 的字形高度为准；给出 image 时贴缓存的字形位图
+    Draw text with matplotlib's alignment; top alignment uses the ink height of "lp" like matplotlib does.
+    With image given, the text is pasted from the cached sprite instead of being rasterized again.
+    返回文字外框 / Returns the text bounding box
+    """
+    x, y = xy
+    if image is not None:
+        mask, dx, dy = get_text_sprite(text, font, ha, va)
+        x0, y0 = round(x) + dx, round(y) + dy
+        image.paste(0, (x0, y0), mask)
+        return (x0, y0, x0 + mask.width, y0 + mask.height)
+    if va == 'top':
+        y += max(-font.getbbox('lp', anchor='ls')[1], -font.getbbox(text or 'lp', anchor='ls')[1])
+    elif va == 'bottom':
+        y -= max(font.getbbox('lp', anchor='ls')[3], font.getbbox(text or 'lp', anchor='ls')[3])
+    anchor = {'left': 'l', 'center': 'm', 'right': 'r'}[ha] + ('m' if va == 'center' else 's')
+    draw.text((x, y), text, font=font, fill=0, anchor=anchor)
+    return draw.textbbox((x, y), text, font=font, anchor=anchor)
+
+RECEIPT_SPRITE_CACHE_SIZE = 512  # 缓存的字形位图数（标题、分隔线、刻度标签）/ Cached text sprites (headers, separators, tick labels)
+text_sprites = OrderedDict()
+text_sprites_lock = threading.Lock()
+
+def get_text_sprite(text, font, ha, va):
+    """
+    栅格化一次的文字遮罩及其相对锚点的偏移，用于每张小票都重复的文字
+    Text rasterized once as a mask plus its offset from the anchor point, for text repeated on every receipt
+    
+    最多缓存 RECEIPT_SPRITE_CACHE_SIZE 个，淘汰最久未用的
+    Up to RECEIPT_SPRITE_CACHE_SIZE are kept, the least recently used evicted first
+    """
+    key = (text, font.path, font.size, ha, va)
+    with text_sprites_lock:
+        sprite = text_sprites.get(key)
+        if sprite is not None:
+            text_sprites.move_to_end(key)
+        else:
+            canvas = Image.new('L', (1, 1), 255)
+            x0, y0, x1, y1 = draw_receipt_text(ImageDraw.Draw(canvas), (0, 0), text, font, ha, va)
+            x0, y0 = math.floor(x0), math.floor(y0)
+            canvas = Image.new('L', (max(1, math.ceil(x1) - x0), max(1, math.ceil(y1) - y0)), 255)
+            draw_receipt_text(ImageDraw.Draw(canvas), (-x0, -y0), text, font, ha, va)
+            sprite = text_sprites[key] = (Image.eval(canvas, lambda v: 255 - v), x0, y0)
+            if len(text_sprites) > RECEIPT_SPRITE_CACHE_SIZE:
+                text_sprites.popitem(last=False)
+        return sprite
+
+def draw_vertical_label(image, x, y, text, font, side):
+    """
+    旋转90°的轴标签；side='right' 表示标签右边缘贴着 x（左侧轴），'left' 表示左边缘贴着 x（右侧轴）
+    Axis label rotated by 90°; side='right' puts its right edge at x (left axes), 'left' its left edge (right axis)
+    """
+    left, top, right, bottom = font.getbbox('lp' + text, anchor='ls')
+    mask = Image.new('L', (math.ceil(font.getlength(text)) + 2, bottom - top + 2), 0)
+    ImageDraw.Draw(mask).text((1, 1 - top), text, font=font, fill=255, anchor='ls')
+    mask = mask.rotate(90, expand=True)
+    x0 = round(x - mask.width) if side == 'right' else round(x)
+    image.paste(0, (x0, round(y - mask.height / 2)), mask)
+
+# 曲线的图表文本键、线型和纵轴上限 / Chart text key, line style and y-axis maximum of each curve
+RECEIPT_CURVES = [('pressure', '-', 10), ('water_flow', '--', 10), ('coffee_flow', ':', 10), ('basket_temp', '-.', 100)]
+RECEIPT_GRID_FILL = round(255 * 0.4)  # 网格线：黑色 alpha 0.6 / Gridlines: black at alpha 0.6
+
+def receipt_geometry(paper=None):
+    """
+    与 matplotlib 引擎相同的尺寸：横向画布，高度即打印机点宽；字号和线宽由点换算为像素
+    Same geometry as the matplotlib engine: a landscape canvas whose height is the dot width, sizes converted from points
+    """
+    profile = PAPER_PROFILES[paper or PAPER_PROFILE]
+    multiplier = profile['dots'] / 576
+    px = profile['dpi'] / 72
+    height = profile['dots']
+    width = int(height * 180 / 80)
+    (chart_x0, chart_w), _, _ = receipt_columns()
+    left, right = chart_x0 * width, (chart_x0 + chart_w) * width
+    top, bottom = (1 - RECEIPT_MARGINS['top']) * height, (1 - RECEIPT_MARGINS['bottom']) * height
+    return {
+        'width': width, 'height': height, 'dpi': profile['dpi'], 'px': px,
+        'font_m': 8 * multiplier * px, 'font_l': 10 * multiplier * px,
+        'line_width': 1.25 * multiplier * px, 'tick_length': 3.5 * px, 'tick_width': max(1, round(0.8 * px)),
+        'left': left, 'right': right, 'top': top, 'bottom': bottom,
+        'plot_w': right - left, 'plot_h': bottom - top,
+        # 下方多留一块，使超出画布的图例仍能写进PNG（与 bbox_inches='tight' 相同）
+        # Extra room below so the legend that overhangs the canvas still reaches the PNG (like bbox_inches='tight')
+        'overflow': int(profile['dpi'] * 0.25)
+    }
+
+def receipt_plot_box(geometry):
+    """绘图区的整数像素框，用于裁剪网格和曲线 / Whole-pixel box of the plot area, used to clip gridlines and curves"""
+    return (math.floor(geometry['left']), math.floor(geometry['top']),
+            math.ceil(geometry['right']), math.ceil(geometry['bottom']))
+
+RECEIPT_BASE_CACHE_SIZE = 16  # 缓存的静态底图数（语言×纸张×机器）/ Cached static base layers (language × paper × machine)
+receipt_bases = {}
+receipt_bases_lock = threading.Lock()
+
+def get_receipt_base(paper, machine_id, font_paths):
+    """
+    获取 (语言, 纸张, 字体, 机器ID) 对应的静态底图，首次使用时栅格化
+    Get the static base layer for (language, paper, fonts, machine ID), rasterized on first use
+    """
+    key = (current_language, paper or PAPER_PROFILE, font_paths, machine_id)
+    with receipt_bases_lock:
+        base = receipt_bases.get(key)
+        if base is None:
+            if len(receipt_bases) >= RECEIPT_BASE_CACHE_SIZE:
+                receipt_bases.pop(next(iter(receipt_bases)))
+            base = receipt_bases[key] = build_receipt_base(receipt_geometry(paper), machine_id, font_paths)
+            print(f"🧱 Receipt base layer cached: {current_language}/{paper or PAPER_PROFILE}/{machine_id}")
+        return base
+
+def build_receipt_base(geometry, machine_id, font_paths):
+    """
+    栅格化每张小票都相同的部分：坐标轴、固定的压力/流速/温度刻度、横向网格、轴标签、图例和机器ID标签
+    Rasterize what every receipt shares: axes, the fixed pressure/flow/temperature scales, horizontal
+    gridlines, axis labels, legend and machine ID label
+    """
+    g = geometry
+    chart_texts = receipt_chart_texts()
+    regular_path, _ = font_paths
+    left, right, top, bottom, plot_w, plot_h = g['left'], g['right'], g['top'], g['bottom'], g['plot_w'], g['plot_h']
+    line_width, tick_length, font_m = g['line_width'], g['tick_length'], g['font_m']
+    image = Image.new('L', (g['width'], g['height'] + g['overflow']), 255)
+    draw = ImageDraw.Draw(image)
+
+    y_ticks = receipt_ticks(0, 10, plot_h, font_m, 2)
+    temp_ticks = receipt_ticks(0, 100, plot_h, font_m, 2)
+    # 横向网格画在绘图区大小的图层上，裁掉超出坐标轴的部分 / Horizontal gridlines on a plot-area layer, clipped to the axes
+    box = receipt_plot_box(g)
+    plot = Image.new('L', (box[2] - box[0], box[3] - box[1]), 255)
+    plot_draw = ImageDraw.Draw(plot)
+    for t in y_ticks:
+        y = bottom - t / 10 * plot_h - box[1]
+        draw_styled_line(plot_draw, [(0, y), (plot.width, y)], '--', line_width / 2, RECEIPT_GRID_FILL)
+    image.paste(plot, box[:2])
+
+    # 边框、刻度和刻度标签 / Spines, ticks and tick labels
+    font_tick = get_pillow_font(regular_path, font_m)
+    draw.rectangle([left, top, right, bottom], outline=0, width=max(1, round(line_width)))
+    temp_x = left - 0.10 * plot_w
+    draw.line([(temp_x, top), (temp_x, bottom)], fill=0, width=max(1, round(line_width)))
+    label_gap = tick_length * 2
+    for t in y_ticks:
+        y = bottom - t / 10 * plot_h
+        draw.line([(left - tick_length, y), (left, y)], fill=0, width=g['tick_width'])
+        draw.line([(right, y), (right + tick_length, y)], fill=0, width=g['tick_width'])
+        draw_receipt_text(draw, (left - label_gap, y), f"{t + 0:g}", font_tick, ha='right', va='center')
+        draw_receipt_text(draw, (right + label_gap, y), f"{t + 0:g}", font_tick, ha='left', va='center')
+    for t in temp_ticks:
+        y = bottom - t / 100 * plot_h
+        draw.line([(temp_x - tick_length, y), (temp_x, y)], fill=0, width=g['tick_width'])
+        draw_receipt_text(draw, (temp_x - label_gap, y), f"{t + 0:g}", font_tick, ha='right', va='center')
+
+    # 轴标签，位置与 set_label_coords 相同 / Axis labels at the same set_label_coords positions
+    middle = (top + bottom) / 2
+    draw_vertical_label(image, left - 0.05 * plot_w, middle, chart_texts['pressure_label'], font_tick, 'right')
+    draw_vertical_label(image, left + 1.06 * plot_w, middle, chart_texts['flow_label'], font_tick, 'left')
+    draw_vertical_label(image, left - 0.18 * plot_w, middle, chart_texts['temp_label'], font_tick, 'right')
+
+    # 图例：四列，居中于坐标轴下方，间距与 matplotlib 默认值相同
+    # Legend: four columns centred below the axes, with matplotlib's default paddings
+    legend_size = font_m * 0.8
+    font_legend = get_pillow_font(regular_path, legend_size)
+    entries = [(chart_texts[key], style, font_legend.getlength(chart_texts[key])) for key, style, _ in RECEIPT_CURVES]
+    handle, handle_pad, column_gap, border = 2.0 * legend_size, 0.8 * legend_size, 2.0 * legend_size, 0.4 * legend_size
+    legend_w = sum(handle + handle_pad + w for _, _, w in entries) + column_gap * (len(entries) - 1)
+    _, row_top, _, row_bottom = font_legend.getbbox('lp', anchor='ls')
+    row_y = bottom + 0.18 * plot_h - 0.5 * legend_size - border - (row_bottom - row_top) / 2
+    x = left + (plot_w - legend_w) / 2
+    for label, style, w in entries:
+        draw_styled_line(draw, [(x, row_y), (x + handle, row_y)], style, line_width)
+        draw_receipt_text(draw, (x + handle + handle_pad, row_y), label, font_legend, va='center')
+        x += handle + handle_pad + w + column_gap
+
+    # 机器ID标签（白底 alpha 0.7 的圆角框）/ Machine ID label (rounded box, white at alpha 0.7)
+    if machine_id != 'UNKNOWN':
+        font_id = get_pillow_font(regular_path, font_m * 0.8)
+        text = f"{get_text('chart_machine_id_label')}: {machine_id}"
+        x = 0.03 * g['width']
+        box = draw_receipt_text(ImageDraw.Draw(Image.new('L', (1, 1))), (x, g['height']), text, font_id, va='bottom')
+        pad = 0.2 * font_m * 0.8
+        frame = [round(box[0] - pad), round(box[1] - pad), round(box[2] + pad), round(box[3] + pad)]
+        image.paste(image.crop(frame).point(lambda v: round(v * 0.3 + 255 * 0.7)), frame[:2])
+        draw.rounded_rectangle(frame, radius=pad, outline=0, width=max(1, round(0.5 * g['px'])))
+        draw_receipt_text(draw, (x, g['height']), text, font_id, va='bottom')
+    return image
+
+def create_coffee_plot_pillow(input_file, output_file, machine_id='UNKNOWN', anomaly=None, raster_file=None, paper=None,
+                              data=None, series=None):
+    """
+    轻量渲染引擎：不创建 matplotlib 图形，直接在打印分辨率的8位 Pillow 画布上画出与 create_coffee_plot
+    相同的小票（曲线、坐标轴、网格、图例和两个文字列），参数与返回值相同
+    Lightweight engine: draws the same receipt as create_coffee_plot (curves, axes, gridlines, legend and both
+    text columns) straight onto an 8-bit Pillow canvas at printer resolution, without a matplotlib figure.
+    Takes the same arguments and returns the same result.
+
+    不随冲泡变化的部分来自缓存的静态底图和字形位图，每张小票只栅格化曲线、时间轴和可变文字
+    Everything that does not change between shots comes from the cached base layer and text sprites;
+    each receipt only rasterizes its curves, time axis and variable text.
+    """
+    try:
+        clock = StageClock()
+        print(f"📊 Generating chart (pillow): {input_file}")
+        chart_texts = receipt_chart_texts()
+        if data is None:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        elapsed, pressure, flow, flow_by_weight, basket_temp = receipt_series(data, series)
+        print(f"  Data length: {len(elapsed)} samples")
+        clock.lap('render.load')
+
+        g = receipt_geometry(paper)
+        width, height, dpi = g['width'], g['height'], g['dpi']
+        left, bottom, plot_w, plot_h = g['left'], g['bottom'], g['plot_w'], g['plot_h']
+        font_m, line_width, tick_length = g['font_m'], g['line_width'], g['tick_length']
+        font_paths = receipt_font_paths()
+        regular_path, bold_path = font_paths
+        clock.lap('render.font')
+
+        image = get_receipt_base(paper, machine_id, font_paths).copy()
+        draw = ImageDraw.Draw(image)
+        clock.lap('render.base')
+
+        first, last = float(elapsed.min()), float(elapsed.max())
+        span = (last - first) or 1.0
+        x_min, x_max = first - 0.05 * span, last + 0.05 * span
+        x_ticks = receipt_ticks(x_min, x_max, plot_w, font_m, 3)
+
+        # 竖向网格和曲线画在绘图区大小的白色图层上（自动裁掉超出坐标轴的部分），再按“取深色”叠加到底图
+        # Vertical gridlines and curves go on a white plot-area layer, which clips anything outside the axes,
+        # and are composited onto the base by keeping the darker pixel
+        box = receipt_plot_box(g)
+        plot = Image.new('L', (box[2] - box[0], box[3] - box[1]), 255)
+        plot_draw = ImageDraw.Draw(plot)
+        for t in x_ticks:
+            x = left + (t - x_min) / (x_max - x_min) * plot_w - box[0]
+            draw_styled_line(plot_draw, [(x, 0), (x, plot.height)], '--', line_width / 2, RECEIPT_GRID_FILL)
+        xs = left + (elapsed - x_min) / (x_max - x_min) * plot_w - box[0]
+        for (_, style, y_max), values in zip(RECEIPT_CURVES, (pressure, flow, flow_by_weight, basket_temp)):
+            ys = bottom - values / y_max * plot_h - box[1]
+            points = list(zip(xs.tolist(), ys.tolist()))
+            if len(points) > 1:
+                draw_styled_line(plot_draw, points, style, line_width)
+        image.paste(ImageChops.darker(image.crop(box), plot), box[:2])
+
+        # 时间轴刻度随冲泡时长变化 / Time axis ticks follow the shot's duration
+        font_tick = get_pillow_font(regular_path, font_m)
+        for t in x_ticks:
+            x = left + (t - x_min) / (x_max - x_min) * plot_w
+            draw.line([(x, bottom), (x, bottom + tick_length)], fill=0, width=g['tick_width'])
+            draw_receipt_text(draw, (x, bottom + tick_length * 2), f"{t + 0:g}", font_tick, ha='center', va='top',
+                              image=image)
+
+        # 异常冲泡标记 / Unusual shot flag
+        if anomaly:
+            reasons = ', '.join(get_text(f'anomaly_{reason}') for reason in anomaly)
+            font_flag = get_pillow_font(bold_path, font_m)
+            text = f"!! {get_text('chart_anomaly')}: {reasons}"
+            x, y = left + 0.02 * plot_w, bottom - 0.97 * plot_h
+            flag = draw_receipt_text(ImageDraw.Draw(Image.new('L', (1, 1))), (x, y), text, font_flag)
+            pad = 0.2 * font_m
+            draw.rectangle([flag[0] - pad, y - pad, flag[2] + pad, flag[3] + pad], fill=255, outline=0,
+                           width=max(1, round(line_width)))
+            draw_receipt_text(draw, (x, y), text, font_flag)
+        clock.lap('render.plot')
+
+        # 两个文字列：标题和分隔线贴缓存的字形位图 / Both text columns; headers and separators are pasted sprites
+        layout = get_text_layout(regular_path, font_m)
+        column_widths = receipt_column_widths(width, layout.size_px * 0.5)
+
+        def wrap_text(text, column_num=1):
+            """按字宽换行，结果会被记忆 / Wrap by measured width; results are memoized"""
+            return layout.wrap(text, column_widths[column_num], column_num, current_language)
+
+        text_content1, text_content2 = receipt_text_columns(data, chart_texts, basket_temp, wrap_text)
+        fonts = {False: get_pillow_font(regular_path, font_m), True: get_pillow_font(bold_path, g['font_l'])}
+        _, (col1_x0, col1_w), (col2_x0, col2_w) = receipt_columns()
+        columns = [
+            (text_content1, (col1_x0 + 0.05 * col1_w) * width,
+             {chart_texts['date_time_title'], chart_texts['profile_title'],
+              chart_texts['extraction_title'], chart_texts['grinder_temp_title']}),
+            (text_content2, (col2_x0 + 0.01 * col2_w) * width,
+             {chart_texts['bean_info'], chart_texts['profile_info'],
+              chart_texts['tasting_note'], TASTING_NOTE_FROM_JSON}),
+        ]
+        for lines, x, headings in columns:
+            for text, y_position, heading in receipt_text_rows(lines, headings):
+                if text:
+                    static = heading or text == RECEIPT_SEPARATOR
+                    draw_receipt_text(draw, (x, bottom - y_position * plot_h), text, fonts[heading],
+                                      image=image if static else None)
+        clock.lap('render.text')
+
+        # 保存：PNG 按内容裁剪并留 0.1 英寸边距，打印位图取画布并旋转为纸宽方向
+        # Save: the PNG is cropped to its content with a 0.1 inch margin, the raster takes the canvas turned to paper width
+        if output_file:
+            x0, y0, x1, y1 = Image.eval(image, lambda v: 255 - v).getbbox() or (0, 0, width, height)
+            pad = round(0.1 * dpi)
+            image.crop((max(0, x0 - pad), max(0, y0 - pad), min(image.width, x1 + pad),
+                        min(image.height, y1 + pad))).save(output_file)
+            clock.lap('render.savefig')
+        if raster_file:
+            save_print_raster(image.crop((0, 0, width, height)).rotate(90, expand=True), raster_file)
+            clock.lap('render.raster')
+        clock.done('render')
+
+        print(f"✅ Chart generated: {output_file or raster_file}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Chart generation failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def write_json_atomic(path, payload):
+    """
+    写入同目录的独立临时文件后替换，并发写入者（线程或 rerender 进程）互不干扰
+    Write to a private temp file in the same directory, then replace, so concurrent writers
+    (threads or a rerender process) never share a temp file
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+class DeferredSave:
+    """
+    把 delay 秒内的多次保存请求合并为一次后台写入；退出时由 main 直接保存
+    Coalesces save requests made within delay seconds into one background write; main saves directly on exit
+    """
+    def __init__(self, save, delay, label):
+        self.save = save
+        self.delay = delay
+        self.label = label
+        self.lock = threading.Lock()
+        self.timer = None
+    
+    def request(self):
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(self.delay, self._run)
+            self.timer.daemon = True
+            self.timer.start()
+    
+    def _run(self):
+        with self.lock:
+            self.timer = None
+        try:
+            self.save()
+        except OSError as e:
+            print(f"⚠️ 保存{self.label}失败 / Failed to save {self.label}: {e}")
+
+class RenderManifest:
+    """
+    记录每个图表的渲染指纹，用于跳过未变化的图表
+    Records the render fingerprint of every chart so unchanged charts can be skipped
+    """
+    SAVE_DELAY = 5.0  # 上传后合并写入的等待秒数 / Seconds uploads wait so their writes are coalesced
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.deferred = DeferredSave(self.save, self.SAVE_DELAY, 'render manifest')
+        self.entries = {}
+        self.load()
+    
+    def load(self):
+        """从磁盘加载清单 / Load manifest from disk"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('shots', {})
+        except Exception as e:
+            print(f"⚠️ 渲染清单损坏，将重新生成 / Render manifest unreadable, starting fresh: {e}")
+            self.entries = {}
+    
+    def save(self):
+        """原子写入清单，中断后可续跑 / Write manifest atomically so interrupted runs can resume"""
+        # 写入和替换整体串行，较早的快照不会覆盖较新的 / Serialize write and replace so an older snapshot never lands last
+        with self.save_lock:
+            with self.lock:
+                payload = {'render_version': RENDER_VERSION, 'shots': dict(self.entries)}
+            write_json_atomic(self.path, payload)
+    
+    def save_later(self):
+        """
+        SAVE_DELAY 秒内的多次上传只写一次清单 / Uploads within SAVE_DELAY seconds share one manifest write
+
+        未写入时退出只会让这些图表在下次 rerender 时重新渲染 / Exiting before the write only makes rerender redraw those charts
+        """
+        self.deferred.request()
+    
+    def get(self, filename):
+        with self.lock:
+            return self.entries.get(filename)
+    
+    def record(self, filename, fingerprint, machine_id='UNKNOWN'):
+        """记录一次成功的渲染 / Record a successful render"""
+        with self.lock:
+            self.entries[filename] = {
+                'hash': fingerprint,
+                'machine_id': machine_id,
+                'rendered_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+render_manifest = None
+render_manifest_lock = threading.Lock()
+
+def get_render_manifest():
+    """获取全局渲染清单（延迟加载）/ Get the global render manifest (lazily loaded)"""
+    global render_manifest
+    with render_manifest_lock:
+        if render_manifest is None:
+            render_manifest = RenderManifest(os.path.join(IMAGE_DIR, RENDER_MANIFEST_FILE))
+        return render_manifest
+
+def render_fingerprint(json_path, machine_id='UNKNOWN', font_path=None, anomaly=None):
+    """
+    计算图表的内容/版本指纹：数据、布局版本、语言、豆子信息开关、字体、机器ID和异常标记
+    Content/version fingerprint of a chart: data, layout version, language, bean info flag, font, machine ID and anomaly flag
+    （以及纸张和渲染引擎 / plus paper and rendering engine）
+    """
+    digest = hashlib.sha1()
+    with open(json_path, 'rb') as f:
+        while chunk := f.read(65536):
+            digest.update(chunk)
+    settings = (f"{RENDER_VERSION}|{current_language}|{int(bool(BEAN_INFO_ENABLED))}|{font_path or ''}|{machine_id}"
+                f"|{','.join(anomaly or [])}|{PAPER_PROFILE}|{RENDERER}")
+    digest.update(settings.encode('utf-8'))
+    return digest.hexdigest()
+
+def record_render(filename, json_path, machine_id='UNKNOWN', anomaly=None):
+    """上传渲染完成后登记指纹 / Register the fingerprint after an upload has been rendered"""
+    try:
+        manifest = get_render_manifest()
+        manifest.record(filename, render_fingerprint(json_path, machine_id, find_chart_font(), anomaly), machine_id)
+        manifest.save_later()
+    except Exception as e:
+        print(f"⚠️ 更新渲染清单失败 / Failed to update render manifest: {e}")
+
+def _rerender_worker_init(language, bean_info_enabled, paper=None, renderer=None):
+    """进程池初始化：同步语言和设置，屏蔽逐图日志 / Pool initializer: sync settings and silence per-chart logs"""
+    global current_language, BEAN_INFO_ENABLED, PAPER_PROFILE, RENDERER
+    current_language = language
+    BEAN_INFO_ENABLED = bean_info_enabled
+    PAPER_PROFILE = paper or PAPER_PROFILE
+    RENDERER = renderer or RENDERER
+    sys.stdout = open(os.devnull, 'w')
+
+def _rerender_worker(filename, machine_id, anomaly=None):
+    """在工作进程中重新渲染一个图表 / Re-render one chart inside a worker process"""
+    json_path = os.path.join(DATA_DIR, filename)
+    image_path = os.path.join(IMAGE_DIR, filename.replace('.json', '.png'))
+    # 打印位图随图表一起更新 / Keep the print raster in step with the chart
+    return create_coffee_plot(json_path, image_path, machine_id, anomaly, raster_file=print_raster_path(image_path))
+
+SHARED_SERIES_FIELDS = ('elapsed', 'pressure', 'flow', 'flow_by_weight', 'basket_temp')
+RENDER_TEXT_FIELDS = ('profile', 'meta', 'date', 'timestamp')  # 渲染文字列所需的字段 / Fields the text columns read
+
+class SharedShotSeries:
+    """
+    放在一块共享内存中的冲泡曲线（每行一条曲线），渲染进程只接收描述符并直接映射，不经过pickle
+    Shot curves in one shared-memory block (one row per curve); render processes get only the descriptor
+    and map the block directly, nothing is pickled
+    """
+    def __init__(self, series):
+        length = len(series['elapsed'])
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, len(SHARED_SERIES_FIELDS) * length * 8))
+        block = np.ndarray((len(SHARED_SERIES_FIELDS), length), dtype=np.float64, buffer=self.shm.buf)
+        for row, name in zip(block, SHARED_SERIES_FIELDS):
+            row[:] = series[name]
+        del block
+        self.descriptor = {'name': self.shm.name, 'length': length}
+
+    @staticmethod
+    def attach(descriptor):
+        """在渲染进程中映射曲线，返回 (共享内存, 曲线) / Map the curves in a render process; returns (shm, series)"""
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        block = np.ndarray((len(SHARED_SERIES_FIELDS), descriptor['length']), dtype=np.float64, buffer=shm.buf)
+        return shm, dict(zip(SHARED_SERIES_FIELDS, block))
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+class SharedRaster:
+    """
+    渲染进程写入1位打印位图的共享内存，由上传进程分配、读取并保存为PNG
+    Shared memory the render process writes the 1-bit print raster into; allocated, read and stored as PNG
+    by the uploading process
+
+    作为 raster_file 传给 create_coffee_plot 时，save_print_raster 把位图写到这里而不是文件
+    Passed as raster_file to create_coffee_plot, save_print_raster writes the raster here instead of a file
+    """
+    def __init__(self, paper=None, descriptor=None):
+        if descriptor:
+            self.shm = shared_memory.SharedMemory(name=descriptor['name'])
+            self.owner = False
+        else:
+            # 按横向画布留足余量；未写入的页面不占内存 / Generous room for the landscape canvas; untouched pages cost no memory
+            g = receipt_geometry(paper)
+            size = (g['height'] // 8 + 2) * (g['width'] + g['overflow']) * 2
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        self.descriptor = {'name': self.shm.name}
+        self.size = None
+
+    def store(self, raster):
+        """写入1位位图（行按字节对齐打包）/ Write a 1-bit raster, rows packed to whole bytes"""
+        data = raster.tobytes()
+        if len(data) > self.shm.size:
+            raise ValueError(f"Raster of {len(data)} bytes does not fit {self.shm.size}")
+        self.shm.buf[:len(data)] = data
+        self.size = raster.size
+        return self
+
+    def save(self, size, raster_path):
+        """把渲染进程写入的位图保存为PNG / Store the raster written by the render process as PNG"""
+        stride = (size[0] + 7) // 8
+        raster = Image.frombuffer('1', size, self.shm.buf[:stride * size[1]], 'raw', '1', 0, 1)
+        tmp_path = raster_path + '.tmp'
+        raster.save(tmp_path, 'PNG', optimize=True)
+        os.replace(tmp_path, raster_path)
+        return raster_path
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __str__(self):
+        return f"shm:{self.shm.name}"
+
+render_pool = None
+render_pool_lock = threading.Lock()
+
+def process_pool_context():
+    """
+    服务器内进程池的启动方式：服务器是多线程的，fork 可能复制其他线程持有的锁，因此用 forkserver（不支持时用 spawn）
+    Start method for process pools inside the server: it is multi-threaded and fork could copy locks held by other
+    threads, so forkserver is used (spawn where it is unavailable)
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _render_worker_init(language, bean_info_enabled, paper=None, renderer=None):
+    """上传渲染进程初始化：同步设置并加载图表字体 / Upload render process initializer: sync settings and load the chart font"""
+    _rerender_worker_init(language, bean_info_enabled, paper, renderer)
+    setup_matplotlib_font()
+
+def get_render_pool():
+    """
+    上传渲染进程池（懒加载），进程用 process_pool_context 启动
+    Render process pool for uploads (lazily created), started with process_pool_context
+    """
+    global render_pool
+    with render_pool_lock:
+        if render_pool is None:
+            render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=process_pool_context(),
+                                              initializer=_render_worker_init,
+                                              initargs=(current_language, BEAN_INFO_ENABLED, PAPER_PROFILE, RENDERER))
+        return render_pool
+
+def _shared_render_worker(job):
+    """
+    在渲染进程中渲染一张上传的冲泡，曲线和打印位图都在共享内存中；返回位图尺寸，失败时返回 False
+    Render one uploaded shot in a render process with the curves and print raster in shared memory;
+    returns the raster size, or False on failure
+    """
+    global current_language, BEAN_INFO_ENABLED
+    # 设置可能在进程池创建后改变 / Settings may have changed since the pool was created
+    current_language, BEAN_INFO_ENABLED = job['language'], job['bean_info']
+    shm, series = SharedShotSeries.attach(job['series'])
+    raster = SharedRaster(descriptor=job['raster']) if job['raster'] else None
+    try:
+        if not create_coffee_plot(job['json_path'], job['output_file'], job['machine_id'], job['anomaly'], raster,
+                                  job['paper'], job['renderer'], data=job['text'], series=series):
+            return False
+        return raster.size if raster else True
+    finally:
+        del series
+        shm.close()
+        if raster:
+            raster.close()
+
+def _discard_render_pool(pool):
+    """
+    丢弃进程池并结束其进程，下次上传时重建；卡住的进程不会继续占用名额
+    Discard the pool and stop its processes so it is rebuilt on the next upload and a stuck process keeps no slot
+    """
+    global render_pool
+    with render_pool_lock:
+        if render_pool is pool:
+            render_pool = None
+    # ProcessPoolExecutor 没有公开的终止方法 / ProcessPoolExecutor has no public way to terminate its processes
+    for process in list((getattr(pool, '_processes', None) or {}).values()):
+        if process.is_alive():
+            process.terminate()
+    pool.shutdown(wait=False)
+
+def _render_in_thread(json_path, output_file, machine_id, anomaly, raster_file, paper, data, series):
+    """
+    渲染进程失败后的本线程渲染：先写临时文件再替换，不会与残留的渲染进程写出的文件交错
+    In-thread render after a render process failed: written to temporary files and then moved into place, so
+    it never interleaves with output from a leftover render process
+    """
+    targets = [path for path in (output_file, raster_file) if path]
+    temps = {}
+    try:
+        for path in targets:
+            fd, temps[path] = tempfile.mkstemp(prefix='.render_', suffix='.png', dir=os.path.dirname(path) or '.')
+            os.close(fd)
+        generated = create_coffee_plot(json_path, temps.get(output_file), machine_id, anomaly, temps.get(raster_file),
+                                       paper, data=data, series=series)
+        if generated:
+            for path in targets:
+                os.replace(temps.pop(path), path)
+        return generated
+    finally:
+        for temp in temps.values():
+            if os.path.exists(temp):
+                os.remove(temp)
+
+def render_shared(json_path, output_file, machine_id='UNKNOWN', anomaly=None, raster_file=None, data=None,
+                  series=None, paper=None):
+    """
+    在渲染进程池中渲染上传的冲泡，参数与返回值同 create_coffee_plot
+    Render an uploaded shot in the render pool; same arguments and result as create_coffee_plot
+
+    曲线放入共享内存，只把描述符和文字字段交给渲染进程，渲染进程不再读取和解析JSON；
+    打印位图同样经共享内存返回并在这里保存
+    The curves go into shared memory and only their descriptor and the text fields are sent, so the render
+    process never reads or parses the JSON; the print raster comes back through shared memory and is stored here
+    """
+    paper = paper or PAPER_PROFILE
+    shared = SharedShotSeries(series)
+    raster = SharedRaster(paper) if raster_file else None
+    try:
+        job = {
+            'json_path': json_path, 'output_file': output_file, 'machine_id': machine_id, 'anomaly': anomaly,
+            'series': shared.descriptor, 'raster': raster.descriptor if raster else None,
+            'text': {key: data[key] for key in RENDER_TEXT_FIELDS if key in data},
+            'language': current_language, 'bean_info': BEAN_INFO_ENABLED, 'paper': paper, 'renderer': RENDERER,
+        }
+        pool = get_render_pool()
+        future = pool.submit(_shared_render_worker, job)
+        try:
+            size = future.result(timeout=RENDER_TIMEOUT)
+        except FuturesTimeoutError:
+            # 渲染进程卡住：结束进程池，下次重建，这次在本线程渲染
+            # A render process is stuck: stop the pool so it is rebuilt next time, and render this shot in-thread
+            _discard_render_pool(pool)
+            print(f"⚠️ 渲染进程超过 {RENDER_TIMEOUT} 秒未返回，改为在本线程渲染 / "
+                  f"Render process timed out after {RENDER_TIMEOUT}s, rendering in-thread")
+            return _render_in_thread(json_path, output_file, machine_id, anomaly, raster_file, paper, data, series)
+        except BrokenProcessPool as e:
+            # 渲染进程意外退出：下次重建进程池，这次在本线程渲染
+            # A render process died: rebuild the pool next time and render this shot in-thread
+            _discard_render_pool(pool)
+            print(f"⚠️ 渲染进程池已损坏，改为在本线程渲染 / Render pool broken, rendering in-thread: {e}")
+            return _render_in_thread(json_path, output_file, machine_id, anomaly, raster_file, paper, data, series)
+        if size is False:
+            return False
+        if raster:
+            raster.save(size, raster_file)
+        return True
+    finally:
+        shared.close()
+        if raster:
+            raster.close()
+
+# 管理API触发的批量渲染状态 / State of the admin-API triggered batch re-render
+rerender_status = {'running': False}
+rerender_lock = threading.Lock()
+
+def rerender_shots(filenames=None, force=False, workers=None, progress=None):
+    """
+    使用进程池批量重新渲染历史图表，跳过指纹未变化的图表
+    Re-render stored shots across a process pool, skipping charts whose fingerprint is unchanged
+    
+    progress(done, total, rendered, failed, elapsed) 在每个图表完成后调用 / is called after every chart
+    """
+    start_time = time.time()
+    manifest = get_render_manifest()
+    font_path = find_chart_font()
+    
+    if not filenames:
+        filenames = sorted(f for f in os.listdir(DATA_DIR) if is_shot_file(f))
+    
+    # 找出需要重新渲染的图表 / Work out which charts are stale
+    pending = []
+    skipped = 0
+    missing = []
+    for filename in filenames:
+        json_path = os.path.join(DATA_DIR, filename)
+        if not os.path.exists(json_path):
+            missing.append(filename)
+            continue
+        entry = manifest.get(filename) or {}
+        record = get_shot_index().get(filename) or {}
+        machine_id = entry.get('machine_id') or record.get('machine_id', 'UNKNOWN')
+        anomaly = (record.get('anomaly') or {}).get('reasons') or None
+        fingerprint = render_fingerprint(json_path, machine_id, font_path, anomaly)
+        image_path = os.path.join(IMAGE_DIR, filename.replace('.json', '.png'))
+        if not force and entry.get('hash') == fingerprint and os.path.exists(image_path):
+            skipped += 1
+            continue
+        pending.append((filename, machine_id, anomaly, fingerprint))
+    
+    total = len(pending)
+    rendered = 0
+    failed = []
+    workers = workers or os.cpu_count() or 1
+    
+    if total:
+        executor = ProcessPoolExecutor(max_workers=min(workers, total), mp_context=process_pool_context(),
+                                       initializer=_render_worker_init,
+                                       initargs=(current_language, BEAN_INFO_ENABLED, PAPER_PROFILE, RENDERER))
+        futures = {}
+        try:
+            futures = {executor.submit(_rerender_worker, filename, machine_id, anomaly): (filename, machine_id, fingerprint)
+                       for filename, machine_id, anomaly, fingerprint in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                filename, machine_id, fingerprint = futures[future]
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print(f"❌ 重新渲染失败 / Re-render failed: {filename}: {e}")
+                    ok = False
+                if ok:
+                    rendered += 1
+                    manifest.record(filename, fingerprint, machine_id)
+                else:
+                    failed.append(filename)
+                # 定期落盘，中断后可以从这里继续 / Persist regularly so an interrupted run resumes here
+                if done % 20 == 0:
+                    manifest.save()
+                if progress:
+                    progress(done, total, rendered, len(failed), time.time() - start_time)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            manifest.save()
+    
+    elapsed = time.time() - start_time
+    return {
+        'total': len(filenames),
+        'skipped': skipped,
+        'rendered': rendered,
+        'failed': failed,
+        'missing': missing,
+        'workers': workers,
+        'elapsed': round(elapsed, 2),
+        'shots_per_second': round(rendered / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+def start_background_rerender(filenames=None, force=False, workers=None):
+    """在后台线程中启动批量渲染（供管理API使用）/ Start a batch re-render in a background thread (admin API)"""
+    with rerender_lock:
+        if rerender_status.get('running'):
+            return False
+        rerender_status.clear()
+        rerender_status.update({
+            'running': True,
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'done': 0, 'total': 0, 'rendered': 0, 'failed': 0, 'shots_per_second': 0.0
+        })
+    
+    def progress(done, total, rendered, failed_count, elapsed):
+        rerender_status.update({
+            'done': done, 'total': total, 'rendered': rendered, 'failed': failed_count,
+            'shots_per_second': round(rendered / elapsed, 2) if elapsed > 0 else 0.0
+        })
+    
+    def run():
+        try:
+            summary = rerender_shots(filenames, force=force, workers=workers, progress=progress)
+            rerender_status.update({'result': summary})
+            print(f"✅ 批量渲染完成 / Batch re-render finished: {summary['rendered']} rendered, "
+                  f"{summary['skipped']} up to date, {len(summary['failed'])} failed, "
+                  f"{summary['shots_per_second']} shots/s")
+        except Exception as e:
+            rerender_status.update({'error': str(e)})
+            print(f"❌ 批量渲染出错 / Batch re-render error: {e}")
+        finally:
+            rerender_status.update({
+                'running': False,
+                'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
+    
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+def parse_shot_datetime(data, fallback=None):
+    """从冲泡数据中解析冲泡时间 / Parse the time a shot was pulled from its data"""
+    timestamp = data.get('timestamp', '') if isinstance(data, dict) else ''
+    date_str = data.get('date', '') if isinstance(data, dict) else ''
+    try:
+        if timestamp:
+            return datetime.fromtimestamp(float(timestamp))
+        if date_str:
+            return datetime.strptime(date_str, '%a %b %d %H:%M:%S %Y')
+    except (ValueError, TypeError, OverflowError, OSError):
+        pass
+    return fallback
+
+def describe_shot(data):
+    """提取索引和列表使用的冲泡摘要 / Extract the summary fields used by the index and lists"""
+    if not isinstance(data, dict):
+        return {'clock': 'unknown', 'profile': 'unknown', 'bean': ''}
+    profile = data.get('profile', {})
+    bean = data.get('meta', {}).get('bean', {}) if isinstance(data.get('meta'), dict) else {}
+    bean_text = ''
+    if isinstance(bean, dict):
+        bean_text = ' - '.join(str(bean[key]) for key in ('brand', 'type') if bean.get(key))
+    return {
+        'clock': data.get('clock', 'unknown'),
+        'profile': profile.get('title', 'unknown') if isinstance(profile, dict) else (profile or 'unknown'),
+        'bean': bean_text
+    }
+
+def shot_record_fields(data):
+    """
+    索引记录中由冲泡内容决定的字段，导入时在工作进程中计算
+    Index record fields that come from the shot content; computed in the worker process on import
+    """
+    summary = describe_shot(data)
+    shot_time = parse_shot_datetime(data)
+    return {
+        'clock': summary['clock'],
+        'profile': summary['profile'],
+        'bean': summary['bean'],
+        'shot_time': shot_time.strftime('%Y-%m-%d %H:%M:%S') if shot_time else None,
+        'shot_key': shot_content_key(data) if isinstance(data, dict) else None,
+    }
+
+class ShotIndex:
+    """
+    持久化的冲泡元数据索引（JSON Lines，只追加），用于筛选、导出和去重
+    Persistent shot metadata index (append-only JSON Lines) used for filtering, export and dedup
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        self.ids = {}  # 冲泡ID -> 文件名集合 / Shot ID -> set of filenames
+        self.load()
+    
+    def load(self):
+        """加载索引，后写入的记录覆盖先写入的 / Load the index, later lines win"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if is_shot_file(record['filename']):
+                        self._put(record)
+                except (ValueError, KeyError):
+                    continue
+    
+    def _put(self, record):
+        filename = record['filename']
+        previous = self.records.get(filename)
+        if previous is not None:
+            self.ids.get(str(previous.get('id')), set()).discard(filename)
+        self.records[filename] = record
+        self.ids.setdefault(str(record.get('id')), set()).add(filename)
+    
+    def add(self, record):
+        """添加或更新一条记录 / Add or update a record"""
+        with self.lock:
+            self._put(record)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    
+    def get(self, filename):
+        with self.lock:
+            return self.records.get(filename)
+    
+    def find_id(self, shot_id):
+        """按冲泡ID查找文件名；ID按秒生成，可能重复，取最新的 / Filename for a shot ID; IDs are per-second and may collide, the newest wins"""
+        with self.lock:
+            matches = self.ids.get(str(shot_id))
+            return max(matches) if matches else None
+    
+    def build_record(self, filename, data, machine_id='UNKNOWN', plugin_version='unknown',
+                     upload_type='json', data_size=0, shot_id=None, timestamp=None, anomaly=None, fields=None):
+        """
+        根据冲泡数据构建索引记录 / Build an index record from shot data
+
+        fields: 已由 shot_record_fields 计算的内容字段，提供时不再读取 data
+                Content fields already computed by shot_record_fields; data is not read when given
+        """
+        if fields is None:
+            fields = shot_record_fields(data)
+        shot_time = fields['shot_time']
+        if shot_time is None and timestamp:
+            shot_time = datetime.strptime(timestamp, '%Y%m%d_%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
+        return {
+            'filename': filename,
+            'id': shot_id,
+            'timestamp': timestamp,
+            'shot_time': shot_time,
+            'machine_id': machine_id,
+            'plugin_version': plugin_version,
+            'upload_type': upload_type,
+            'data_size': data_size,
+            'clock': fields['clock'],
+            'profile': fields['profile'],
+            'bean': fields['bean'],
+            'shot_key': fields['shot_key'],
+            'anomaly': {'reasons': anomaly['reasons'], 'score': anomaly['score']}
+                       if anomaly and anomaly.get('flagged') else None
+        }
+    
+    def sync(self):
+        """为未索引的历史文件补建记录 / Index stored files that have no record yet"""
+        with self.lock:
+            known = set(self.records)
+        added = 0
+        for filename in sorted(os.listdir(DATA_DIR)):
+            if not is_shot_file(filename) or filename in known:
+                continue
+            filepath = os.path.join(DATA_DIR, filename)
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (ValueError, OSError):
+                data = {}
+            # 文件名格式: shot_YYYYMMDD_HHMMSS_<id>.json / Filename format
+            parts = filename[:-5].split('_')
+            timestamp = f"{parts[1]}_{parts[2]}" if len(parts) >= 4 else None
+            shot_id = int(parts[3]) if len(parts) >= 4 and parts[3].isdigit() else None
+            try:
+                record = self.build_record(filename, data, data_size=os.path.getsize(filepath),
+                                           shot_id=shot_id, timestamp=timestamp)
+            except ValueError:
+                record = self.build_record(filename, data, data_size=os.path.getsize(filepath),
+                                           shot_id=shot_id)
+            self.add(record)
+            added += 1
+        if added:
+            print(f"📇 索引了 {added} 个历史冲泡文件 / Indexed {added} stored shot files")
+        return added
+    
+    def query(self, date_from=None, date_to=None, machine_id=None, profile=None, bean=None):
+        """按日期、机器、方案和豆子筛选，按冲泡时间排序 / Filter by date, machine, profile and bean, sorted by shot time"""
+        with self.lock:
+            records = list(self.records.values())
+        profile = profile.lower() if profile else None
+        bean = bean.lower() if bean else None
+        result = []
+        for record in records:
+            day = (record.get('shot_time') or '')[:10]
+            if date_from and (not day or day < date_from):
+                continue
+            if date_to and (not day or day > date_to):
+                continue
+            if machine_id and record.get('machine_id') != machine_id:
+                continue
+            if profile and profile not in str(record.get('profile', '')).lower():
+                continue
+            if bean and bean not in str(record.get('bean', '')).lower():
+                continue
+            result.append(record)
+        result.sort(key=lambda r: (r.get('shot_time') or '', r['filename']))
+        return result
+
+shot_index = None
+shot_index_lock = threading.Lock()
+
+def get_shot_index():
+    """获取全局冲泡索引（延迟加载）/ Get the global shot index (lazily loaded)"""
+    global shot_index
+    # 启动时的索引线程和请求线程可能同时首次访问 / The startup index thread and request threads may get here first at the same time
+    with shot_index_lock:
+        if shot_index is None:
+            shot_index = ShotIndex(os.path.join(DATA_DIR, SHOT_INDEX_FILE))
+        return shot_index
+
+FEATURE_VERSION = "1"  # 特征向量布局版本 / Feature vector layout version
+FEATURE_GRID_SECONDS = 60.0  # 曲线重采样的时间范围 / Time span the curves are resampled over
+FEATURE_GRID_POINTS = 32  # 每条曲线的采样点数 / Samples per curve
+
+def load_shot_series(data):
+    """
+    把冲泡曲线转换为等长的NumPy数组
+    Convert the shot curves into equal-length NumPy arrays
+    """
+    series = {
+        'elapsed': np.asarray(data['elapsed'], dtype=np.float64),
+        'pressure': np.asarray(data['pressure']['pressure'], dtype=np.float64),
+        'flow': np.asarray(data['flow']['flow'], dtype=np.float64),
+        'flow_by_weight': np.asarray(data['flow']['by_weight'], dtype=np.float64),
+        'basket_temp': np.asarray(data['temperature']['basket'], dtype=np.float64),
+    }
+    min_length = min(len(values) for values in series.values())
+    return {name: values[:min_length] for name, values in series.items()}
+
+def parse_shot_upload(body):
+    """
+    单次解析上传：字节只解码和解析一次，曲线直接转换为NumPy数组，由分析和渲染共用
+    Single-parse upload: the bytes are decoded and parsed once and the curves go straight into NumPy arrays,
+    shared by analytics and rendering
+
+    返回 (冲泡数据, 曲线)；不是冲泡对象或曲线不完整时曲线为 None，渲染时再从文件读取
+    Returns (shot_data, series); series is None when the body is not a shot object or its curves are
+    incomplete, and rendering then falls back to reading the file
+    """
+    data = json.loads(body.decode('utf-8'))
+    try:
+        series = load_shot_series(data) if isinstance(data, dict) else None
+    except (KeyError, TypeError, ValueError):
+        series = None
+    return data, series
+
+def shot_feature_vector(series):
+    """
+    曲线特征：按固定量程归一化并重采样到公共时间网格，再加上汇总指标
+    Curve features: curves scaled to the fixed chart ranges and resampled onto a common time grid, plus summary metrics
+    """
+    elapsed = series['elapsed']
+    grid = np.linspace(0.0, FEATURE_GRID_SECONDS, FEATURE_GRID_POINTS)
+    # 冲泡结束后的点为0，使时长也体现在曲线中 / Points after the shot ended are 0, so duration shows in the curves
+    curves = [np.interp(grid, elapsed, series[name], left=0.0, right=0.0) / 10.0
+              for name in ('pressure', 'flow', 'flow_by_weight')]
+    duration = float(elapsed[-1] - elapsed[0]) if len(elapsed) else 0.0
+    by_weight = series['flow_by_weight']
+    # 梯形积分得到出液量 / Trapezoidal integral gives the beverage weight
+    weight = float(np.sum((by_weight[1:] + by_weight[:-1]) * np.diff(elapsed)) / 2.0) if len(elapsed) > 1 else 0.0
+    metrics = np.array([
+        duration / FEATURE_GRID_SECONDS,
+        float(series['pressure'].max()) / 10.0 if len(elapsed) else 0.0,
+        float(series['flow'].mean()) / 10.0 if len(elapsed) else 0.0,
+        weight / 60.0,
+        float(series['basket_temp'][0]) / 100.0 if len(elapsed) else 0.0,
+    ])
+    # 汇总指标与整条曲线同等重要 / Weight the summary block like a whole curve
+    metrics *= np.sqrt(FEATURE_GRID_POINTS / len(metrics))
+    return np.concatenate(curves + [metrics]).astype(np.float32)
+
+FEATURE_DIMENSION = FEATURE_GRID_POINTS * 3 + 5
+
+class ShotFeatureIndex:
+    """
+    冲泡曲线特征的内存矩阵，追加写入磁盘（.f32 行数据 + 文件名列表），支持向量化k近邻查询
+    In-memory matrix of shot curve features, appended to disk (.f32 rows + names file), answering vectorized k-NN queries
+    """
+    def __init__(self, base_path):
+        self.matrix_path = base_path + '.f32'
+        self.names_path = base_path + '.names'
+        self.lock = threading.Lock()
+        self.filenames = []
+        self.rows = {}
+        self.matrix = np.zeros((1024, FEATURE_DIMENSION), dtype=np.float32)
+        self.load()
+    
+    def load(self):
+        """加载特征；版本不符时重建 / Load features, rebuilding when the layout version changed"""
+        try:
+            if not (os.path.exists(self.names_path) and os.path.exists(self.matrix_path)):
+                return
+            with open(self.names_path, 'r', encoding='utf-8') as f:
+                header = f.readline().strip()
+                names = [line.strip() for line in f if line.strip()]
+            if header != f"v{FEATURE_VERSION}:{FEATURE_DIMENSION}":
+                print("🔄 特征格式已变化，将重新计算 / Feature layout changed, recomputing")
+                os.remove(self.names_path)
+                os.remove(self.matrix_path)
+                return
+            rows = np.fromfile(self.matrix_path, dtype=np.float32)
+            rows = rows[:len(rows) // FEATURE_DIMENSION * FEATURE_DIMENSION].reshape(-1, FEATURE_DIMENSION)
+            # 异常中断可能让两个文件长度不一致 / An interrupted write can leave the files out of step
+            count = min(len(names), len(rows))
+            for filename, vector in zip(names[:count], rows[:count]):
+                self._put(filename, vector)
+            # 磁盘行与内存行一一对应，重新加入时才能原位覆盖 / Disk rows must match memory rows so a re-add can overwrite in place
+            if len(self.filenames) != len(names) or len(names) != len(rows):
+                self._rewrite()
+        except Exception as e:
+            print(f"⚠️ 加载特征索引失败 / Failed to load feature index: {e}")
+    
+    def _rewrite(self):
+        """按内存中的行重写两个文件（去掉重复和残缺的行）/ Rewrite both files from the in-memory rows, dropping duplicates and partial rows"""
+        with open(self.matrix_path + '.tmp', 'wb') as f:
+            f.write(self.matrix[:len(self.filenames)].tobytes())
+        with open(self.names_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(f"v{FEATURE_VERSION}:{FEATURE_DIMENSION}\n")
+            f.writelines(name + '\n' for name in self.filenames)
+        os.replace(self.matrix_path + '.tmp', self.matrix_path)
+        os.replace(self.names_path + '.tmp', self.names_path)
+    
+    def _put(self, filename, vector):
+        row = self.rows.get(filename)
+        if row is None:
+            row = len(self.filenames)
+            if row >= len(self.matrix):
+                grown = np.zeros((len(self.matrix) * 2, FEATURE_DIMENSION), dtype=np.float32)
+                grown[:row] = self.matrix[:row]
+                self.matrix = grown
+            self.filenames.append(filename)
+            self.rows[filename] = row
+        self.matrix[row] = vector
+    
+    def add(self, filename, vector):
+        """
+        加入一个冲泡的特征并追加到磁盘；已有的冲泡（重新渲染或导入）原位替换其行
+        Add a shot's features and append them to disk; a shot already present (re-render or import) has its row replaced in place
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            row = self.rows.get(filename)
+            self._put(filename, vector)
+            if row is not None and os.path.exists(self.matrix_path):
+                with open(self.matrix_path, 'r+b') as f:
+                    f.seek(row * FEATURE_DIMENSION * vector.itemsize)
+                    f.write(vector.tobytes())
+                return
+            new_file = not os.path.exists(self.names_path)
+            with open(self.matrix_path, 'ab') as f:
+                f.write(vector.tobytes())
+            with open(self.names_path, 'a', encoding='utf-8') as f:
+                if new_file:
+                    f.write(f"v{FEATURE_VERSION}:{FEATURE_DIMENSION}\n")
+                f.write(filename + '\n')
+    
+    def add_shot(self, filename, data):
+        """从冲泡数据计算并加入特征 / Compute and add the features of a shot"""
+        try:
+            self.add(filename, shot_feature_vector(load_shot_series(data)))
+            return True
+        except Exception as e:
+            print(f"⚠️ 计算冲泡特征失败 / Failed to compute shot features: {filename}: {e}")
+            return False
+    
+    def has(self, filename):
+        """冲泡是否已有特征 / Whether a shot has features"""
+        with self.lock:
+            return filename in self.rows
+    
+    def count(self):
+        """已有特征的冲泡数 / Number of shots with features"""
+        with self.lock:
+            return len(self.filenames)
+    
+    def backfill(self):
+        """为还没有特征的历史冲泡计算特征 / Compute features for stored shots that have none yet"""
+        with self.lock:
+            known = set(self.rows)
+        added = 0
+        for filename in sorted(os.listdir(DATA_DIR)):
+            if not is_shot_file(filename) or filename in known:
+                continue
+            try:
+                with open(os.path.join(DATA_DIR, filename), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if self.add_shot(filename, data):
+                added += 1
+        if added:
+            print(f"🧮 计算了 {added} 个冲泡的曲线特征 / Computed curve features for {added} shots")
+        return added
+    
+    def similar(self, filename, k=5):
+        """返回与指定冲泡最相似的k个冲泡 / Return the k shots most similar to the given one"""
+        with self.lock:
+            row = self.rows.get(filename)
+            if row is None:
+                return None
+            count = len(self.filenames)
+            matrix = self.matrix[:count]
+            distances = np.sqrt(((matrix - matrix[row]) ** 2).sum(axis=1))
+            distances[row] = np.inf
+            k = max(0, min(k, count - 1))
+            if k == 0:
+                return []
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest])]
+            return [(self.filenames[i], float(distances[i])) for i in nearest]
+
+feature_index = None
+feature_index_lock = threading.Lock()
+
+def get_feature_index():
+    """获取全局特征索引（延迟加载）/ Get the global feature index (lazily loaded)"""
+    global feature_index
+    with feature_index_lock:
+        if feature_index is None:
+            feature_index = ShotFeatureIndex(os.path.join(DATA_DIR, SHOT_FEATURES_FILE))
+        return feature_index
+
+BASELINE_MIN_SHOTS = 5  # 基线至少包含的冲泡数 / Shots a baseline needs before it flags anything
+BASELINE_ALPHA = 0.1  # 滚动基线的指数衰减系数（约等于最近10杯）/ EW decay of the rolling baseline (~last 10 shots)
+ANOMALY_SIGMA = 3.0  # 包络宽度（标准差倍数）/ Envelope width in standard deviations
+ANOMALY_CURVE_FRACTION = 0.2  # 曲线超出包络的比例阈值 / Fraction of a curve outside the envelope that flags it
+ANOMALY_METRIC_SIGMA = 4.0  # 汇总指标的z分数阈值 / z-score threshold for summary metrics
+# 归一化后的最小标准差，避免几杯完全一样的冲泡使包络过窄 / Std floor (normalized units) so near-identical shots don't collapse the envelope
+ANOMALY_STD_FLOOR = 0.05
+
+ANOMALY_CURVES = ('pressure_curve', 'flow_curve', 'weight_curve')
+ANOMALY_METRICS = ('duration', 'peak_pressure', 'mean_flow', 'yield', 'start_temp')
+
+class ProfileBaselines:
+    """
+    按 (冲煮方案, 机器ID) 维护的滚动基线：在公共时间网格上增量更新均值/方差包络
+    Rolling baselines per (profile title, machine_id): an incrementally updated mean/variance envelope on a common time grid
+    """
+    SAVE_DELAY = 10.0  # 上传后合并写入的等待秒数 / Seconds uploads wait so their writes are coalesced
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.deferred = DeferredSave(self.save, self.SAVE_DELAY, 'shot baselines')
+        self.baselines = {}
+        self.load()
+    
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+                if payload.get('feature_version') == FEATURE_VERSION:
+                    for key, entry in payload.get('baselines', {}).items():
+                        self.baselines[key] = {
+                            'count': entry['count'],
+                            'mean': np.asarray(entry['mean'], dtype=np.float64),
+                            'var': np.asarray(entry['var'], dtype=np.float64)
+                        }
+        except Exception as e:
+            print(f"⚠️ 加载冲泡基线失败 / Failed to load shot baselines: {e}")
+    
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                payload = {
+                    'feature_version': FEATURE_VERSION,
+                    'baselines': {key: {'count': entry['count'],
+                                        'mean': entry['mean'].round(5).tolist(),
+                                        'var': entry['var'].round(6).tolist()}
+                                  for key, entry in self.baselines.items()}
+                }
+            write_json_atomic(self.path, payload)
+    
+    def save_later(self):
+        """
+        入库路径不做整文件写入，最多 SAVE_DELAY 秒后写一次 / Keep the full-file write off the ingest path; written at most SAVE_DELAY seconds later
+
+        异常退出最多丢失这段时间内的基线更新 / A crash loses at most the baseline updates from that window
+        """
+        self.deferred.request()
+    
+    @staticmethod
+    def key(profile, machine_id):
+        return f"{machine_id}|{profile}"
+    
+    def check_and_update(self, profile, machine_id, vector):
+        """
+        用当前基线检查冲泡，然后把它并入基线
+        Check a shot against the current baseline, then fold it into the baseline
+        """
+        start = time.perf_counter()
+        vector = np.asarray(vector, dtype=np.float64)
+        key = self.key(profile, machine_id)
+        reasons = []
+        score = 0.0
+        
+        with self.lock:
+            entry = self.baselines.get(key)
+            count = entry['count'] if entry else 0
+            if entry and count >= BASELINE_MIN_SHOTS:
+                std = np.sqrt(np.maximum(entry['var'], ANOMALY_STD_FLOOR ** 2))
+                z = np.abs(vector - entry['mean']) / std
+                points = FEATURE_GRID_POINTS
+                for i, name in enumerate(ANOMALY_CURVES):
+                    outside = float(np.mean(z[i * points:(i + 1) * points] > ANOMALY_SIGMA))
+                    if outside > ANOMALY_CURVE_FRACTION:
+                        reasons.append(name)
+                metric_z = z[len(ANOMALY_CURVES) * points:]
+                for name, value in zip(ANOMALY_METRICS, metric_z):
+                    if value > ANOMALY_METRIC_SIGMA:
+                        reasons.append(name)
+                score = float(z.max())
+            
+            # 指数加权的均值/方差增量更新 / Incremental exponentially weighted mean/variance update
+            if entry is None:
+                entry = {'count': 0, 'mean': vector.copy(), 'var': np.zeros_like(vector)}
+                self.baselines[key] = entry
+            else:
+                alpha = max(1.0 / (entry['count'] + 1), BASELINE_ALPHA)
+                diff = vector - entry['mean']
+                increment = alpha * diff
+                entry['mean'] += increment
+                entry['var'] = (1.0 - alpha) * (entry['var'] + diff * increment)
+            entry['count'] += 1
+        
+        return {
+            'flagged': bool(reasons),
+            'reasons': reasons,
+            'score': round(score, 2),
+            'baseline_shots': count,
+            'check_us': round((time.perf_counter() - start) * 1e6, 1)
+        }
+
+profile_baselines = None
+profile_baselines_lock = threading.Lock()
+
+def get_profile_baselines():
+    """获取全局冲泡基线（延迟加载）/ Get the global shot baselines (lazily loaded)"""
+    global profile_baselines
+    with profile_baselines_lock:
+        if profile_baselines is None:
+            profile_baselines = ProfileBaselines(os.path.join(DATA_DIR, BASELINES_FILE))
+        return profile_baselines
+
+class EventLog:
+    """
+    供网页轮询的事件环形缓冲区 / Ring buffer of events polled by the web dashboard
+    """
+    def __init__(self, size=200):
+        self.lock = threading.Lock()
+        self.events = []
+        self.size = size
+        self.seq = 0
+    
+    def publish(self, event_type, message, **data):
+        with self.lock:
+            self.seq += 1
+            self.events.append({
+                'seq': self.seq,
+                'type': event_type,
+                'message': message,
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'data': data
+            })
+            del self.events[:-self.size]
+    
+    def since(self, seq):
+        with self.lock:
+            return [event for event in self.events if event['seq'] > seq], self.seq
+
+event_log = EventLog()
+
+class StageTimings:
+    """
+    渲染和打印流水线的逐阶段耗时：每张冲泡的明细，以及每个阶段最近样本的滚动分位数
+    Per-stage timings of the render and print pipeline: a breakdown per shot, plus rolling
+    percentiles over each stage's recent samples
+    """
+    def __init__(self, window=None, shots=None):
+        self.lock = threading.Lock()
+        self.window = window or STAGE_TIMINGS_WINDOW
+        self.max_shots = shots or STAGE_TIMINGS_SHOTS
+        self.samples = {}  # 阶段 -> 最近的耗时（秒）/ stage -> recent durations (seconds)
+        self.counts = {}
+        self.shots = {}  # 冲泡 -> {阶段: 秒}，按到达顺序 / shot -> {stage: seconds}, in arrival order
+
+    def record(self, stage, seconds, shot=None):
+        with self.lock:
+            samples = self.samples.setdefault(stage, [])
+            samples.append(seconds)
+            del samples[:-self.window]
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+            if shot:
+                stages = self.shots.pop(shot, {})
+                # 同一阶段可能执行多次（如重新打印），按累计计 / A stage may run more than once (e.g. a reprint), so it accumulates
+                stages[stage] = round(stages.get(stage, 0.0) + seconds, 4)
+                self.shots[shot] = stages
+                while len(self.shots) > self.max_shots:
+                    self.shots.pop(next(iter(self.shots)))
+        if SLOW_STAGE_SECONDS and seconds >= SLOW_STAGE_SECONDS:
+            print(f"🐢 慢阶段 / Slow stage: {stage} {seconds * 1000:.0f} ms ({shot or '-'})")
+            event_log.publish('slow_stage', f"{stage}: {seconds * 1000:.0f} ms",
+                              stage=stage, seconds=round(seconds, 4), shot=shot)
+
+    @staticmethod
+    def _quantile(values, q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+    def snapshot(self, shot=None):
+        """各阶段的滚动分位数和最近冲泡的明细 / Rolling percentiles per stage and recent per-shot breakdowns"""
+        with self.lock:
+            if shot is not None:
+                return {'shot': shot, 'stages': dict(self.shots.get(shot, {}))}
+            stages = {}
+            for stage, samples in sorted(self.samples.items()):
+                values = sorted(samples)
+                stages[stage] = {
+                    'count': self.counts[stage],
+                    'window': len(values),
+                    'last': round(samples[-1], 4),
+                    'mean': round(sum(values) / len(values), 4),
+                    'p50': self._quantile(values, 0.5),
+                    'p95': self._quantile(values, 0.95),
+                    'p99': self._quantile(values, 0.99),
+                    'max': round(values[-1], 4)
+                }
+            shots = [{'shot': name, 'stages': dict(timings)} for name, timings in reversed(self.shots.items())]
+        return {'stages': stages, 'shots': shots, 'slow_stage_seconds': SLOW_STAGE_SECONDS}
+
+stage_timings = StageTimings()
+stage_context = threading.local()  # 当前线程正在处理的冲泡 / The shot the current thread is working on
+
+@contextlib.contextmanager
+def shot_stages(shot):
+    """把本线程中的阶段计时归到一张冲泡 / Attribute the stage timers on this thread to a shot"""
+    previous = getattr(stage_context, 'shot', None)
+    stage_context.shot = shot
+    try:
+        yield
+    finally:
+        stage_context.shot = previous
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """为一个阶段计时，出错时同样记录 / Time one stage, recorded even when it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_timings.record(stage, time.perf_counter() - started, getattr(stage_context, 'shot', None))
+
+class StageClock:
+    """
+    顺序执行的各阶段计时：每次 lap() 记录自上一次以来的耗时，done() 记录总耗时
+    Times stages that run one after another: each lap() records the time since the previous one, done() the total
+    """
+    def __init__(self, shot=None):
+        self.shot = shot
+        self.started = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        stage_timings.record(stage, now - self.last, self.shot or getattr(stage_context, 'shot', None))
+        self.last = now
+
+    def done(self, stage):
+        stage_timings.record(stage, time.perf_counter() - self.started, self.shot or getattr(stage_context, 'shot', None))
+
+class Profiler:
+    """
+    按需用 cProfile 剖析接下来的N次渲染或请求，或按比例抽样
+    On-demand cProfile of the next N renders or requests, or of a sampled fraction
+    
+    关闭时只多一次属性读取；同一时间只剖析一个，其他的照常运行
+    Disabled, it costs one attribute read; only one profile runs at a time and the rest run unprofiled
+    """
+    KINDS = ('render', 'request')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy = threading.Lock()
+        self.remaining = {kind: 0 for kind in self.KINDS}
+        self.sample = {kind: 0.0 for kind in self.KINDS}
+        self.active = False
+    
+    def configure(self, kind, count=None, sample=None):
+        """设置剩余次数和/或抽样比例 / Set the remaining count and/or sampled fraction"""
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown profile kind: {kind}")
+        with self.lock:
+            if count is not None:
+                self.remaining[kind] = max(0, int(count))
+            if sample is not None:
+                self.sample[kind] = min(1.0, max(0.0, float(sample)))
+            self.active = any(self.remaining.values()) or any(self.sample.values())
+        print(f"🔬 剖析设置 / Profiling: {kind} next={self.remaining[kind]} sample={self.sample[kind]:g}")
+    
+    def configure_from(self, spec):
+        """解析 "render:5,request:0.1"：整数为次数，小数为比例 / Parse "render:5,request:0.1": integers count, decimals sample"""
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            kind, _, value = item.partition(':')
+            if '.' in value:
+                self.configure(kind.strip(), sample=value)
+            else:
+                self.configure(kind.strip(), count=value or 1)
+    
+    def status(self):
+        with self.lock:
+            return {kind: {'remaining': self.remaining[kind], 'sample': self.sample[kind]} for kind in self.KINDS}
+    
+    def _claim(self, kind):
+        with self.lock:
+            if self.remaining[kind] > 0:
+                chosen = True
+            else:
+                chosen = self.sample[kind] > 0 and random.random() < self.sample[kind]
+            if not chosen or not self.busy.acquire(blocking=False):
+                return False
+            if self.remaining[kind] > 0:
+                self.remaining[kind] -= 1
+            self.active = any(self.remaining.values()) or any(self.sample.values())
+            return True
+    
+    @contextlib.contextmanager
+    def profile(self, kind, label):
+        """剖析一段代码并写入 PROFILE_DIR / Profile a block and write the result to PROFILE_DIR"""
+        if not self.active or not self._claim(kind):
+            yield
+            return
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        finally:
+            self.busy.release()
+            self._save(profiler, kind, label, time.perf_counter() - started)
+    
+    def _save(self, profiler, kind, label, seconds):
+        safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_')[:80] or 'unknown'
+        name = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{safe_label}.prof"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+            for old in list_profiles()[PROFILE_KEEP:]:
+                os.remove(os.path.join(PROFILE_DIR, old['name']))
+        except OSError as e:
+            print(f"⚠️ 保存剖析结果失败 / Failed to save profile: {e}")
+            return
+        print(f"🔬 剖析已保存 / Profile saved: {name} ({seconds * 1000:.0f} ms)")
+        event_log.publish('profile', f"Profile saved: {name}", name=name, kind=kind, seconds=round(seconds, 4))
+
+profiler = Profiler()
+
+def list_profiles():
+    """剖析文件，最新的在前 / Saved profiles, newest first"""
+    try:
+        names = [name for name in os.listdir(PROFILE_DIR) if name.endswith('.prof')]
+    except OSError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            continue
+        profiles.append({
+            'name': name,
+            'kind': name.split('_', 1)[0],
+            'size': stat.st_size,
+            'time': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            'mtime': stat.st_mtime
+        })
+    profiles.sort(key=lambda profile: profile['mtime'], reverse=True)
+    return profiles
+
+def profile_report(path, sort='cumulative', limit=40):
+    """pstats文本摘要 / pstats text summary"""
+    out = StringIO()
+    pstats.Stats(path, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+def analyze_shot(filename, data, machine_id='UNKNOWN', series=None, vector=None, profile=None):
+    """
+    入库时的曲线分析：计算特征向量、加入相似度索引，并对照方案基线检查异常
+    Ingest-time curve analysis: compute the feature vector, add it to the similarity index and check it against the profile baseline
+
+    series: 上传时已转换的曲线数组 / Curve arrays already converted at upload
+    vector, profile: 导入工作进程已算好的特征向量和方案名，提供时不再读取 data
+                     Feature vector and profile name already computed by an import worker; data is not read when given
+    """
+    started = time.perf_counter()
+    try:
+        if vector is None:
+            vector = shot_feature_vector(series if series is not None else load_shot_series(data))
+    except Exception as e:
+        print(f"⚠️ 计算冲泡特征失败 / Failed to compute shot features: {filename}: {e}")
+        return None
+    get_feature_index().add(filename, vector)
+    
+    baselines = get_profile_baselines()
+    if profile is None:
+        profile = describe_shot(data)['profile']
+    anomaly = baselines.check_and_update(profile, machine_id, vector)
+    baselines.save_later()
+    # 整个入库分析的耗时（特征、索引追加和检查），check_us 只包含检查 / Cost of the whole ingest analysis (features, index append and check); check_us covers only the check
+    anomaly['analyze_us'] = round((time.perf_counter() - started) * 1e6, 1)
+    
+    if anomaly['flagged']:
+        print(f"⚠️ 异常冲泡 / Unusual shot: {filename} ({', '.join(anomaly['reasons'])}, "
+              f"check {anomaly['check_us']}µs, analysis {anomaly['analyze_us']}µs)")
+        event_log.publish('anomaly', f"Unusual shot: {profile}", filename=filename,
+                          machine_id=machine_id, reasons=anomaly['reasons'])
+    return anomaly
+
+def resolve_shot_filename(shot_ref):
+    """把冲泡ID或文件名解析为DATA_DIR中的文件名 / Resolve a shot ID or filename to a file in DATA_DIR"""
+    shot_ref = os.path.basename(shot_ref)
+    if shot_ref.endswith('.json'):
+        return shot_ref if os.path.exists(os.path.join(DATA_DIR, shot_ref)) else None
+    if not shot_ref.isdigit():
+        return None
+    return get_shot_index().find_id(shot_ref)
+
+class ChunkedWriter:
+    """
+    以HTTP分块传输编码写出响应体，缓冲小块写入，内存占用恒定
+    Writes a response body with HTTP chunked transfer encoding; coalesces small writes in a bounded buffer
+    """
+    def __init__(self, wfile, chunked=True, buffer_size=64 * 1024):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.bytes_written = 0
+    
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+    
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(self.buffer) + bytes(self.buffer) + b'\r\n')
+        else:
+            self.wfile.write(bytes(self.buffer))
+        self.bytes_written += len(self.buffer)
+        self.buffer.clear()
+    
+    def close(self):
+        """发送剩余数据和结束块 / Send remaining data and the terminating chunk"""
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+def write_export_zip(writer, records, include_images=False):
+    """以流式ZIP写出冲泡数据（和可选图表）/ Stream shots (and optional charts) as a ZIP archive"""
+    with zipfile.ZipFile(writer, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for record in records:
+            json_path = os.path.join(DATA_DIR, record['filename'])
+            if not os.path.exists(json_path):
+                continue
+            zf.write(json_path, arcname=f"{DATA_DIR}/{record['filename']}")
+            if include_images:
+                image_name = record['filename'].replace('.json', '.png')
+                image_path = os.path.join(IMAGE_DIR, image_name)
+                if os.path.exists(image_path):
+                    # PNG已压缩，直接存储 / PNGs are already compressed, store as-is
+                    zf.write(image_path, arcname=f"{IMAGE_DIR}/{image_name}",
+                             compress_type=zipfile.ZIP_STORED)
+        with zf.open(SHOT_INDEX_FILE, mode='w') as index_file:
+            for record in records:
+                index_file.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+def write_export_ndjson(writer, records):
+    """每行一个冲泡：{"filename", "meta", "shot"} / One shot per line: {"filename", "meta", "shot"}"""
+    for record in records:
+        json_path = os.path.join(DATA_DIR, record['filename'])
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 导出时跳过 / Skipping in export: {record['filename']}: {e}")
+            continue
+        line = json.dumps({'filename': record['filename'], 'meta': record, 'shot': data},
+                          ensure_ascii=False, separators=(',', ':'))
+        writer.write(line.encode('utf-8') + b'\n')
+
+def parse_tcl_list(text):
+    """
+    解析Tcl列表（DE1旧版 .shot 文件使用的格式）
+    Parse a Tcl list, the format used by legacy DE1 .shot history files
+    """
+    items = []
+    i = 0
+    length = len(text)
+    while i < length:
+        while i < length and text[i].isspace():
+            i += 1
+        if i >= length:
+            break
+        if text[i] == '{':
+            depth = 1
+            start = i + 1
+            i += 1
+            while i < length and depth:
+                if text[i] == '\\':
+                    i += 1
+                elif text[i] == '{':
+                    depth += 1
+                elif text[i] == '}':
+                    depth -= 1
+                i += 1
+            items.append(text[start:i - 1])
+        elif text[i] == '"':
+            i += 1
+            word = []
+            while i < length and text[i] != '"':
+                if text[i] == '\\' and i + 1 < length:
+                    i += 1
+                word.append(text[i])
+                i += 1
+            i += 1
+            items.append(''.join(word))
+        else:
+            word = []
+            while i < length and not text[i].isspace():
+                if text[i] == '\\' and i + 1 < length:
+                    i += 1
+                word.append(text[i])
+                i += 1
+            items.append(''.join(word))
+    return items
+
+def _tcl_dict(text):
+    """把Tcl键值列表转换为字典 / Turn a Tcl key/value list into a dict"""
+    items = parse_tcl_list(text)
+    return dict(zip(items[0::2], items[1::2]))
+
+def convert_legacy_shot(text):
+    """
+    把DE1旧版 .shot 文件转换为插件上传的v2 JSON结构
+    Convert a legacy DE1 .shot file into the v2 JSON structure the plugin uploads
+    """
+    shot = _tcl_dict(text)
+    settings = _tcl_dict(shot.get('settings', ''))
+    
+    def series(key):
+        return [float(v) for v in parse_tcl_list(shot.get(key, ''))]
+    
+    elapsed = series('espresso_elapsed')
+    clock = shot.get('clock', '')
+    return {
+        'version': 2,
+        'clock': clock,
+        'timestamp': clock,
+        'elapsed': elapsed,
+        'pressure': {'pressure': series('espresso_pressure')},
+        'flow': {'flow': series('espresso_flow'), 'by_weight': series('espresso_flow_weight')},
+        'temperature': {'basket': series('espresso_temperature_basket')},
+        'profile': {
+            'title': settings.get('profile_title', 'Unknown Profile'),
+            'notes': settings.get('profile_notes', '')
+        },
+        'meta': {
+            'in': settings.get('grinder_dose_weight', 'N/A'),
+            'out': settings.get('drink_weight', 'N/A'),
+            'time': round(elapsed[-1], 1) if elapsed else 'N/A',
+            'grinder': {'setting': settings.get('grinder_setting', 'N/A')},
+            'bean': {
+                'brand': settings.get('bean_brand', ''),
+                'type': settings.get('bean_type', ''),
+                'notes': settings.get('bean_notes', ''),
+                'roast_level': settings.get('roast_level', ''),
+                'roast_date': settings.get('roast_date', '')
+            },
+            'shot': {'notes': settings.get('espresso_notes', '')}
+        }
+    }
+
+def normalize_shot_data(data):
+    """
+    校验渲染所需的曲线字段，返回规范化后的冲泡数据
+    Validate the curve fields rendering relies on and return the normalized shot data
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Shot data is not a JSON object")
+    try:
+        series = [data['elapsed'], data['pressure']['pressure'], data['flow']['flow'],
+                  data['flow']['by_weight'], data['temperature']['basket']]
+    except (KeyError, TypeError):
+        raise ValueError("Shot data is missing elapsed/pressure/flow/temperature series")
+    if min(len(s) for s in series) < 2:
+        raise ValueError("Shot data is too short")
+    if not isinstance(data.get('profile'), dict):
+        data['profile'] = {'title': str(data.get('profile') or 'Unknown Profile')}
+    if not isinstance(data.get('meta'), dict):
+        data['meta'] = {}
+    return data
+
+def shot_content_key(data):
+    """
+    与文件格式无关的冲泡内容键，用于去重
+    Format-independent content key of a shot, used for deduplication
+    """
+    try:
+        payload = [
+            str(data.get('clock', '')),
+            [round(float(v), 3) for v in data['elapsed']],
+            [round(float(v), 3) for v in data['pressure']['pressure']],
+            [round(float(v), 3) for v in data['flow']['flow']],
+        ]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return hashlib.sha1(json.dumps(payload, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def _import_worker(name, raw):
+    """
+    在工作进程中解析和规范化一个历史文件
+    Parse and normalize one history file inside a worker process
+    
+    返回 (name, error, shot_bytes, summary)；summary 含索引字段和特征向量，主进程无需再次解析
+    Returns (name, error, shot_bytes, summary); summary carries the index fields and feature vector,
+    so the main process never parses the shot again
+    """
+    try:
+        text = raw.decode('utf-8-sig', errors='replace')
+        if name.lower().endswith('.shot'):
+            data = convert_legacy_shot(text)
+        else:
+            data = json.loads(text)
+        data = normalize_shot_data(data)
+        shot_time = parse_shot_datetime(data) or datetime.now()
+        fields = shot_record_fields(data)
+        try:
+            vector = shot_feature_vector(load_shot_series(data))
+        except Exception:
+            vector = None  # 主进程的 analyze_shot 会报告 / Reported by analyze_shot in the main process
+        summary = {
+            'key': fields['shot_key'],
+            'clock': str(data.get('clock', '')),
+            'shot_time': shot_time.strftime('%Y%m%d_%H%M%S'),
+            'fields': fields,
+            'vector': vector,
+        }
+        return name, None, json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8'), summary
+    except Exception as e:
+        return name, str(e), None, None
+
+def iter_import_sources(path):
+    """
+    遍历目录或压缩包中的历史文件，逐个产出 (name, bytes)
+    Yield (name, bytes) for every history file in a directory or archive
+    """
+    suffixes = ('.json', '.shot')
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.lower().endswith(suffixes):
+                    with open(os.path.join(root, file), 'rb') as f:
+                        yield os.path.relpath(os.path.join(root, file), path), f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(suffixes):
+                    yield info.filename, zf.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as tf:
+            for member in tf:
+                if member.isfile() and member.name.lower().endswith(suffixes):
+                    yield member.name, tf.extractfile(member).read()
+    elif path.lower().endswith(suffixes):
+        with open(path, 'rb') as f:
+            yield os.path.basename(path), f.read()
+    else:
+        raise ValueError(f"Not a directory, archive or shot file: {path}")
+
+def import_shots(path, machine_id='UNKNOWN', render=True, workers=None, progress=None):
+    """
+    并行导入DE1历史数据：工作进程解析和规范化，主进程去重、保存并写入索引
+    Import DE1 history in parallel: workers parse and normalize, the main process dedups, stores and indexes
+    
+    progress(done, imported, duplicates, failed, elapsed) 在每个文件完成后调用 / is called after every file
+    """
+    start_time = time.time()
+    index = get_shot_index()
+    index.sync()
+    
+    # 已存储冲泡的内容键 / Content keys of everything already stored
+    known_keys = set()
+    # 启动时的索引线程可能仍在写入 / The startup index thread may still be adding records
+    with index.lock:
+        records = list(index.records.values())
+    for record in records:
+        key = record.get('shot_key')
+        if key is None:
+            try:
+                with open(os.path.join(DATA_DIR, record['filename']), 'r', encoding='utf-8') as f:
+                    key = shot_content_key(json.load(f))
+            except (OSError, ValueError):
+                key = None
+            if key:
+                index.add(dict(record, shot_key=key))
+        if key:
+            known_keys.add(key)
+    
+    imported = []
+    duplicates = 0
+    failed = []
+    done = 0
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    
+    def collect(future):
+        nonlocal done, duplicates
+        name, error, shot_bytes, summary = future.result()
+        done += 1
+        if error:
+            failed.append((name, error))
+        elif summary['key'] and summary['key'] in known_keys:
+            duplicates += 1
+        else:
+            if summary['key']:
+                known_keys.add(summary['key'])
+            shot_id = summary['clock'] if summary['clock'].isdigit() else str(int(time.time()))
+            filename = new_shot_filename(summary['shot_time'], shot_id)
+            with open(os.path.join(DATA_DIR, filename), 'wb') as f:
+                f.write(shot_bytes)
+            fields = summary['fields']
+            record = index.build_record(filename, None, machine_id, 'import', 'import',
+                                        len(shot_bytes), int(shot_id), summary['shot_time'], fields=fields)
+            record['anomaly'] = None
+            anomaly = analyze_shot(filename, None, machine_id, vector=summary['vector'], profile=fields['profile'])
+            if anomaly and anomaly['flagged']:
+                record['anomaly'] = {'reasons': anomaly['reasons'], 'score': anomaly['score']}
+            index.add(record)
+            imported.append(filename)
+        if progress:
+            progress(done, len(imported), duplicates, len(failed), time.time() - start_time)
+    
+    # 限制在途任务数量，内存占用与历史大小无关 / Bound in-flight work so memory does not grow with history size
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as executor:
+        in_flight = set()
+        for name, raw in iter_import_sources(path):
+            in_flight.add(executor.submit(_import_worker, name, raw))
+            if len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(future)
+        for future in as_completed(in_flight):
+            collect(future)
+    get_profile_baselines().save()
+    
+    parse_elapsed = time.time() - start_time
+    summary = {
+        'files': done,
+        'imported': len(imported),
+        'duplicates': duplicates,
+        'failed': failed,
+        'elapsed': round(parse_elapsed, 2),
+        'shots_per_second': round(done / parse_elapsed, 2) if parse_elapsed > 0 else 0.0,
+        'render': None
+    }
+    if render and imported:
+        summary['render'] = rerender_shots(imported, workers=workers)
+    return summary
+
+def print_raster_path(png_path, paper=None):
+    """图表对应的打印位图路径（每种纸张一个）/ Path of the print raster stored next to a chart (one per paper profile)"""
+    return f"{png_path[:-len('.png')]}{PRINT_RASTER_SUFFIX}_{paper or PAPER_PROFILE}.png"
+
+def save_print_raster(gray, raster_path, threshold=200):
+    """
+    灰度图二值化后保存为1位PNG（体积远小于BMP）
+    Threshold a grayscale image and store it as a 1-bit PNG (far smaller than BMP)
+    """
+    raster = gray.point(lambda p: 255 if p > threshold else 0).convert('1')
+    if isinstance(raster_path, SharedRaster):
+        return raster_path.store(raster)
+    # 先写临时文件再替换，打印时不会读到半个文件 / Write then rename so a print never reads a partial file
+    tmp_path = raster_path + '.tmp'
+    raster.save(tmp_path, 'PNG', optimize=True)
+    os.replace(tmp_path, raster_path)
+    return raster_path
+
+def generate_print_image(png_path, paper=None):
+    """
+    按纸张规格的原生点宽生成打印位图：有冲泡数据时直接重新光栅化，否则把PNG一次缩放到点宽
+    Generate the print raster at the paper's native dot width: re-rasterized from the shot data when
+    available, otherwise the PNG is scaled once to the dot width
+    """
+    with stage_timer('print.generate'):
+        raster_path = print_raster_path(png_path, paper)
+        filename = os.path.basename(png_path).replace('.png', '.json')
+        json_path = os.path.join(DATA_DIR, filename)
+        try:
+            if os.path.exists(json_path):
+                record = get_shot_index().get(filename) or {}
+                anomaly = (record.get('anomaly') or {}).get('reasons') or None
+                if create_coffee_plot(json_path, None, record.get('machine_id', 'UNKNOWN'), anomaly,
+                                      raster_file=raster_path, paper=paper):
+                    print(f"🖨️ Print image generated: {raster_path}")
+                    return raster_path
+        
+            dots = PAPER_PROFILES[paper or PAPER_PROFILE]['dots']
+            img = Image.open(png_path).convert('L')
+            img = img.resize((round(img.width * dots / img.height), dots), Image.LANCZOS)
+            save_print_raster(img.rotate(90, expand=True), raster_path)
+            print(f"🖨️ Print image generated: {raster_path}")
+            return raster_path
+        
+        except Exception as e:
+            print(f"❌ Print image generation failed: {str(e)}")
+            return png_path
+
+def get_print_raster(png_path, paper=None):
+    """
+    返回可直接提交的打印位图：已是最新则直接复用，否则现场生成
+    Return a print-ready raster: reuses an up-to-date file, otherwise generates it now
+    """
+    raster_path = print_raster_path(png_path, paper)
+    try:
+        if os.path.getmtime(raster_path) >= os.path.getmtime(png_path):
+            return raster_path
+    except OSError:
+        pass
+    return generate_print_image(png_path, paper)
+
+def compose_batch_raster(png_paths, cut_marks=True, paper=None):
+    """
+    把多个冲泡的1位打印位图首尾相接拼成一张连续小票；最新的位图直接复用，缺失或过期的由 get_print_raster 重新生成
+    Join several shots' 1-bit print rasters end to end into one continuous receipt; up-to-date rasters are
+    reused, missing or stale ones are regenerated by get_print_raster
+    
+    直接拼接打包后的位图行；cut_marks 在冲泡之间加入虚线裁切标记
+    Packed bitmap rows are concatenated as-is; cut_marks adds a dashed cut line between shots
+    位图生成失败的冲泡（get_print_raster 退回原始图表PNG）会被跳过，不与1位位图混拼；全部失败时抛出 RuntimeError
+    Shots whose raster generation failed (get_print_raster fell back to the chart PNG) are skipped rather than
+    spliced into the 1-bit receipt; raises RuntimeError if none succeeded
+    返回位图路径 / Returns the raster path
+    """
+    rasters = []
+    for png_path in png_paths:
+        raster_path = get_print_raster(png_path, paper)
+        if raster_path != print_raster_path(png_path, paper):
+            print(f"⚠️ 跳过无打印位图的冲泡 / Skipping shot without a print raster: {os.path.basename(png_path)}")
+            continue
+        img = Image.open(raster_path)
+        if img.mode != '1':
+            img = img.convert('1')
+        rasters.append(img)
+    if not rasters:
+        raise RuntimeError("no print raster could be generated for the batch")
+    width = max(img.width for img in rasters)
+    stride = (width + 7) // 8
+    
+    # 裁切标记：留白 + 虚线 + 留白，按设备点数缩放 / Cut mark: gap, dashed line, gap, scaled to device dots
+    scale = max(1, width // 576)
+    gap = b'\xff' * stride * (12 * scale)
+    dash_unit = max(1, scale)
+    dash_row = bytes((0x00 if (i // dash_unit) % 2 == 0 else 0xff) for i in range(stride))
+    separator = gap + dash_row * (2 * scale) + gap if cut_marks else b'\xff' * stride * (6 * scale)
+    
+    chunks = []
+    height = 0
+    for index, img in enumerate(rasters):
+        data = img.tobytes()  # 模式'1'按行打包，1=白 / Mode '1' packs rows, 1 = white
+        img_stride = (img.width + 7) // 8
+        if img_stride != stride:
+            # 较窄的位图右侧补白 / Pad narrower rasters with white on the right
+            pad = b'\xff' * (stride - img_stride)
+            data = b''.join(data[row * img_stride:(row + 1) * img_stride] + pad for row in range(img.height))
+        if index:
+            chunks.append(separator)
+            height += len(separator) // stride
+        chunks.append(data)
+        height += img.height
+    
+    batch = Image.frombytes('1', (stride * 8, height), b''.join(chunks))
+    if batch.width != width:
+        batch = batch.crop((0, 0, width, height))
+    fd, batch_path = tempfile.mkstemp(prefix='batch_', suffix=PRINT_RASTER_SUFFIX + '.png')
+    os.close(fd)
+    batch.save(batch_path, 'PNG', optimize=True)
+    print(f"🧾 合并 {len(rasters)} 张小票 / Composed {len(rasters)} receipts: {width}x{height}")
+    return batch_path
+
+def send_to_printer(image_path, destination=None, paper=None):
+    """
+    把图像发送到系统打印队列（同步）/ Send an image to the system print queue (blocking)
+    
+    destination: CUPS打印机名，None表示默认打印机（Windows总是使用默认打印机）
+                 CUPS destination, None for the default printer (Windows always uses the default printer)
+    paper: 纸张规格名；位图按原生分辨率1:1打印，纸长取自位图高度
+           Paper profile name; the raster prints 1:1 at native resolution and the paper length follows its height
+    返回 (是否成功, 后端任务ID或None) / Returns (success, backend job ID or None)
+    只应由打印调度器调用 / Should only be called by the print scheduler
+    """
+    if not os.path.exists(image_path):
+        print(f"❌ 图像文件不存在: {image_path}")
+        return False, None
+        
+    try:
+        print("🖨️ Sending print job...")
+        
+        if is_windows():
+            # Windows打印 - 尝试多种方法
+            print("🪟 使用Windows打印方式")
+            
+            # 方法1: 使用高级Windows打印API
+            success = windows_print_image(image_path)
+            if success:
+                return True, None
+                
+            # 方法2: 使用简单系统打印
+            print("🔄 尝试简单打印方法...")
+            success = windows_simple_print(image_path)
+            if success:
+                return True, None
+                
+            print("❌ 所有Windows打印方法都失败了")
+            return False, None
+        else:
+            # 纸长按位图高度计算，超过单页上限时CUPS会续打到下一页
+            # Paper length follows the raster height; beyond the page limit CUPS continues on the next page
+            profile = PAPER_PROFILES[paper or PAPER_PROFILE]
+            with Image.open(image_path) as img:
+                length_mm = min(math.ceil(img.height / profile['dpi'] * 25.4), profile['max_length_mm'])
+            # 按原生分辨率1:1打印，不让CUPS再缩放 / Print 1:1 at native resolution so CUPS does not rescale
+            options = [
+                '-o', f"media=Custom.{profile['width_mm']}x{length_mm}mm",
+                '-o', f"ppi={profile['dpi']}",
+                '-o', 'margin-top=0',
+                '-o', 'margin-bottom=0'
+            ]
+            
+            # 优先使用lp，它会返回CUPS任务ID以便跟踪 / Prefer lp, which reports the CUPS job ID for tracking
+            cmd = ['lp', image_path] + options
+            if destination:
+                cmd += ['-d', destination]
+            
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=PRINT_SUBMIT_TIMEOUT)
+            
+            if result.returncode == 0:
+                # 输出格式 / Output format: "request id is TM_T20-42 (1 file(s))"
+                match = re.search(r'request id is (\S+)', result.stdout)
+                backend_job_id = match.group(1) if match else None
+                print(f"✅ Print job sent (CUPS job {backend_job_id or 'unknown'})")
+                return True, backend_job_id
+            else:
+                # 备用打印命令 / Alternative print command
+                cmd = ['lpr', image_path] + options
+                if destination:
+                    cmd += ['-P', destination]
+                
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=PRINT_SUBMIT_TIMEOUT)
+                
+                if result.returncode == 0:
+                    print("✅ Print job sent (using lpr command)")
+                    return True, None
+                else:
+                    print(f"❌ Print failed: {result.stderr}")
+                    return False, None
+                    
+    except subprocess.TimeoutExpired as e:
+        print(f"❌ Print command timed out after {e.timeout}s: {e.cmd[0]}")
+        return False, None
+    except Exception as e:
+        print(f"❌ Print error: {str(e)}")
+        return False, None
+
+ESCPOS_BAND_LINES = 24  # 每条带的点行数，打印机收到第一条带即可开始走纸 / Dot rows per band; the printer starts feeding after the first one
+ESCPOS_TIMEOUT = 30  # 网络打印机连接超时（秒）/ Network printer connect timeout (seconds)
+ESCPOS_KEYS = ('device', 'baud', 'host', 'port', 'compression', 'band_lines')
+ESCPOS_INVERT = bytes(255 - i for i in range(256))
+
+def escpos_raster_commands(image_path, paper=None, compression='compact', band_lines=ESCPOS_BAND_LINES):
+    """
+    把1位打印位图逐条带编码为ESC/POS命令（生成器，每次产出一条带）
+    Encode a 1-bit print raster as ESC/POS commands, one band per yielded chunk
+    
+    compression:
+        'none'    每条带一个全宽的 GS v 0 / One full-width GS v 0 per band
+        'compact' 空白行改为走纸命令(ESC J)，每条带裁掉右侧空白字节；只用标准命令，所有ESC/POS打印机都支持
+                  Blank rows become paper feeds (ESC J) and each band is trimmed to its rightmost inked byte;
+                  standard commands only, so every ESC/POS printer accepts it
+    """
+    profile = PAPER_PROFILES[paper or PAPER_PROFILE]
+    img = Image.open(image_path)
+    if img.mode != '1':
+        img = img.convert('L').point(lambda p: 255 if p > 200 else 0).convert('1')
+    width, height = img.size
+    stride = (width + 7) // 8
+    # PIL模式'1'中1为白，ESC/POS中1为黑 / In PIL mode '1' a set bit is white, in ESC/POS it is black
+    data = img.tobytes().translate(ESCPOS_INVERT)
+    if width % 8:
+        # 清除行尾填充位，否则会打印成黑点 / Clear the row padding bits, which would otherwise print black
+        mask = (0xff << (8 - width % 8)) & 0xff
+        rows = bytearray(data)
+        for row in range(height):
+            rows[row * stride + stride - 1] &= mask
+        data = bytes(rows)
+    
+    # 初始化，并把走纸单位设为点距 / Initialize and set the motion unit to one dot
+    yield b'\x1b@' + b'\x1dP' + bytes([profile['dpi'], profile['dpi']])
+    
+    def band(start, count):
+        chunk = data[start * stride:(start + count) * stride]
+        xbytes = stride
+        if compression == 'compact':
+            xbytes = max(len(chunk[i:i + stride].rstrip(b'\x00')) for i in range(0, len(chunk), stride)) or 1
+            chunk = b''.join(chunk[i:i + xbytes] for i in range(0, len(chunk), stride))
+        return b'\x1dv0\x00' + bytes([xbytes & 0xff, xbytes >> 8, count & 0xff, count >> 8]) + chunk
+    
+    row = 0
+    blank = 0
+    while row < height:
+        if compression == 'compact' and not any(data[row * stride:(row + 1) * stride]):
+            blank += 1
+            row += 1
+            continue
+        feed = b''
+        while blank:
+            feed += b'\x1bJ' + bytes([min(blank, 255)])
+            blank -= min(blank, 255)
+        count = 1
+        while count < band_lines and row + count < height:
+            if compression == 'compact' and not any(data[(row + count) * stride:(row + count + 1) * stride]):
+                break
+            count += 1
+        yield feed + band(row, count)
+        row += count
+    
+    tail = b''
+    while blank:
+        tail += b'\x1bJ' + bytes([min(blank, 255)])
+        blank -= min(blank, 255)
+    # 有切刀时走纸到切刀位置并半切，否则多走几行便于撕纸
+    # Feed to the cutter and partial-cut when there is one, otherwise feed a few lines for tearing off
+    yield tail + (b'\x1dVB\x00' if profile['cutter'] else b'\x1bd\x04')
+
+def open_escpos_transport(config):
+    """
+    打开原始打印机连接：串口/蓝牙设备文件（device, baud）或网络打印机（host, port）
+    Open a raw printer connection: serial/Bluetooth device file (device, baud) or network printer (host, port)
+    """
+    if config.get('host'):
+        import socket
+        sock = socket.create_connection((config['host'], int(config.get('port') or 9100)), timeout=ESCPOS_TIMEOUT)
+        transport = sock.makefile('wb', buffering=0)
+        sock.close()  # 文件对象关闭时才真正关闭连接 / The connection closes when the file object does
+        return transport
+    
+    # 非阻塞打开，写入时用 select 限时，打印机停止接收数据时不会永久卡住
+    # Opened non-blocking and written with a select timeout, so a printer that stops reading cannot hang the worker
+    fd = os.open(config['device'], os.O_WRONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        import termios
+        import tty
+    except ImportError:
+        termios = None
+    if termios is not None:
+        try:
+            # 串口设为原始模式并设置波特率；rfcomm/USB设备不是终端时忽略
+            # Put a serial port into raw mode at the configured baud rate; ignored when the device is not a tty
+            tty.setraw(fd)
+            baud = getattr(termios, f"B{int(config.get('baud') or 115200)}", None)
+            if baud is not None:
+                attrs = termios.tcgetattr(fd)
+                attrs[4] = attrs[5] = baud
+                termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except termios.error:
+            pass
+    return os.fdopen(fd, 'wb', buffering=0)
+
+def escpos_write(transport, chunk, timeout=ESCPOS_TIMEOUT):
+    """写入一条带，设备缓冲区满时最多等待 timeout 秒 / Write one band, waiting at most timeout seconds while the device buffer is full"""
+    import select
+    view = memoryview(chunk)
+    while view:
+        written = transport.write(view)
+        if written is None:
+            if not select.select([], [transport], [], timeout)[1]:
+                raise TimeoutError(f"printer accepted no data for {timeout}s")
+            continue
+        view = view[written:]
+
+def send_escpos(image_path, config, paper=None):
+    """
+    绕过CUPS，把打印位图以ESC/POS逐条带发送到串口、蓝牙或网络打印机
+    Send a print raster straight to a serial, Bluetooth or network printer as ESC/POS, band by band
+    
+    返回值与 send_to_printer 相同 / Returns the same as send_to_printer
+    """
+    started = time.time()
+    sent = 0
+    try:
+        with open_escpos_transport(config) as transport:
+            for chunk in escpos_raster_commands(image_path, paper, config.get('compression') or 'compact',
+                                                int(config.get('band_lines') or ESCPOS_BAND_LINES)):
+                escpos_write(transport, chunk)
+                sent += len(chunk)
+        print(f"✅ ESC/POS job sent: {sent} bytes in {time.time() - started:.2f}s "
+              f"to {config.get('host') or config.get('device')}")
+        return True, None
+    except (OSError, ValueError) as e:
+        print(f"❌ ESC/POS print failed: {e}")
+        return False, None
+
+def get_cups_jobs():
+    """
+    读取CUPS中未完成的任务 / Read unfinished jobs from CUPS
+    
+    返回 {任务ID: {'status', 'submitted'}}，lpstat不可用时返回None
+    Returns {job_id: {'status', 'submitted'}}, or None when lpstat is unavailable
+    """
+    try:
+        result = subprocess.run(['lpstat', '-o'], capture_output=True, text=True, timeout=CUPS_QUERY_TIMEOUT)
+        if result.returncode != 0:
+            return None
+        jobs = {}
+        for line in result.stdout.split('\n'):
+            # 格式 / Format: "TM_T20-42  user  10240  Mon 19 Oct 2026 10:00:00 AM CEST"
+            parts = line.split()
+            if len(parts) >= 4:
+                jobs[parts[0]] = {'status': 'Pending', 'submitted': ' '.join(parts[3:])}
+        # 正在打印的任务 / Jobs currently printing: "printer TM_T20 now printing TM_T20-42.  enabled since ..."
+        result = subprocess.run(['lpstat', '-p'], capture_output=True, text=True, timeout=CUPS_QUERY_TIMEOUT)
+        for match in re.finditer(r'now printing (\S+?)\.?(\s|$)', result.stdout):
+            if match.group(1) in jobs:
+                jobs[match.group(1)]['status'] = 'Printing'
+        return jobs
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def probe_printer(destination=None, raw=None):
+    """
+    检查打印机是否可用（有超时，不会阻塞）/ Check whether a printer is reachable (bounded, never blocks)
+    
+    CUPS打印机查询 lpstat -p，网络打印机尝试连接，串口/蓝牙打印机检查设备文件
+    CUPS printers are queried with lpstat -p, network printers are connected to, serial/Bluetooth device files are checked
+    返回 (是否可用, 错误信息) / Returns (ok, error)
+    """
+    try:
+        if raw and raw.get('host'):
+            import socket
+            socket.create_connection((raw['host'], int(raw.get('port') or 9100)), timeout=PRINTER_PROBE_TIMEOUT).close()
+            return True, None
+        if raw:
+            return (True, None) if os.path.exists(raw['device']) else (False, f"device {raw['device']} not found")
+        cmd = ['lpstat', '-p'] + ([destination] if destination else [])
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=CUPS_QUERY_TIMEOUT)
+        if result.returncode != 0:
+            return False, (result.stderr.strip() or f"lpstat exited with {result.returncode}")
+        if re.search(r'\bdisabled\b', result.stdout):
+            return False, 'printer disabled in CUPS'
+        return True, None
+    except subprocess.TimeoutExpired:
+        return False, f"CUPS did not answer within {CUPS_QUERY_TIMEOUT}s"
+    except (OSError, subprocess.SubprocessError) as e:
+        return False, str(e)
+
+class LatencyHistogram:
+    """
+    固定分桶的延迟直方图（秒）/ Fixed-bucket latency histogram (seconds)
+    """
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, value):
+        value = max(0.0, value)
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+    
+    def quantile(self, q):
+        """按桶上界估算分位数 / Estimate a quantile as the upper bound of its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+    
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': round(self.max, 3),
+            'buckets': {f"le_{bound:g}": count for bound, count in zip(self.BUCKETS, self.counts)},
+            'overflow': self.counts[-1]
+        }
+    
+    def exposition(self):
+        """Prometheus格式的累计桶、总和与次数 / Cumulative buckets, sum and count in the Prometheus form"""
+        buckets, seen = [], 0
+        for bound, count in zip(self.BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            buckets.append((bound, seen))
+        return buckets, self.total, self.count
+
+class Metrics:
+    """
+    进程内的计数器和直方图，以Prometheus文本格式导出
+    In-process counters and histograms, exported in the Prometheus text format
+    
+    记录只是一次加锁的字典更新；格式化和仪表读取都在抓取时进行
+    Recording is a single locked dict update; formatting and gauge reads happen on scrape
+    """
+    PREFIX = 'printtheshot_'
+    MACHINE_LABELS = 16  # 未登记机器的标签上限，之后归为'other' / Labels for unregistered machines before 'other'
+    HELP = {
+        'uploads_total': ('counter', 'Shots uploaded, by machine and upload type'),
+        'upload_bytes_total': ('counter', 'Shot bytes received, by machine and upload type'),
+        'http_requests_total': ('counter', 'HTTP requests, by method and route'),
+        'render_seconds': ('histogram', 'Chart and print raster render time'),
+        'render_failures_total': ('counter', 'Uploads whose chart could not be rendered'),
+        'render_busy_seconds_total': ('counter', 'Time spent rendering; its rate is render worker utilization'),
+        'renders_in_progress': ('gauge', 'Renders currently running'),
+        'print_latency_seconds': ('histogram', 'Print job latency per stage, from upload to paper'),
+        'print_jobs_total': ('counter', 'Print attempts, by printer and result'),
+        'print_failovers_total': ('counter', 'Print jobs moved to another printer'),
+        'print_queue_depth': ('gauge', 'Unfinished print jobs per printer'),
+        'print_worker_busy_seconds_total': ('counter', 'Time print workers spent on jobs; its rate is worker utilization'),
+        'printer_up': ('gauge', 'Whether the printer circuit breaker is closed'),
+        'shots_received': ('gauge', 'Shots in the recent received list'),
+        'threads': ('gauge', 'Live Python threads'),
+        'process_resident_memory_bytes': ('gauge', 'Resident set size of the server process'),
+        'process_start_time_seconds': ('gauge', 'Server start time as a Unix timestamp'),
+    }
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}      # (name, labels) -> number
+        self.histograms = {}  # (name, labels) -> LatencyHistogram
+        self.machines = set()  # 已分配标签的未登记机器 / Unregistered machines that were given a label
+    
+    def machine_label(self, machine_id, registered=()):
+        """
+        上传查询参数中的 machine_id 不可信：printers.json 中登记的机器原样使用，其余机器按先到先得最多
+        MACHINE_LABELS 个，之后归为 'other'，避免标签无限增长
+        machine_id comes from an untrusted query parameter: machines registered in printers.json keep their ID,
+        other machines get one first come, first served up to MACHINE_LABELS, then 'other', so label cardinality
+        stays bounded
+        """
+        if machine_id in registered:
+            return machine_id
+        with self.lock:
+            if machine_id in self.machines:
+                return machine_id
+            if len(self.machines) < self.MACHINE_LABELS:
+                self.machines.add(machine_id)
+                return machine_id
+        return 'other'
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+    
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+    
+    @staticmethod
+    def _format(name, labels, value):
+        if labels:
+            pairs = ','.join('{}="{}"'.format(key, str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for key, val in labels)
+            name = f"{name}{{{pairs}}}"
+        if isinstance(value, float):
+            value = '+Inf' if value == float('inf') else repr(round(value, 6))
+        return f"{name} {value}"
+    
+    def exposition(self, samples=()):
+        """
+        生成文本格式；samples 为抓取时读取的 (名称, 标签, 值或直方图) 
+        Build the text format; samples are (name, labels, value or histogram exposition) read at scrape time
+        """
+        with self.lock:
+            collected = [(name, labels, value) for (name, labels), value in self.values.items()]
+            collected += [(name, labels, histogram.exposition()) for (name, labels), histogram in self.histograms.items()]
+        families = {}
+        for name, labels, value in list(collected) + list(samples):
+            families.setdefault(name, []).append((tuple(labels), value))
+        lines = []
+        for name in sorted(families):
+            kind, text = self.HELP.get(name, ('untyped', name))
+            full = self.PREFIX + name
+            lines.append(f"# HELP {full} {text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in sorted(families[name], key=lambda sample: sample[0]):
+                if kind != 'histogram':
+                    lines.append(self._format(full, labels, value))
+                    continue
+                buckets, total, count = value
+                for bound, seen in buckets:
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    lines.append(self._format(full + '_bucket', labels + (('le', le),), seen))
+                lines.append(self._format(full + '_sum', labels, float(total)))
+                lines.append(self._format(full + '_count', labels, count))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class PrinterRegistry:
+    """
+    打印机池：按机器ID路由、在池内负载均衡、故障时切换
+    Printer pool: routes by machine ID, balances load across the pool and fails over on errors
+    
+    printers.json 示例 / example:
+        {"printers": [
+            {"name": "left", "destination": "TM_T20_left", "machines": ["DE1-A"]},
+            {"name": "right", "destination": "TM_T20_right"},
+            {"name": "bar", "device": "/dev/rfcomm0", "baud": 115200, "paper": "58mm"}
+        ]}
+    没有 machines 的打印机组成共享池 / Printers without machines form the shared pool
+    有 device 或 host 的打印机绕过CUPS直接发送ESC/POS / Printers with a device or host get ESC/POS directly, bypassing CUPS
+    """
+    def __init__(self, printers=None):
+        self.lock = threading.Lock()
+        self.printers = {}
+        for printer in printers or [{'name': PrintScheduler.DEFAULT_PRINTER, 'destination': None}]:
+            self.printers[printer['name']] = {
+                'name': printer['name'],
+                'destination': printer.get('destination'),
+                'paper': printer.get('paper') if printer.get('paper') in PAPER_PROFILES else None,
+                'machines': list(printer.get('machines') or []),
+                'raw': {key: printer[key] for key in ESCPOS_KEYS if key in printer}
+                       if printer.get('device') or printer.get('host') else None,
+                'consecutive_failures': 0,
+                'breaker': 'closed',  # closed / open / half_open
+                'opened_at': None,
+                'last_error': None,
+                'probe': None
+            }
+    
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                printers = json.load(f).get('printers') or None
+            registry = cls(printers)
+            print(f"🖨️ 已加载打印机池 / Loaded printer pool: {', '.join(registry.printers)}")
+            return registry
+        except (ValueError, OSError, KeyError, AttributeError) as e:
+            print(f"⚠️ 打印机配置无效，使用默认打印机 / Invalid printer config, using default printer: {e}")
+            return cls()
+    
+    def machines(self):
+        """printers.json 中登记的所有机器ID / Every machine ID registered in printers.json"""
+        return {machine for printer in self.printers.values() for machine in printer['machines']}
+    
+    def destination(self, name):
+        printer = self.printers.get(name)
+        return printer['destination'] if printer else None
+    
+    def paper(self, name):
+        """打印机的纸张规格，未配置时为默认 / Paper profile of a printer, the default when not configured"""
+        printer = self.printers.get(name)
+        return (printer['paper'] if printer else None) or PAPER_PROFILE
+    
+    def raw(self, name):
+        """直连ESC/POS打印机的连接配置，CUPS打印机为None / Connection settings of a raw ESC/POS printer, None for CUPS printers"""
+        printer = self.printers.get(name)
+        return printer['raw'] if printer else None
+    
+    def _healthy(self, printer):
+        if printer['breaker'] != 'open':
+            return True
+        # 冷却时间过后允许再次尝试 / Allow another attempt once the cooldown has passed
+        return time.time() - printer['opened_at'] >= PRINTER_RETRY_AFTER
+    
+    def route(self, machine_id=None, load=None, exclude=()):
+        """
+        为机器选择打印机：专用打印机 > 共享池 > 任意健康打印机，同级中选队列最短的
+        Pick a printer for a machine: dedicated > shared pool > any healthy printer, shortest queue within a tier
+        
+        没有可用打印机时返回 None / Returns None when no printer is available
+        """
+        load = load or {}
+        with self.lock:
+            candidates = [p for p in self.printers.values() if p['name'] not in exclude]
+            healthy = [p for p in candidates if self._healthy(p)]
+            tiers = (
+                [p for p in healthy if machine_id and machine_id in p['machines']],
+                [p for p in healthy if not p['machines']],
+                healthy
+            )
+            for tier in tiers:
+                if tier:
+                    return min(tier, key=lambda p: (load.get(p['name'], 0), p['consecutive_failures']))['name']
+            # 全部故障时仍尝试最早出故障的那台 / If all are down, still try the one that failed first
+            if candidates and not exclude:
+                return min(candidates, key=lambda p: p['opened_at'] or 0)['name']
+            return None
+    
+    def is_healthy(self, name):
+        with self.lock:
+            printer = self.printers.get(name)
+            return printer is not None and printer['breaker'] == 'closed'
+    
+    def retry_in(self, name):
+        """
+        断路器：距离允许下一次提交还有多少秒，0表示可以提交
+        Circuit breaker: seconds until the next submission is allowed, 0 when it may go ahead
+        
+        打开状态冷却结束后转为半开，放行一个试探任务 / An open breaker turns half-open after the cooldown and lets one trial job through
+        """
+        with self.lock:
+            printer = self.printers.get(name)
+            if printer is None or printer['breaker'] != 'open':
+                return 0
+            remaining = printer['opened_at'] + PRINTER_RETRY_AFTER - time.time()
+            if remaining > 0:
+                return remaining
+            printer['breaker'] = 'half_open'
+            print(f"🔌 断路器半开，试探打印 / Breaker half-open, sending a trial job: {name}")
+            return 0
+    
+    def mark_success(self, name):
+        with self.lock:
+            printer = self.printers.get(name)
+            if printer:
+                if printer['breaker'] != 'closed':
+                    print(f"✅ 打印机已恢复 / Printer recovered: {name}")
+                printer['consecutive_failures'] = 0
+                printer['breaker'] = 'closed'
+                printer['opened_at'] = None
+    
+    def mark_failure(self, name, error=None):
+        with self.lock:
+            printer = self.printers.get(name)
+            if not printer:
+                return
+            printer['consecutive_failures'] += 1
+            printer['last_error'] = error
+            # 半开时试探失败立即重新打开 / A failed trial re-opens a half-open breaker straight away
+            if printer['consecutive_failures'] >= PRINTER_FAILURE_THRESHOLD or printer['breaker'] == 'half_open':
+                if printer['breaker'] == 'closed':
+                    print(f"⚠️ 打印机故障，断路器打开 / Printer failing, breaker opened: {name}")
+                printer['breaker'] = 'open'
+                printer['opened_at'] = time.time()
+    
+    def record_probe(self, name, ok, error=None):
+        """
+        记录健康探测结果：失败计入断路器，成功时让打开的断路器立即半开
+        Record a health probe: failures count towards the breaker, success lets an open breaker go half-open now
+        """
+        with self.lock:
+            printer = self.printers.get(name)
+            if not printer:
+                return
+            printer['probe'] = {'ok': ok, 'error': error, 'checked': datetime.now().strftime('%H:%M:%S')}
+            if ok and printer['breaker'] == 'open':
+                printer['opened_at'] = time.time() - PRINTER_RETRY_AFTER
+        if not ok:
+            self.mark_failure(name, error)
+    
+    def configs(self):
+        """用于健康探测的 (名称, CUPS目标, 直连配置) / (name, CUPS destination, raw config) for health probes"""
+        with self.lock:
+            return [(p['name'], p['destination'], p['raw']) for p in self.printers.values()]
+    
+    def status(self):
+        with self.lock:
+            return {name: {
+                'destination': p['destination'] or (p['raw'] and (p['raw'].get('host') or p['raw'].get('device')))
+                               or '(default)',
+                'paper': p['paper'] or PAPER_PROFILE,
+                'machines': p['machines'],
+                'healthy': p['breaker'] == 'closed',
+                'breaker': p['breaker'],
+                'opened_at': datetime.fromtimestamp(p['opened_at']).strftime('%H:%M:%S') if p['opened_at'] else None,
+                'consecutive_failures': p['consecutive_failures'],
+                'last_error': p['last_error'],
+                'probe': p['probe']
+            } for name, p in self.printers.items()}
+
+printer_registry = None
+printer_registry_lock = threading.Lock()
+
+def get_printer_registry():
+    """获取全局打印机池（延迟加载）/ Get the global printer pool (lazily loaded)"""
+    global printer_registry
+    with printer_registry_lock:
+        if printer_registry is None:
+            printer_registry = PrinterRegistry.load(PRINTERS_FILE)
+        return printer_registry
+
+class PrintScheduler:
+    """
+    集中式打印调度器：每台打印机一个优先级队列和一个工作线程
+    Central print scheduler: one priority queue and one worker thread per printer
+    
+    - 手动打印优先于自动打印 / Manual prints go ahead of auto-prints
+    - 按打印机实际速度限流 / Throttled to the printer's real throughput
+    - 同一冲泡的重复任务会合并 / Duplicate jobs for the same shot are coalesced
+    - 通过打印机池路由，失败时切换到其他打印机 / Routed through the printer pool, failing over on errors
+    """
+    DEFAULT_PRINTER = 'default'
+    HISTORY_SIZE = 100
+    FINISHED = ('done', 'failed', 'cancelled', 'unknown')
+    LATENCY_STAGES = ('render', 'queue', 'raster', 'submit', 'printer', 'total')
+    EMPTY_STATS = {
+        'submitted': 0, 'printed': 0, 'failed': 0, 'coalesced': 0, 'failovers': 0,
+        'total_wait': 0.0, 'max_wait': 0.0, 'first_print': None, 'last_print': None, 'busy': 0.0
+    }
+    
+    def __init__(self, min_interval=PRINT_MIN_INTERVAL, sender=send_to_printer, registry=None):
+        self.cond = threading.Condition()
+        self.min_interval = min_interval
+        self.sender = sender
+        self.registry = registry or PrinterRegistry()
+        self.queues = {}     # printer -> heap of (priority, seq, job_id)
+        self.workers = {}    # printer -> thread
+        self.jobs = {}       # job_id -> job
+        self.pending = {}    # shot -> job_id，用于合并 / for coalescing
+        self.stats = {}      # printer -> counters
+        self.last_print = {}  # printer -> monotonic time of last finished job
+        self.seq = 0
+        self.tracker = None  # CUPS状态轮询线程 / CUPS status polling thread
+        self.prober = None   # 打印机健康探测线程 / Printer health probe thread
+        self.cups_jobs = {}  # 后台线程最近读取的CUPS任务 / CUPS jobs last read by a background thread
+        self.cups_checked_at = None
+        self.latency = {stage: LatencyHistogram() for stage in self.LATENCY_STAGES}
+    
+    def _printer_stats(self, printer):
+        return self.stats.setdefault(printer, dict(self.EMPTY_STATS))
+    
+    def _load(self):
+        """在锁内调用：各打印机未完成的任务数 / Called with the lock held: unfinished jobs per printer"""
+        load = {}
+        for job in self.jobs.values():
+            if job['status'] in ('queued', 'printing'):
+                load[job['printer']] = load.get(job['printer'], 0) + 1
+        return load
+    
+    def _enqueue(self, job):
+        """在锁内调用；重新排队的任务保持原来的先后顺序 / Called with the lock held; re-queued jobs keep their original place"""
+        if 'seq' not in job:
+            self.seq += 1
+            job['seq'] = self.seq
+        heapq.heappush(self.queues.setdefault(job['printer'], []), (job['priority'], job['seq'], job['id']))
+        if job['printer'] not in self.workers:
+            worker = threading.Thread(target=self._run, args=(job['printer'],), daemon=True,
+                                      name=f"print-{job['printer']}")
+            self.workers[job['printer']] = worker
+            worker.start()
+        self.cond.notify_all()
+    
+    def submit(self, image_path, shot=None, priority=PRINT_PRIORITY_AUTO, printer=None, raster=False,
+               machine_id=None, received_at=None, rendered_at=None, batch=None, cut_marks=True):
+        """
+        提交打印任务；若同一冲泡已在队列中或等待重试则合并（并按需提升优先级）
+        Submit a print job; coalesces with a queued or retrying job for the same shot (raising its priority if needed)
+        
+        printer 为空时按 machine_id 从打印机池中路由 / Routed by machine_id through the pool when printer is not given
+        received_at/rendered_at: 上传接收和图表渲染完成的时间，用于端到端延迟统计
+                                 When the upload was received and the chart rendered, for end-to-end latency
+        batch: 合并为一张小票打印的多个图表路径 / Chart paths printed together as one receipt
+        """
+        shot = shot or os.path.basename(image_path)
+        with self.cond:
+            existing = self.jobs.get(self.pending.get(shot))
+            # 等待重试的任务与排队中的一样尚未打印（同 cancel_all）/ A retrying job has not printed yet either (as in cancel_all)
+            if existing and existing['status'] in ('queued', 'retrying'):
+                self._printer_stats(existing['printer'])['coalesced'] += 1
+                existing['coalesced'] += 1
+                if priority < existing['priority']:
+                    existing['priority'] = priority
+                    # 旧的堆条目会在出队时被跳过；等待重试的任务在 _retry 时再入队
+                    # The stale heap entry is skipped when popped; a retrying job is queued again by _retry
+                    if existing['status'] == 'queued':
+                        self._enqueue(existing)
+                print(f"🖨️ 合并重复打印任务 / Coalesced duplicate print job: {shot}")
+                return dict(existing)
+            
+            printer = printer or self.registry.route(machine_id, self._load()) or self.DEFAULT_PRINTER
+            job = {
+                'id': self.seq + 1,
+                'shot': shot,
+                'image_path': image_path,
+                'printer': printer,
+                'machine_id': machine_id,
+                'priority': priority,
+                'raster': raster,
+                'batch': batch,
+                'cut_marks': cut_marks,
+                'status': 'queued',
+                'coalesced': 0,
+                'tried': [],
+                'retries': 0,
+                'error': None,
+                'backend_job_id': None,
+                'backend_status': None,
+                'received_at': received_at,
+                'rendered_at': rendered_at,
+                'queued_at': time.time(),
+                'started_at': None,
+                'rasterized_at': None,
+                'submitted_at': None,
+                'completed_at': None,
+                'finished_at': None
+            }
+            self.jobs[job['id']] = job
+            self.pending[shot] = job['id']
+            self._printer_stats(printer)['submitted'] += 1
+            self._trim_history()
+            self._enqueue(job)
+            self._publish(job)
+            return dict(job)
+    
+    def _publish(self, job):
+        """把任务状态变化推送给网页 / Push a job status change to the dashboard"""
+        event_log.publish('print_job', f"Print {job['status']}: {job['shot']}", job_id=job['id'],
+                          shot=job['shot'], status=job['status'], printer=job['printer'], error=job['error'])
+    
+    def _drain(self, printer):
+        """在锁内调用：把故障打印机上排队的任务移到其他打印机 / Called with the lock held: move queued jobs off a failed printer"""
+        for job in list(self.jobs.values()):
+            if job['printer'] == printer and job['status'] == 'queued':
+                target = self.registry.route(job['machine_id'], self._load(), exclude=[printer])
+                if target:
+                    job['printer'] = target
+                    self._printer_stats(printer)['failovers'] += 1
+                    self._printer_stats(target)['submitted'] += 1
+                    self._enqueue(job)
+    
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in self.FINISHED]
+        for job_id in finished[:-self.HISTORY_SIZE]:
+            del self.jobs[job_id]
+    
+    def _next_job(self, printer):
+        """在锁内调用：等待限流间隔后取出优先级最高的任务 / Called with the lock held"""
+        queue = self.queues[printer]
+        while True:
+            # 丢弃已提升优先级、已切换或已取消任务的旧条目 / Drop stale entries of re-prioritised, moved or cancelled jobs
+            while queue:
+                priority, _, job_id = queue[0]
+                job = self.jobs.get(job_id)
+                if job is not None and job['status'] == 'queued' and job['priority'] == priority \
+                        and job['printer'] == printer:
+                    break
+                heapq.heappop(queue)
+            if not queue:
+                self.cond.wait()
+                continue
+            # 断路器打开时任务留在队列中，等打印机恢复 / While the breaker is open, jobs stay spooled until the printer recovers
+            delay = self.registry.retry_in(printer)
+            if delay > 0:
+                self.cond.wait(delay)
+                continue
+            # 限流：等待期间新来的高优先级任务仍可插队 / Throttle: higher-priority arrivals can still jump ahead
+            delay = self.last_print.get(printer, 0) + self.min_interval - time.monotonic()
+            if delay > 0:
+                self.cond.wait(delay)
+                continue
+            _, _, job_id = heapq.heappop(queue)
+            return self.jobs[job_id]
+    
+    def _run(self, printer):
+        while True:
+            with self.cond:
+                job = self._next_job(printer)
+                job['status'] = 'printing'
+                job['started_at'] = time.time()
+                wait_time = job['started_at'] - job['queued_at']
+                self._publish(job)
+            
+            error = None
+            batch_path = None
+            shot = job['shot'] or f"job-{job['id']}"
+            stage_timings.record('print.queue', wait_time, shot)
+            try:
+                paper = self.registry.paper(printer)
+                raw = self.registry.raw(printer)
+                with shot_stages(shot):
+                    with stage_timer('print.compose' if job['batch'] else 'print.raster'):
+                        if job['batch']:
+                            image_path = batch_path = compose_batch_raster(job['batch'], job['cut_marks'], paper)
+                        else:
+                            image_path = (get_print_raster(job['image_path'], paper) if job['raster'] or raw
+                                          else job['image_path'])
+                    job['rasterized_at'] = time.time()
+                    with stage_timer('print.escpos' if raw else 'print.submit'):
+                        if raw:
+                            success, backend_job_id = send_escpos(image_path, raw, paper)
+                        else:
+                            success, backend_job_id = self.sender(image_path, self.registry.destination(printer), paper)
+                if not success:
+                    error = f"print submission to {printer} failed"
+            except Exception as e:
+                print(f"❌ 打印任务出错 / Print job error: {e}")
+                success, backend_job_id, error = False, None, str(e)
+            finally:
+                # CUPS提交时已复制文件 / CUPS copies the file on submission
+                if batch_path and os.path.exists(batch_path):
+                    os.remove(batch_path)
+            
+            finished = []
+            with self.cond:
+                self.last_print[printer] = time.monotonic()
+                stats = self._printer_stats(printer)
+                stats['total_wait'] += wait_time
+                stats['max_wait'] = max(stats['max_wait'], wait_time)
+                stats['busy'] += time.time() - job['started_at']
+                if success:
+                    self.registry.mark_success(printer)
+                    job['error'] = None
+                    job['submitted_at'] = time.time()
+                    job['backend_job_id'] = backend_job_id
+                    stats['printed'] += 1
+                    if stats['first_print'] is None:
+                        stats['first_print'] = job['started_at']
+                    stats['last_print'] = job['started_at']
+                else:
+                    self.registry.mark_failure(printer, error)
+                    job['error'] = error
+                    stats['failed'] += 1
+                    if not self.registry.is_healthy(printer):
+                        self._drain(printer)
+                    job['tried'].append(printer)
+                    alternative = self.registry.route(job['machine_id'], self._load(), exclude=job['tried'])
+                    if alternative and job['status'] == 'printing':
+                        # 切换到其他打印机重新排队 / Re-queue on another printer
+                        print(f"🔀 打印失败，切换到 / Print failed, failing over to: {alternative}")
+                        stats['failovers'] += 1
+                        job['printer'] = alternative
+                        job['status'] = 'queued'
+                        job['queued_at'] = time.time()
+                        self._printer_stats(alternative)['submitted'] += 1
+                        self._enqueue(job)
+                        self._publish(job)
+                        continue
+                    if job['status'] == 'printing' and self.registry.retry_in(printer) > 0:
+                        # 断路器已打开且无可切换的打印机：暂存任务，恢复后再打印，不消耗重试次数
+                        # Breaker open and nowhere to fail over: spool the job for after recovery without using up a retry
+                        print(f"📥 打印机不可用，任务已暂存 / Printer unavailable, job spooled: {job['shot']}")
+                        job['status'] = 'queued'
+                        job['tried'] = []
+                        self._enqueue(job)
+                        self._publish(job)
+                        continue
+                    if job['retries'] < PRINT_MAX_RETRIES and job['status'] == 'printing':
+                        # 稍后在同一打印机池中重试 / Retry later in the same pool
+                        job['retries'] += 1
+                        job['status'] = 'retrying'
+                        delay = PRINT_RETRY_DELAY * job['retries']
+                        print(f"🔁 打印失败，{delay:.0f}秒后重试 / Print failed, retrying in {delay:.0f}s: {job['shot']}")
+                        timer = threading.Timer(delay, self._retry, args=(job['id'],))
+                        timer.daemon = True
+                        timer.start()
+                        self._publish(job)
+                        continue
+                if self.pending.get(job['shot']) == job['id']:
+                    del self.pending[job['shot']]
+                if success and backend_job_id:
+                    # 由跟踪线程等待CUPS报告完成 / The tracker waits for CUPS to report completion
+                    job['status'] = 'submitted'
+                    self._start_tracker()
+                    self._publish(job)
+                    self.cond.notify_all()
+                else:
+                    # 没有后端任务ID时以提交时间作为完成时间 / Without a backend job ID, submission counts as completion
+                    finished.append(self._finish(job, 'done' if success else 'failed'))
+            self._log_finished(finished)
+    
+    def _retry(self, job_id):
+        """重试计时到期：重新路由并排队 / Retry timer fired: route again and re-queue"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] != 'retrying':
+                return
+            job['tried'] = []
+            job['printer'] = self.registry.route(job['machine_id'], self._load()) or job['printer']
+            job['status'] = 'queued'
+            job['queued_at'] = time.time()
+            self._enqueue(job)
+            self._publish(job)
+    
+    def _finish(self, job, status):
+        """
+        在锁内调用：结束任务并记录延迟，返回日志记录，由调用者在释放锁后用 _log_finished 写入
+        Called with the lock held: finish a job and record its latency; returns the log record, which the
+        caller writes with _log_finished after releasing the lock
+        """
+        now = time.time()
+        job['status'] = status
+        job['finished_at'] = now
+        self._publish(job)
+        if status == 'done':
+            job['completed_at'] = now if job['backend_job_id'] else job['submitted_at']
+            stages = {
+                'render': (job['received_at'], job['rendered_at']),
+                'queue': (job['queued_at'], job['started_at']),
+                'raster': (job['started_at'], job['rasterized_at']),
+                'submit': (job['rasterized_at'], job['submitted_at']),
+                'printer': (job['submitted_at'], job['completed_at']),
+                'total': (job['received_at'] or job['queued_at'], job['completed_at'])
+            }
+            for stage, (begin, end) in stages.items():
+                if begin is not None and end is not None:
+                    self.latency[stage].observe(end - begin)
+        self.cond.notify_all()
+        return self._public(job)
+    
+    def _log_finished(self, records):
+        """在锁外调用：追加已完成任务的记录 / Called without the lock: append finished job records"""
+        if not records:
+            return
+        try:
+            with open(os.path.join(DATA_DIR, PRINT_JOBS_FILE), 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        except OSError as e:
+            print(f"⚠️ 写入打印记录失败 / Failed to write print job log: {e}")
+    
+    def _start_tracker(self):
+        """在锁内调用 / Called with the lock held"""
+        if self.tracker is None:
+            self.tracker = threading.Thread(target=self._track, daemon=True, name="print-tracker")
+            self.tracker.start()
+    
+    def _track(self):
+        """
+        轮询CUPS，任务离开未完成列表即视为打印完成 / Poll CUPS; a job that leaves the not-completed list has printed
+        
+        lpstat 不可用时，提交超过 PRINT_SUBMIT_TIMEOUT 秒的任务以 'unknown' 结束，等待者和任务记录不会一直挂起
+        While lpstat is unavailable, jobs submitted more than PRINT_SUBMIT_TIMEOUT seconds ago finish as 'unknown',
+        so waiters and the job log are never left hanging
+        """
+        while True:
+            with self.cond:
+                while not any(job['status'] == 'submitted' for job in self.jobs.values()):
+                    self.cond.wait()
+            time.sleep(PRINT_TRACK_INTERVAL)
+            cups_jobs = get_cups_jobs()
+            finished = []
+            if cups_jobs is None:
+                deadline = time.time() - PRINT_SUBMIT_TIMEOUT
+                with self.cond:
+                    for job in list(self.jobs.values()):
+                        if job['status'] == 'submitted' and job['submitted_at'] < deadline:
+                            job['backend_status'] = 'Unknown'
+                            job['error'] = 'CUPS job status unavailable'
+                            finished.append(self._finish(job, 'unknown'))
+                self._log_finished(finished)
+                continue
+            with self.cond:
+                self._store_cups_jobs(cups_jobs)
+                for job in list(self.jobs.values()):
+                    if job['status'] != 'submitted':
+                        continue
+                    cups_job = cups_jobs.get(job['backend_job_id'])
+                    if cups_job:
+                        job['backend_status'] = cups_job['status']
+                    else:
+                        job['backend_status'] = 'Completed'
+                        finished.append(self._finish(job, 'done'))
+            self._log_finished(finished)
+    
+    def start_prober(self):
+        """启动周期性打印机健康探测 / Start the periodic printer health probe"""
+        with self.cond:
+            if self.prober is None:
+                self.prober = threading.Thread(target=self._probe, daemon=True, name="print-prober")
+                self.prober.start()
+    
+    def _probe(self):
+        """在独立线程中探测每台打印机，结果交给断路器 / Probe every printer on its own thread and feed the results to the breaker"""
+        while True:
+            for name, destination, raw in self.registry.configs():
+                if is_windows() and not raw:
+                    continue
+                ok, error = probe_printer(destination, raw)
+                self.registry.record_probe(name, ok, error)
+            cups_jobs = None if is_windows() else get_cups_jobs()
+            with self.cond:
+                if cups_jobs is not None:
+                    self._store_cups_jobs(cups_jobs)
+                # 唤醒等待断路器的工作线程 / Wake workers waiting on a breaker
+                self.cond.notify_all()
+            time.sleep(PRINTER_PROBE_INTERVAL)
+    
+    def _store_cups_jobs(self, cups_jobs):
+        """在锁内调用：缓存CUPS任务供状态接口读取 / Called with the lock held: cache CUPS jobs for the status endpoints"""
+        self.cups_jobs = cups_jobs
+        self.cups_checked_at = time.time()
+    
+    def cups_queue(self):
+        """
+        缓存的CUPS任务及读取时间，不调用lpstat / Cached CUPS jobs and when they were read, without running lpstat
+        
+        由探测线程（以及有已提交任务时的跟踪线程）刷新 / Refreshed by the probe thread (and by the tracker while jobs are submitted)
+        """
+        with self.cond:
+            return dict(self.cups_jobs), self.cups_checked_at
+    
+    def _public(self, job):
+        """任务的可序列化视图 / Serializable view of a job"""
+        def stamp(value):
+            return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] if value else None
+        return {
+            'id': job['id'],
+            'shot': job['shot'],
+            'shots': [os.path.basename(path).replace('.png', '.json') for path in job['batch']] if job['batch'] else None,
+            'machine_id': job['machine_id'],
+            'printer': job['printer'],
+            'backend_job_id': job['backend_job_id'],
+            'backend_status': job['backend_status'],
+            'status': job['status'],
+            'spooled': job['status'] == 'queued' and not self.registry.is_healthy(job['printer']),
+            'priority': 'manual' if job['priority'] <= PRINT_PRIORITY_MANUAL else 'auto',
+            'tried': job['tried'],
+            'retries': job['retries'],
+            'error': job['error'],
+            'received': stamp(job['received_at']),
+            'rendered': stamp(job['rendered_at']),
+            'queued': stamp(job['queued_at']),
+            'started': stamp(job['started_at']),
+            'rasterized': stamp(job['rasterized_at']),
+            'submitted': stamp(job['submitted_at']),
+            'completed': stamp(job['completed_at']),
+            'latency': round(job['completed_at'] - (job['received_at'] or job['queued_at']), 3)
+                       if job['completed_at'] else None
+        }
+    
+    def recent(self, limit=50):
+        """最近的打印任务及延迟直方图 / Recent print jobs and latency histograms"""
+        with self.cond:
+            jobs = sorted(self.jobs.values(), key=lambda job: job['id'], reverse=True)[:limit]
+            return {
+                'jobs': [self._public(job) for job in jobs],
+                'latency': {stage: histogram.snapshot() for stage, histogram in self.latency.items()}
+            }
+    
+    def find_backend(self, backend_job_id):
+        """按CUPS任务ID查找任务 / Find a job by its CUPS job ID"""
+        with self.cond:
+            for job in self.jobs.values():
+                if job['backend_job_id'] == backend_job_id:
+                    return self._public(job)
+            return None
+    
+    def wait(self, job_id, timeout=None, statuses=FINISHED):
+        """等待任务进入指定状态并返回其副本 / Wait for a job to reach one of the given statuses and return a copy of it"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.cond:
+            while True:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] in statuses:
+                    return dict(job) if job else None
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return dict(job)
+                self.cond.wait(remaining)
+    
+    def get(self, job_id):
+        """任务的可序列化视图，未知任务返回None / Serializable view of a job, None if unknown"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            return self._public(job) if job else None
+    
+    def cancel_all(self):
+        """取消所有排队中和等待重试的任务，并写入任务记录 / Cancel every queued or retrying job and log them"""
+        finished = []
+        with self.cond:
+            for job in list(self.jobs.values()):
+                if job['status'] in ('queued', 'retrying'):
+                    finished.append(self._finish(job, 'cancelled'))
+            self.pending.clear()
+            self.cond.notify_all()
+        self._log_finished(finished)
+        return len(finished)
+    
+    def depth(self):
+        with self.cond:
+            return sum(self._load().values())
+    
+    def snapshot(self):
+        """各打印机的健康状态、队列深度、等待时间、吞吐量和计数 / Per-printer health, queue depth, wait times, throughput and counters"""
+        now = time.time()
+        health = self.registry.status()
+        with self.cond:
+            printers = {}
+            for printer in sorted(set(health) | set(self.stats)):
+                stats = self.stats.get(printer) or self.EMPTY_STATS
+                active = [job for job in self.jobs.values()
+                          if job['printer'] == printer and job['status'] in ('queued', 'printing')]
+                active.sort(key=lambda job: (job['status'] != 'printing', job['priority'], job['id']))
+                finished = stats['printed'] + stats['failed']
+                # 吞吐量按首尾两次打印之间的间隔计算 / Throughput over the span between the first and last print
+                minutes = (stats['last_print'] - stats['first_print']) / 60 if stats['printed'] > 1 else 0
+                printers[printer] = dict(health.get(printer, {}), **{
+                    'depth': len(active),
+                    'spooled': sum(1 for job in active if job['status'] == 'queued')
+                               if health.get(printer, {}).get('breaker', 'closed') != 'closed' else 0,
+                    'oldest_wait': round(max((now - job['queued_at'] for job in active), default=0.0), 1),
+                    'avg_wait': round(stats['total_wait'] / finished, 2) if finished else 0.0,
+                    'max_wait': round(stats['max_wait'], 2),
+                    'jobs_per_minute': round((stats['printed'] - 1) / minutes, 2) if minutes > 0 else 0.0,
+                    'submitted': stats['submitted'],
+                    'printed': stats['printed'],
+                    'failed': stats['failed'],
+                    'failovers': stats['failovers'],
+                    'coalesced': stats['coalesced'],
+                    'jobs': [{
+                        'id': job['id'],
+                        'shot': job['shot'],
+                        'status': job['status'],
+                        'priority': 'manual' if job['priority'] <= PRINT_PRIORITY_MANUAL else 'auto',
+                        'wait': round(now - job['queued_at'], 1),
+                        'added_time': datetime.fromtimestamp(job['queued_at']).strftime('%H:%M:%S')
+                    } for job in active]
+                })
+            return {'min_interval': self.min_interval, 'printers': printers}
+    
+    def metric_samples(self):
+        """抓取时读取的打印指标 / Print metrics read at scrape time"""
+        health = self.registry.status()
+        samples = []
+        with self.cond:
+            load = self._load()
+            for printer in sorted(set(health) | set(self.stats)):
+                # 只读不插入：抓取不应创建统计项 / Read without inserting: a scrape must not create stats entries
+                stats = self.stats.get(printer) or self.EMPTY_STATS
+                labels = (('printer', printer),)
+                samples += [
+                    ('print_queue_depth', labels, load.get(printer, 0)),
+                    ('print_jobs_total', labels + (('result', 'printed'),), stats['printed']),
+                    ('print_jobs_total', labels + (('result', 'failed'),), stats['failed']),
+                    ('print_failovers_total', labels, stats['failovers']),
+                    ('print_worker_busy_seconds_total', labels, stats['busy']),
+                ]
+                if printer in health:
+                    samples.append(('printer_up', labels, int(health[printer]['breaker'] == 'closed')))
+            for stage, histogram in self.latency.items():
+                samples.append(('print_latency_seconds', (('stage', stage),), histogram.exposition()))
+        return samples
+
+def process_rss_bytes():
+    """进程常驻内存；macOS上为峰值，Windows上不可用 / Process resident memory; the peak on macOS, unavailable on Windows"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def metrics_exposition():
+    """当前全部指标的Prometheus文本 / All current metrics as Prometheus text"""
+    samples = [
+        ('shots_received', (), len(received_shots)),
+        ('threads', (), threading.active_count()),
+        ('process_start_time_seconds', (), server_start_time.timestamp()),
+    ]
+    rss = process_rss_bytes()
+    if rss is not None:
+        samples.append(('process_resident_memory_bytes', (), rss))
+    # 不为抓取而创建调度器 / Do not create the scheduler just for a scrape
+    if print_scheduler is not None:
+        samples += print_scheduler.metric_samples()
+    return metrics.exposition(samples)
+
+METRICS_ROUTES = ('/', '/api/status', '/api/queue', '/api/shots', '/api/language', '/api/settings',
+                  '/api/admin/rerender', '/api/print', '/metrics', '/plugin/plugin.tcl')
+METRICS_ROUTE_PREFIXES = ('/images/', '/download/json/', '/api/shots/', '/api/print/jobs', '/api/export',
+                          '/api/events', '/api/timings', '/api/admin/', '/upload')
+
+def metrics_route(path):
+    """把请求路径归为有限的路由标签 / Reduce a request path to a bounded route label"""
+    path = urllib.parse.urlparse(path).path
+    if path in METRICS_ROUTES:
+        return path
+    for prefix in METRICS_ROUTE_PREFIXES:
+        if path.startswith(prefix):
+            return prefix
+    return 'other'
+
+print_scheduler = None
+print_scheduler_lock = threading.Lock()
+
+def get_print_scheduler():
+    """获取全局打印调度器（延迟创建）/ Get the global print scheduler (lazily created)"""
+    global print_scheduler
+    with print_scheduler_lock:
+        if print_scheduler is None:
+            print_scheduler = PrintScheduler(registry=get_printer_registry())
+        return print_scheduler
+
+class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        self.semaphore = threading.Semaphore(MAX_USERS)
+        super().__init__(*args, **kwargs)
+    
+    def download_json_file(self):
+      """提供JSON文件下载 / Serve JSON file download"""
+      try:
+          # 从URL路径中提取文件名
+          filename = self.path.split('/download/json/')[-1]
+          # 确保是JSON文件
+          if not filename.endswith('.json'):
+              self.send_error(400, "Invalid file type")
+              return
+          
+          filepath = os.path.join(DATA_DIR, filename)
+          
+          if os.path.exists(filepath):
+              self.send_response(200)
+              self.send_header('Content-type', 'application/json')
+              self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+              self.send_header('Content-Length', str(os.path.getsize(filepath)))
+              self.end_headers()
+              
+              with open(filepath, 'rb') as f:
+                  # 分块发送文件，避免内存问题
+                  while chunk := f.read(8192):
+                      self.wfile.write(chunk)
+              print(f"✅ JSON文件已下载: {filename}")
+          else:
+              self.send_error(404, "JSON file not found")
+              
+      except Exception as e:
+          print(f"❌ 下载JSON文件时出错: {e}")
+          self.send_error(500, f"Error downloading JSON file: {str(e)}")
+    
+    def do_GET(self):
+        """处理 GET 请求 - 显示服务状态和管理界面"""
+        """Handle GET requests - show service status and management interface"""
+        metrics.inc('http_requests_total', method='GET', route=metrics_route(self.path))
+        with self.semaphore, profiler.profile('request', f"GET_{metrics_route(self.path)}"):
+            if self.path == '/':
+                self.show_management_interface()
+            elif self.path == '/api/status':
+                self.send_api_status()
+            elif self.path == '/api/queue':
+                self.send_queue_status()
+            elif self.path.startswith('/images/'):
+                self.serve_image()
+            elif self.path == '/api/shots':
+                self.send_shots_list()
+            elif self.path.startswith('/api/shots/') and '/similar' in self.path:
+                self.send_similar_shots()
+            elif self.path == '/api/language':
+                self.handle_language_change()
+            elif self.path == '/plugin/plugin.tcl':
+                self.serve_plugin_file()
+            elif self.path == '/api/settings':
+                self.send_settings()
+            elif self.path.startswith('/download/json/'):
+                self.download_json_file()
+            elif self.path == '/api/admin/rerender':
+                self.send_rerender_status()
+            elif self.path.startswith('/api/export'):
+                self.handle_export()
+            elif self.path.startswith('/api/events'):
+                self.send_events()
+            elif self.path.startswith('/api/print/jobs/'):
+                self.send_print_job()
+            elif self.path.startswith('/api/print/jobs'):
+                self.send_print_jobs()
+            elif self.path.startswith('/api/timings'):
+                self.send_stage_timings()
+            elif self.path == '/metrics':
+                self.send_metrics()
+            elif self.path.startswith('/api/admin/profiles/'):
+                self.download_profile()
+            elif self.path == '/api/admin/profiles':
+                self.send_profiles()
+            else:
+                super().do_GET()
+
+    def do_POST(self):
+        """处理 POST 请求 - 接收上传的冲泡数据"""
+        """Handle POST requests - receive uploaded shot data"""
+        metrics.inc('http_requests_total', method='POST', route=metrics_route(self.path))
+        with self.semaphore, profiler.profile('request', f"POST_{metrics_route(self.path)}"):
+            if self.path == '/upload' or self.path.startswith('/upload'):
+                try:
+                    content_type = self.headers.get('Content-Type', '')
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    post_data = self.rfile.read(content_length)
+                    
+                    if 'application/json' in content_type:
+                        self.handle_json_upload(post_data)
+                    elif 'multipart/form-data' in content_type:
+                        self.handle_multipart_upload(post_data, content_type)
+                    else:
+                        self.send_error(400, "Unsupported content type")
+                        
+                except Exception as e:
+                    print(f"❌ 处理上传时出错 / Error processing upload: {e}")
+                    self.send_error(500, f"Server error: {str(e)}")
+                    
+            elif self.path == '/api/print':
+                self.handle_print_control()
+            elif self.path == '/api/language':
+                self.handle_language_change()
+            elif self.path == '/api/settings/beaninfo':
+                self.handle_beaninfo_setting()
+            elif self.path == '/api/admin/rerender':
+                self.handle_rerender()
+            elif self.path == '/api/admin/profiles':
+                self.handle_profile_config()
+            else:
+                self.send_error(404, "Endpoint not found")
+
+    def do_DELETE(self):
+        """处理DELETE请求 - 清空打印队列"""
+        """Handle DELETE requests - clear print queue"""
+        with self.semaphore:
+            if self.path == '/api/queue':
+                self.handle_clear_queue()
+            else:
+                self.send_error(404, "Endpoint not found")
+
+    def handle_language_change(self):
+        """处理语言切换请求 / Handle language change requests"""
+        global current_language
+        
+        if self.command == 'GET':
+            # 返回当前语言设置
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({'language': current_language}).encode('utf-8'))
+            
+        elif self.command == 'POST':
+            # 切换语言
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+                post_data = self.rfile.read(content_length)
+                request_data = json.loads(post_data.decode('utf-8'))
+                
+                lang = request_data.get('language', 'zh')
+                if lang in LANGUAGES:
+                    current_language = lang
+                    
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    'success': True, 
+                    'language': current_language
+                }).encode('utf-8'))
+                
+            except Exception as e:
+                self.send_error(500, f"Language change error: {str(e)}")
+                
+    def send_settings(self):
+        """发送当前设置"""
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        
+        settings = {
+            'bean_info_enabled': BEAN_INFO_ENABLED,
+            'print_enabled': PRINT_ENABLED,
+            'max_users': MAX_USERS,
+            'paper_profile': PAPER_PROFILE,
+            'paper_profiles': PAPER_PROFILES,
+            'renderer': RENDERER,
+            'renderers': RENDERERS
+        }
+        
+        self.wfile.write(json.dumps(settings).encode('utf-8'))
 
     def handle_beaninfo_setting(self):
         """处理豆子信息设置 / Handle bean info change requests"""
@@ -927,6 +5205,161 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Settings error: {str(e)}")
 
+    def send_rerender_status(self):
+        """发送批量渲染进度 / Send batch re-render progress"""
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(rerender_status).encode('utf-8'))
+
+    def handle_rerender(self):
+        """启动批量重新渲染 / Start a batch re-render of stored shots"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            post_data = self.rfile.read(content_length) if content_length else b''
+            request_data = json.loads(post_data.decode('utf-8')) if post_data else {}
+            
+            filenames = request_data.get('files') or None
+            if filenames:
+                filenames = [os.path.basename(f) for f in filenames if is_shot_file(os.path.basename(f))]
+            started = start_background_rerender(filenames,
+                                                force=bool(request_data.get('force', False)),
+                                                workers=request_data.get('workers'))
+            response = {
+                'success': started,
+                'message': 'Re-render started' if started else 'Re-render already running',
+                'status': rerender_status
+            }
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+            
+        except Exception as e:
+            self.send_error(500, f"Re-render error: {str(e)}")
+
+    def send_profiles(self):
+        """剖析设置和已保存的剖析文件 / Send the profiling settings and saved profiles (GET /api/admin/profiles)"""
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'settings': profiler.status(), 'profiles': list_profiles()}).encode('utf-8'))
+
+    def handle_profile_config(self):
+        """
+        剖析接下来的N次渲染/请求或按比例抽样；count 和 sample 均为0时关闭
+        Profile the next N renders/requests or a sampled fraction; count and sample of 0 turn it off
+        
+        POST /api/admin/profiles {"kind": "render", "count": 5} / {"kind": "request", "sample": 0.1}
+        """
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            request_data = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length else {}
+            profiler.configure(request_data.get('kind', 'render'), request_data.get('count'), request_data.get('sample'))
+        except (ValueError, TypeError) as e:
+            self.send_error(400, f"Invalid profiling request: {e}")
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'success': True, 'settings': profiler.status()}).encode('utf-8'))
+
+    def download_profile(self):
+        """
+        下载剖析文件（pstats格式，可用 snakeviz 查看），?format=text 返回文本摘要
+        Download a profile (pstats format, e.g. for snakeviz); ?format=text returns a text summary
+        
+        GET /api/admin/profiles/<name>[?format=text&sort=tottime]
+        """
+        parsed = urllib.parse.urlparse(self.path)
+        name = os.path.basename(urllib.parse.unquote(parsed.path))
+        path = os.path.join(PROFILE_DIR, name)
+        if not name.endswith('.prof') or not os.path.isfile(path):
+            self.send_error(404, "Profile not found")
+            return
+        params = urllib.parse.parse_qs(parsed.query)
+        if params.get('format', [''])[0] == 'text':
+            try:
+                body = profile_report(path, params.get('sort', ['cumulative'])[0]).encode('utf-8')
+            except (KeyError, ValueError) as e:
+                self.send_error(400, f"Invalid sort key: {e}")
+                return
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+        else:
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_export(self):
+        """
+        按日期、机器、方案或豆子流式导出冲泡数据（ZIP或NDJSON）
+        Stream a filtered bulk export of shots as ZIP or NDJSON
+        
+        GET /api/export?format=zip|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&machine=ID&profile=text&bean=text&images=1
+        """
+        headers_sent = False
+        try:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            
+            def param(name):
+                value = query.get(name, [''])[0].strip()
+                return value or None
+            
+            export_format = param('format') or 'zip'
+            if export_format not in ('zip', 'ndjson'):
+                self.send_error(400, "Unsupported export format")
+                return
+            for name in ('from', 'to'):
+                if param(name):
+                    try:
+                        datetime.strptime(param(name), '%Y-%m-%d')
+                    except ValueError:
+                        self.send_error(400, f"Invalid date for '{name}', expected YYYY-MM-DD")
+                        return
+            
+            records = get_shot_index().query(date_from=param('from'), date_to=param('to'),
+                                             machine_id=param('machine'), profile=param('profile'),
+                                             bean=param('bean'))
+            include_images = param('images') in ('1', 'true', 'yes')
+            
+            # HTTP/1.1 客户端使用分块传输，HTTP/1.0 客户端以关闭连接结束 / Chunked for HTTP/1.1, close-delimited for HTTP/1.0
+            chunked = self.request_version == 'HTTP/1.1'
+            if chunked:
+                self.protocol_version = 'HTTP/1.1'
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            extension = 'zip' if export_format == 'zip' else 'ndjson'
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/zip' if export_format == 'zip' else 'application/x-ndjson')
+            self.send_header('Content-Disposition', f'attachment; filename="shots_export_{stamp}.{extension}"')
+            if chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            headers_sent = True
+            
+            writer = ChunkedWriter(self.wfile, chunked=chunked)
+            if export_format == 'zip':
+                write_export_zip(writer, records, include_images=include_images)
+            else:
+                write_export_ndjson(writer, records)
+            writer.close()
+            print(f"📦 导出完成 / Export finished: {len(records)} shots, {writer.bytes_written} bytes ({export_format})")
+            
+        except (BrokenPipeError, ConnectionResetError):
+            print("⚠️ 客户端在导出过程中断开连接 / Client disconnected during export")
+        except Exception as e:
+            print(f"❌ 导出出错 / Export error: {e}")
+            if not headers_sent:
+                self.send_error(500, f"Export error: {str(e)}")
+
     def serve_plugin_file(self):
         """提供插件文件下载 / Serve plugin file download"""
         try:
@@ -1060,6 +5493,8 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     <p>{get_text('server_desc')}</p>
                 </div>
                 
+                <div class="card" id="eventBanner" style="display: none;"></div>
+                
                 <div class="card">
                     <h2>📊 {get_text('status_running')}</h2>
                     <div class="status-grid" id="statusGrid">
@@ -1113,8 +5548,45 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     <p>API Endpoint: <code>POST /upload</code> (Content-Type: application/json)</p>
                 </div>
                 
+                <div class="card">
+                    <h2>{get_text('export_data')}</h2>
+                    <form action="/api/export" method="get" class="controls">
+                        <label>{get_text('export_from')} <input type="date" name="from"></label>
+                        <label>{get_text('export_to')} <input type="date" name="to"></label>
+                        <label>{get_text('export_machine')} <input type="text" name="machine"></label>
+                        <label>{get_text('chart_profile')} <input type="text" name="profile"></label>
+                        <label>{get_text('chart_bean_info')} <input type="text" name="bean"></label>
+                        <label>Format
+                            <select name="format">
+                                <option value="zip">ZIP</option>
+                                <option value="ndjson">NDJSON</option>
+                            </select>
+                        </label>
+                        <label><input type="checkbox" name="images" value="1" style="width: auto;"> {get_text('export_include_images')}</label>
+                        <button type="submit" class="btn btn-primary">{get_text('export_download')}</button>
+                    </form>
+                </div>
+                
+                <div class="card">
+                    <h2>{get_text('profiling')}</h2>
+                    <div class="controls">
+                        <select id="profileKind" style="width: auto;">
+                            <option value="render">{get_text('profile_renders')}</option>
+                            <option value="request">{get_text('profile_requests')}</option>
+                        </select>
+                        <label>{get_text('profile_next')} <input type="number" id="profileCount" min="0" value="1" style="width: 5em;"></label>
+                        <label>{get_text('profile_sample')} <input type="number" id="profileSample" min="0" max="1" step="0.01" value="0" style="width: 5em;"></label>
+                        <button class="btn btn-primary" onclick="configureProfiling()">{get_text('profile_apply')}</button>
+                    </div>
+                    <div id="profileList"></div>
+                </div>
+                
                 <div class="card">
                     <h2>{get_text('recent_data')}</h2>
+                    <div class="controls">
+                        <button class="btn btn-success" onclick="printBatch()">{get_text('print_selected')}</button>
+                        <label style="display: inline;"><input type="checkbox" id="batchCutMarks" checked style="width: auto;"> {get_text('cut_marks')}</label>
+                    </div>
                     <div class="shot-grid" id="shotsGrid">
                         <!-- 动态数据卡片 / Dynamic data cards -->
                     </div>
@@ -1133,6 +5605,7 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     loadPrinters();
                     loadQueueStatus();
                     loadSettings(); 
+                    loadProfiles();
                     
                     // 设置文件上传 / Setup file upload
                     document.getElementById('fileInput').addEventListener('change', handleFileUpload);
@@ -1141,6 +5614,7 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     setInterval(loadStatus, 5000);
                     setInterval(loadShots, 10000);
                     setInterval(loadQueueStatus, 8000);
+                    setInterval(pollEvents, 3000);
                 }});
                 
                 // 初始化时从服务器获取设置
@@ -1241,7 +5715,7 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                             </div>
                             <div class="status-item">
                                 <h3>📋 {get_text('print_queue')}</h3>
-                                <p>${{data.print_queue_count}} jobs</p>
+                                <p>${{data.print_queue_count}} jobs${{data.print_scheduler_depth ? ` (+${{data.print_scheduler_depth}} scheduled)` : ''}}</p>
                             </div>
                         `;
                         
@@ -1259,22 +5733,44 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                         const data = await response.json();
                         
                         let queueHTML = '';
+                        // 调度器中排队的任务 / Jobs waiting in the print scheduler
+                        const printers = data.scheduler ? Object.entries(data.scheduler.printers) : [];
+                        printers.forEach(([name, printer]) => {{
+                            queueHTML += `
+                                <p><strong>${{printer.healthy === false ? '⚠️' : '🖨️'}} ${{name}}</strong> <small>${{printer.destination || ''}}</small>: ${{printer.depth}} queued | avg wait ${{printer.avg_wait}}s | oldest ${{printer.oldest_wait}}s | ${{printer.jobs_per_minute}}/min | printed ${{printer.printed}} | failed ${{printer.failed}} | failovers ${{printer.failovers}} | coalesced ${{printer.coalesced}}${{printer.breaker && printer.breaker !== 'closed' ? ` | 🔌 ${{printer.breaker}}, ${{printer.spooled}} spooled` : ''}}${{printer.probe && !printer.probe.ok ? ` | probe: ${{printer.probe.error}}` : ''}}</p>
+                                ${{printer.jobs.map(job => `
+                                    <div class="queue-item">
+                                        <strong>${{job.shot}}</strong><br>
+                                        <small>Status: ${{job.status}} (${{job.priority}}) | Added: ${{job.added_time}} | Waiting: ${{job.wait}}s</small>
+                                    </div>
+                                `).join('')}}
+                            `;
+                        }});
                         if (data.queue_count === 0) {{
-                            queueHTML = '<p class="success">✅ {get_text('queue_cleared')}</p>';
+                            if (!printers.some(([name, printer]) => printer.depth > 0)) {{
+                                queueHTML += '<p class="success">✅ {get_text('queue_cleared')}</p>';
+                            }}
                         }} else {{
-                            queueHTML = `
+                            queueHTML += `
                                 <p><strong>{get_text('queue_status')}: ${{data.queue_count}} tasks</strong></p>
                                 <div id="queueItems">
                                     ${{data.queue_items ? data.queue_items.map(item => `
                                         <div class="queue-item">
                                             <strong>${{item.filename}}</strong><br>
-                                            <small>Status: ${{item.status}} | Added: ${{item.added_time}}</small>
+                                            <small>${{item.job_id}}${{item.printer ? ` @ ${{item.printer}}` : ''}} | Status: ${{item.status}} | Added: ${{item.added_time}}</small>
                                         </div>
                                     `).join('') : ''}}
                                 </div>
                             `;
                         }}
                         
+                        // 上传到出纸的延迟 / Upload-to-paper latency
+                        const jobs = await (await fetch('/api/print/jobs')).json();
+                        const total = jobs.latency.total;
+                        if (total.count) {{
+                            queueHTML += `<p><small>⏱️ upload → paper: p50 ≤ ${{total.p50}}s | p95 ≤ ${{total.p95}}s | max ${{total.max}}s (${{total.count}} jobs)</small></p>`;
+                        }}
+                        
                         document.getElementById('queueStatus').innerHTML = queueHTML;
                         
                     }} catch (error) {{
@@ -1349,6 +5845,8 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     try {{
                         const response = await fetch('/api/shots');
                         const shots = await response.json();
+                        // 刷新时保留合并打印的勾选 / Keep batch selections across refreshes
+                        const selected = new Set(Array.from(document.querySelectorAll('.batch-select:checked')).map(box => box.value));
                         
                         let shotsHTML = '';
                         shots.forEach(shot => {{
@@ -1359,7 +5857,8 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                             
                             shotsHTML += `
                                 <div class="shot-card">
-                                    <h4>${{shot.profile}}</h4>
+                                    <h4><input type="checkbox" class="batch-select" value="${{shot.filename}}" ${{selected.has(shot.filename) ? 'checked' : ''}} style="width: auto;"> ${{shot.profile}}</h4>
+                                    ${{shot.anomaly && shot.anomaly.length ? `<p class="error"><strong>⚠️ {get_text('chart_anomaly')}:</strong> ${{shot.anomaly.join(', ')}}</p>` : ''}}
                                     <p><strong>Time:</strong> ${{shot.timestamp}}</p>
                                     ${{shot.machine_id && shot.machine_id !== 'UNKNOWN' ? `<p><strong>Machine ID:</strong> ${{shot.machine_id}}</p>` : ''}}
                                     ${{shot.plugin_version && shot.plugin_version !== 'unknown' ? `<p><small>Plugin: ${{shot.plugin_version}}</small></p>` : ''}}
@@ -1380,6 +5879,75 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     }}
                 }}
                 
+                let lastEventSeq = null;
+                
+                async function loadProfiles() {{
+                    try {{
+                        const data = await (await fetch('/api/admin/profiles')).json();
+                        const settings = Object.entries(data.settings)
+                            .filter(([kind, s]) => s.remaining || s.sample)
+                            .map(([kind, s]) => `${{kind}}: ${{s.remaining}} / ${{s.sample}}`).join(', ');
+                        const rows = data.profiles.map(p => `
+                            <li><code>${{p.name}}</code> <small>${{p.time}}, ${{(p.size / 1024).toFixed(0)}} KB</small>
+                                <a href="/api/admin/profiles/${{encodeURIComponent(p.name)}}">.prof</a>
+                                <a href="/api/admin/profiles/${{encodeURIComponent(p.name)}}?format=text" target="_blank">text</a></li>`).join('');
+                        document.getElementById('profileList').innerHTML =
+                            (settings ? `<p>🔬 ${{settings}}</p>` : '') +
+                            (rows ? `<ul>${{rows}}</ul>` : '<p>{get_text('profile_none')}</p>');
+                    }} catch (error) {{
+                        console.error('Error loading profiles:', error);
+                    }}
+                }}
+                
+                async function configureProfiling() {{
+                    try {{
+                        await fetch('/api/admin/profiles', {{
+                            method: 'POST',
+                            headers: {{'Content-Type': 'application/json'}},
+                            body: JSON.stringify({{
+                                kind: document.getElementById('profileKind').value,
+                                count: parseInt(document.getElementById('profileCount').value) || 0,
+                                sample: parseFloat(document.getElementById('profileSample').value) || 0
+                            }})
+                        }});
+                        loadProfiles();
+                    }} catch (error) {{
+                        console.error('Error configuring profiling:', error);
+                    }}
+                }}
+                
+                async function pollEvents() {{
+                    try {{
+                        const response = await fetch(`/api/events?since=${{lastEventSeq || 0}}`);
+                        const result = await response.json();
+                        // 首次轮询只记录位置，不弹出历史事件 / First poll only records the position
+                        if (lastEventSeq !== null) {{
+                            const printEvents = result.events.filter(e => e.type === 'print_job');
+                            if (printEvents.length) {{
+                                loadQueueStatus();
+                            }}
+                            if (result.events.some(e => e.type === 'profile')) {{
+                                loadProfiles();
+                            }}
+                            const alerts = result.events.filter(e => e.type === 'anomaly' ||
+                                (e.type === 'print_job' && e.data.status === 'failed'));
+                            if (alerts.length) {{
+                                const banner = document.getElementById('eventBanner');
+                                banner.innerHTML = alerts.map(e =>
+                                    e.type === 'anomaly' ?
+                                    `<p class="error">⚠️ ${{e.time}} ${{e.message}} (${{e.data.reasons.join(', ')}}) - ${{e.data.filename}}</p>` :
+                                    `<p class="error">🖨️ ${{e.time}} ${{e.message}} (#${{e.data.job_id}}, ${{e.data.printer}}): ${{e.data.error || ''}}</p>`
+                                ).join('');
+                                banner.style.display = 'block';
+                                loadShots();
+                            }}
+                        }}
+                        lastEventSeq = result.last_seq;
+                    }} catch (error) {{
+                        console.error('Error polling events:', error);
+                    }}
+                }}
+                
                 async function loadPrinters() {{
                     // 这里可以扩展为从系统获取打印机列表
                     // Can be extended to get printer list from system
@@ -1415,6 +5983,34 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     event.target.value = '';
                 }}
                 
+                async function printBatch() {{
+                    const filenames = Array.from(document.querySelectorAll('.batch-select:checked')).map(box => box.value);
+                    if (!filenames.length) {{
+                        alert('{get_text('select_shots')}');
+                        return;
+                    }}
+                    try {{
+                        const response = await fetch('/api/print', {{
+                            method: 'POST',
+                            headers: {{ 'Content-Type': 'application/json' }},
+                            body: JSON.stringify({{
+                                action: 'print_batch',
+                                filenames: filenames,
+                                cut_marks: document.getElementById('batchCutMarks').checked
+                            }})
+                        }});
+                        const result = await response.json();
+                        if (result.success) {{
+                            alert(`{get_text('print_job_sent')} (#${{result.job_id}})`);
+                            loadQueueStatus();
+                        }} else {{
+                            alert('{get_text('upload_failed')}: ' + result.message);
+                        }}
+                    }} catch (error) {{
+                        alert('{get_text('upload_failed')}: ' + error);
+                    }}
+                }}
+                
                 async function printShot(filename) {{
                     if (!printEnabled) {{
                         alert('{get_text('disabled')}');
@@ -1433,7 +6029,8 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                         
                         const result = await response.json();
                         if (result.success) {{
-                            alert('{get_text('print_job_sent')}');
+                            // 任务已排队，完成或失败会通过事件推送 / Job queued; completion or failure arrives via events
+                            alert(`{get_text('print_job_sent')} (#${{result.job_id}})`);
                             loadQueueStatus();
                         }} else {{
                             alert('{get_text('upload_failed')}: ' + result.message);
@@ -1485,14 +6082,39 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                       <div style="display: flex; gap: 10px; flex-wrap: wrap;">
                           <button class="btn btn-primary" onclick="downloadJSON('${{filename}}')">Download JSON</button>
                           <button class="btn btn-info" onclick="viewChart('${{filename}}')">View Chart</button>
+                          <button class="btn btn-success" onclick="loadSimilar('${{filename}}', this)">{get_text('similar_shots')}</button>
                           <button class="btn btn-secondary" onclick="this.parentElement.parentElement.parentElement.remove()">Close</button>
                       </div>
+                      <div class="similar-list" style="margin-top: 15px;"></div>
                   `;
                   
                   modal.appendChild(modalContent);
                   document.body.appendChild(modal);
               }}
 
+              async function loadSimilar(filename, button) {{
+                  // 查找曲线相似的历史冲泡 / Find historic shots with similar curves
+                  const list = button.parentElement.parentElement.querySelector('.similar-list');
+                  list.innerHTML = '<p>Loading...</p>';
+                  try {{
+                      const response = await fetch(`/api/shots/${{encodeURIComponent(filename)}}/similar?k=5`);
+                      if (!response.ok) {{
+                          list.innerHTML = '<p class="error">❌ {get_text('no_data')}</p>';
+                          return;
+                      }}
+                      const result = await response.json();
+                      list.innerHTML = `<h4>{get_text('similar_shots')}</h4>` + (result.similar.map(shot => `
+                          <div class="queue-item">
+                              <strong>${{shot.profile}}</strong> <small>${{shot.shot_time || ''}}</small><br>
+                              <small>${{shot.bean ? shot.bean + ' | ' : ''}}distance ${{shot.distance}}</small>
+                              ${{shot.image_exists ? ` | <a href="#" onclick="viewChart('${{shot.filename}}'); return false;">View Chart</a>` : ''}}
+                          </div>
+                      `).join('') || '<p>{get_text('no_data')}</p>');
+                  }} catch (error) {{
+                      list.innerHTML = `<p class="error">❌ ${{error}}</p>`;
+                  }}
+              }}
+
               function downloadJSON(filename) {{
                   // 下载JSON文件
                   window.location.href = `/download/json/${{filename}}`;
@@ -1530,12 +6152,25 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             'max_users': MAX_USERS,
             'print_enabled': PRINT_ENABLED,
             'print_queue_count': queue_count,
+            'print_scheduler_depth': get_print_scheduler().depth(),
+            'printers': {name: {key: printer[key] for key in ('healthy', 'breaker', 'opened_at', 'consecutive_failures',
+                                                              'last_error', 'probe')}
+                         for name, printer in get_printer_registry().status().items()},
             'data_dir': os.path.abspath(DATA_DIR),
             'image_dir': os.path.abspath(IMAGE_DIR)
         }
         
         self.wfile.write(json.dumps(status_data).encode('utf-8'))
 
+    def send_metrics(self):
+        """Prometheus文本格式的指标 / Send metrics in the Prometheus text format (GET /metrics)"""
+        body = metrics_exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def send_queue_status(self):
         """发送打印队列状态 / Send print queue status"""
         self.send_response(200)
@@ -1551,25 +6186,146 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Content-type', 'application/json')
         self.end_headers()
         
-        shots_data = []
-        for shot in received_shots[-20:]:
-            image_filename = shot['filename'].replace('.json', '.png')
-            image_path = os.path.join(IMAGE_DIR, image_filename)
+        shots_data = []
+        for shot in received_shots[-20:]:
+            image_filename = shot['filename'].replace('.json', '.png')
+            image_path = os.path.join(IMAGE_DIR, image_filename)
+            
+            shot_info = {
+                'id': shot['id'],
+                'filename': shot['filename'],
+                'timestamp': shot['timestamp'],
+                'profile': shot.get('profile', 'unknown'),
+                'clock': shot.get('clock', 'unknown'),
+                'data_size': shot.get('data_size', 0),
+                'image_exists': os.path.exists(image_path),
+                'machine_id': shot.get('machine_id', 'UNKNOWN'),
+                'plugin_version': shot.get('plugin_version', 'unknown'),
+                'anomaly': shot.get('anomaly')
+            }
+            shots_data.append(shot_info)
+        
+        self.wfile.write(json.dumps(shots_data[::-1]).encode('utf-8'))
+
+    def send_print_job(self):
+        """返回单个打印任务的状态 / Send the status of one print job (GET /api/print/jobs/<id>)"""
+        job_ref = urllib.parse.urlparse(self.path).path.rstrip('/').split('/')[-1]
+        job = get_print_scheduler().get(int(job_ref)) if job_ref.isdigit() else None
+        if job is None:
+            self.send_error(404, "Print job not found")
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(job, ensure_ascii=False).encode('utf-8'))
+
+    def send_print_jobs(self):
+        """
+        返回最近的打印任务（含各阶段时间戳）和延迟直方图
+        Send recent print jobs (with per-stage timestamps) and latency histograms
+        """
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(get_print_scheduler().recent(), ensure_ascii=False).encode('utf-8'))
+
+    def send_stage_timings(self):
+        """
+        返回各阶段耗时的滚动百分位和最近冲泡的分解 / Send rolling per-stage percentiles and recent per-shot breakdowns
+        
+        GET /api/timings[?shot=<filename>]
+        """
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        shot = params.get('shot', [None])[0]
+        snapshot = stage_timings.snapshot(shot)
+        if shot and not snapshot['stages']:
+            self.send_error(404, "No timings for this shot")
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(snapshot, ensure_ascii=False).encode('utf-8'))
+
+    def send_events(self):
+        """
+        返回指定序号之后的事件，供网页轮询 / Send events after a sequence number for dashboard polling
+        
+        GET /api/events?since=<seq>
+        """
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            since = int(params.get('since', ['0'])[0])
+        except ValueError:
+            since = 0
+        events, last_seq = event_log.since(since)
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'events': events, 'last_seq': last_seq}, ensure_ascii=False).encode('utf-8'))
+
+    def send_similar_shots(self):
+        """
+        返回曲线最相似的历史冲泡 / Send the historic shots whose curves are most similar
+        
+        GET /api/shots/<id or filename>/similar?k=5
+        """
+        try:
+            parsed_path = urllib.parse.urlparse(self.path)
+            shot_ref = urllib.parse.unquote(parsed_path.path[len('/api/shots/'):].split('/')[0])
+            query_params = urllib.parse.parse_qs(parsed_path.query)
+            k = max(1, min(int(query_params.get('k', ['5'])[0]), 100))
             
-            shot_info = {
-                'id': shot['id'],
-                'filename': shot['filename'],
-                'timestamp': shot['timestamp'],
-                'profile': shot.get('profile', 'unknown'),
-                'clock': shot.get('clock', 'unknown'),
-                'data_size': shot.get('data_size', 0),
-                'image_exists': os.path.exists(image_path),
-                'machine_id': shot.get('machine_id', 'UNKNOWN'),
-                'plugin_version': shot.get('plugin_version', 'unknown')
-            }
-            shots_data.append(shot_info)
-        
-        self.wfile.write(json.dumps(shots_data[::-1]).encode('utf-8'))
+            index = get_shot_index()
+            filename = resolve_shot_filename(shot_ref)
+            if filename is None:
+                self.send_error(404, "Shot not found")
+                return
+            
+            features = get_feature_index()
+            if not features.has(filename):
+                # 尚未计算特征（例如回填仍在进行）/ No features yet (e.g. backfill still running)
+                try:
+                    with open(os.path.join(DATA_DIR, filename), 'r', encoding='utf-8') as f:
+                        features.add_shot(filename, json.load(f))
+                except (OSError, ValueError):
+                    pass
+            
+            start = time.perf_counter()
+            neighbours = features.similar(filename, k)
+            query_ms = (time.perf_counter() - start) * 1000
+            if neighbours is None:
+                self.send_error(404, "No curve data for this shot")
+                return
+            
+            results = []
+            for neighbour, distance in neighbours:
+                record = index.get(neighbour) or {}
+                results.append({
+                    'filename': neighbour,
+                    'id': record.get('id'),
+                    'distance': round(distance, 4),
+                    'shot_time': record.get('shot_time'),
+                    'profile': record.get('profile', 'unknown'),
+                    'bean': record.get('bean', ''),
+                    'machine_id': record.get('machine_id', 'UNKNOWN'),
+                    'image_exists': os.path.exists(os.path.join(IMAGE_DIR, neighbour.replace('.json', '.png')))
+                })
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({
+                'filename': filename,
+                'k': k,
+                'searched': features.count(),
+                'query_ms': round(query_ms, 3),
+                'similar': results
+            }).encode('utf-8'))
+            
+        except ValueError:
+            self.send_error(400, "Invalid k")
+        except Exception as e:
+            self.send_error(500, f"Similar shots error: {str(e)}")
 
     def serve_image(self):
         """提供图像文件服务 / Serve image files"""
@@ -1593,6 +6349,8 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
     def handle_json_upload(self, post_data):
         """处理JSON格式的上传 / Handle JSON format upload"""
         global received_shots
+        received_at = time.time()
+        clock = StageClock()
         
         try:
           
@@ -1601,19 +6359,28 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             machine_id = query_params.get('machine_id', ['UNKNOWN'])[0]
             plugin_version = query_params.get('plugin_version', ['unknown'])[0]
             
-            shot_data = json.loads(post_data.decode('utf-8'))
+            # 只解析一次，曲线数组直接交给分析和渲染 / Parse once; the curve arrays go straight to analytics and rendering
+            shot_data, series = parse_shot_upload(post_data)
             shot_id = int(time.time())
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"shot_{timestamp}_{shot_id}.json"
+            filename = new_shot_filename(timestamp, shot_id)
             filepath = os.path.join(DATA_DIR, filename)
+            clock.shot = filename
+            clock.lap('upload.parse')
+            machine_label = metrics.machine_label(machine_id, get_printer_registry().machines())
+            metrics.inc('uploads_total', machine_id=machine_label, type='json')
+            metrics.inc('upload_bytes_total', len(post_data), machine_id=machine_label, type='json')
             
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(shot_data, f, indent=2, ensure_ascii=False)
+            # 原样保存上传的字节，不再重新序列化 / Store the uploaded bytes verbatim instead of re-serializing
+            with open(filepath, 'wb') as f:
+                f.write(post_data)
+            clock.lap('upload.save')
             
             # 先发送响应，避免客户端超时 / Send response first to avoid client timeout
             response = {
                 'status': 'success',
                 'id': shot_id,
+                'filename': filename,
                 'message': f'Shot data received and saved as {filename}',
                 'timestamp': timestamp,
                 'image_generated': False,
@@ -1630,51 +6397,70 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             except BrokenPipeError:
                 print("⚠️ 客户端提前断开连接，但数据已保存 / Client disconnected early but data saved")
                 return
+            clock.lap('upload.ack')
             
             # 然后在后台处理图表生成和打印 / Then process chart generation and printing in background
             def background_processing(shots_list, machine_id, plugin_version):
-                try:
-                    # 生成图表 / Generate chart
-                    image_filename = filename.replace('.json', '.png')
-                    image_path = os.path.join(IMAGE_DIR, image_filename)
-                    image_generated = self.create_coffee_plot(filepath, image_path, machine_id)
+                with shot_stages(filename):
+                    try:
+                        # 生成图表 / Generate chart
+                        image_filename = filename.replace('.json', '.png')
+                        image_path = os.path.join(IMAGE_DIR, image_filename)
+                        # 渲染前先做异常检查，以便在小票上标记 / Check for anomalies before rendering so the receipt can flag them
+                        with stage_timer('render.analyze'):
+                            anomaly = analyze_shot(filename, shot_data, machine_id, series)
+                        reasons = anomaly['reasons'] if anomaly else None
+                        # 图表和打印位图由同一次渲染生成 / Chart and print raster come out of the same render
+                        image_generated = self.create_coffee_plot(filepath, image_path, machine_id, reasons,
+                                                                  raster_file=print_raster_path(image_path),
+                                                                  data=shot_data, series=series)
+                        rendered_at = time.time()
+                        if image_generated:
+                            with stage_timer('render.manifest'):
+                                record_render(filename, filepath, machine_id, reasons)
                     
-                    # 记录接收信息 / Record reception info
-                    shot_info = {
-                        'id': shot_id,
-                        'timestamp': timestamp,
-                        'filename': filename,
-                        'data_size': len(post_data),
-                        'clock': shot_data.get('clock', 'unknown'),
-                        'profile': shot_data.get('profile', {}).get('title', 'unknown') if isinstance(shot_data.get('profile'), dict) else shot_data.get('profile', 'unknown'),
-                        'success': True,
-                        'upload_type': 'json',
-                        'json_path': filepath,
-                        'machine_id': machine_id,
-                        'plugin_version': plugin_version
-                    }
+                        # 记录接收信息 / Record reception info
+                        shot_info = {
+                            'id': shot_id,
+                            'timestamp': timestamp,
+                            'filename': filename,
+                            'data_size': len(post_data),
+                            'clock': shot_data.get('clock', 'unknown'),
+                            'profile': shot_data.get('profile', {}).get('title', 'unknown') if isinstance(shot_data.get('profile'), dict) else shot_data.get('profile', 'unknown'),
+                            'success': True,
+                            'upload_type': 'json',
+                            'json_path': filepath,
+                            'machine_id': machine_id,
+                            'plugin_version': plugin_version,
+                            'anomaly': reasons
+                        }
                     
-                    received_shots.append(shot_info)
-                    # 注意：这里不需要重新赋值，直接操作原列表 / Note: No need to reassign, operate on original list
-                    if len(shots_list) > 50:
-                        del shots_list[:-50]
+                        received_shots.append(shot_info)
+                        with stage_timer('upload.index'):
+                            get_shot_index().add(get_shot_index().build_record(
+                                filename, shot_data, machine_id, plugin_version, 'json',
+                                len(post_data), shot_id, timestamp, anomaly))
+                        # 注意：这里不需要重新赋值，直接操作原列表 / Note: No need to reassign, operate on original list
+                        if len(shots_list) > 50:
+                            del shots_list[:-50]
                     
-                    # 打印接收信息 / Print reception info
-                    self.print_shot_info(shot_info)
+                        # 打印接收信息 / Print reception info
+                        self.print_shot_info(shot_info)
                     
-                    # 自动打印（如果启用）/ Auto print (if enabled)
-                    if PRINT_ENABLED and image_generated:
-                        print("🖨️ 开始在后台打印... / Starting background printing...")
-                        self.print_image(image_path)
+                        # 自动打印（如果启用）/ Auto print (if enabled)
+                        if PRINT_ENABLED and image_generated:
+                            print("🖨️ 开始在后台打印... / Starting background printing...")
+                            self.print_image(image_path, shot=filename, raster=True, machine_id=machine_id,
+                                             received_at=received_at, rendered_at=rendered_at)
                     
-                    print(f"✅ 后台处理完成 / Background processing completed: {filename}")
+                        print(f"✅ 后台处理完成 / Background processing completed: {filename}")
                     
-                except Exception as e:
-                    print(f"❌ 后台处理出错 / Background processing error: {e}")
+                    except Exception as e:
+                        print(f"❌ 后台处理出错 / Background processing error: {e}")
             
             # 在后台线程中处理 / Process in background thread
             threading.Thread(target=background_processing, args=(received_shots, machine_id, plugin_version), daemon=True).start()                
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
             self.send_error(400, f"Invalid JSON: {str(e)}")
         except Exception as e:
             self.send_error(500, f"Error processing JSON: {str(e)}")
@@ -1682,6 +6468,8 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
     def handle_multipart_upload(self, post_data, content_type):
         """处理multipart格式的上传 / Handle multipart format upload"""
         global received_shots
+        received_at = time.time()
+        clock = StageClock()
         
         try:
             parsed_path = urllib.parse.urlparse(self.path)
@@ -1694,16 +6482,23 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             
             shot_id = int(time.time())
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"shot_{timestamp}_{shot_id}.json"
+            filename = new_shot_filename(timestamp, shot_id)
             filepath = os.path.join(DATA_DIR, filename)
+            clock.shot = filename
+            clock.lap('upload.parse')
+            machine_label = metrics.machine_label(machine_id, get_printer_registry().machines())
+            metrics.inc('uploads_total', machine_id=machine_label, type='multipart')
+            metrics.inc('upload_bytes_total', len(file_data), machine_id=machine_label, type='multipart')
             
             with open(filepath, 'wb') as f:
                 f.write(file_data)
+            clock.lap('upload.save')
             
             # 先发送响应 / Send response first
             response = {
                 'status': 'success',
                 'id': shot_id,
+                'filename': filename,
                 'message': f'Shot data received and saved as {filename}',
                 'timestamp': timestamp,
                 'upload_type': 'multipart',
@@ -1720,58 +6515,84 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             except BrokenPipeError:
                 print("⚠️ 客户端提前断开连接，但数据已保存 / Client disconnected early but data saved")
                 return
+            clock.lap('upload.ack')
             
             # 后台处理 / Background processing
             def background_processing(shots_list, machine_id, plugin_version):
-                try:
-                    # 生成图表 / Generate chart
-                    image_filename = filename.replace('.json', '.png')
-                    image_path = os.path.join(IMAGE_DIR, image_filename)
-                    image_generated = self.create_coffee_plot(filepath, image_path, machine_id)
-                    
-                    # 解析JSON数据 / Parse JSON data
+                with shot_stages(filename):
                     try:
-                        shot_data = json.loads(file_data.decode('utf-8'))
-                        shot_info = {
-                            'id': shot_id,
-                            'timestamp': timestamp,
-                            'filename': filename,
-                            'data_size': len(file_data),
-                            'clock': shot_data.get('clock', 'unknown'),
-                            'profile': shot_data.get('profile', {}).get('title', 'unknown') if isinstance(shot_data.get('profile'), dict) else shot_data.get('profile', 'unknown'),
-                            'success': True,
-                            'upload_type': 'multipart',
-                            'machine_id': machine_id,  # 新增
-                            'plugin_version': plugin_version
-                        }
-                    except json.JSONDecodeError:
-                        shot_info = {
-                            'id': shot_id,
-                            'timestamp': timestamp,
-                            'filename': filename,
-                            'data_size': len(file_data),
-                            'clock': 'unknown',
-                            'profile': 'unknown',
-                            'success': True,
-                            'note': 'Binary data (non-JSON)',
-                            'upload_type': 'multipart'
-                        }
+                        # 生成图表 / Generate chart
+                        image_filename = filename.replace('.json', '.png')
+                        image_path = os.path.join(IMAGE_DIR, image_filename)
+                        # 解析JSON数据 / Parse JSON data
+                        try:
+                            shot_data, series = parse_shot_upload(file_data)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            shot_data, series = None, None
+                    
+                        # 渲染前先做异常检查 / Check for anomalies before rendering
+                        with stage_timer('render.analyze'):
+                            anomaly = (analyze_shot(filename, shot_data, machine_id, series)
+                                       if isinstance(shot_data, dict) else None)
+                        reasons = anomaly['reasons'] if anomaly else None
+                        # 图表和打印位图由同一次渲染生成 / Chart and print raster come out of the same render
+                        image_generated = self.create_coffee_plot(filepath, image_path, machine_id, reasons,
+                                                                  raster_file=print_raster_path(image_path),
+                                                                  data=shot_data if series is not None else None,
+                                                                  series=series)
+                        rendered_at = time.time()
+                        if image_generated:
+                            with stage_timer('render.manifest'):
+                                record_render(filename, filepath, machine_id, reasons)
                     
-                    shots_list.append(shot_info)
-                    if len(shots_list) > 50:
-                        del shots_list[:-50]
+                        if shot_data is not None:
+                            shot_info = {
+                                'id': shot_id,
+                                'timestamp': timestamp,
+                                'filename': filename,
+                                'data_size': len(file_data),
+                                'clock': shot_data.get('clock', 'unknown'),
+                                'profile': shot_data.get('profile', {}).get('title', 'unknown') if isinstance(shot_data.get('profile'), dict) else shot_data.get('profile', 'unknown'),
+                                'success': True,
+                                'upload_type': 'multipart',
+                                'machine_id': machine_id,  # 新增
+                                'plugin_version': plugin_version,
+                                'anomaly': reasons
+                            }
+                        else:
+                            shot_data = {}
+                            shot_info = {
+                                'id': shot_id,
+                                'timestamp': timestamp,
+                                'filename': filename,
+                                'data_size': len(file_data),
+                                'clock': 'unknown',
+                                'profile': 'unknown',
+                                'success': True,
+                                'note': 'Binary data (non-JSON)',
+                                'upload_type': 'multipart'
+                            }
                     
-                    self.print_shot_info(shot_info)
+                        shots_list.append(shot_info)
+                        if len(shots_list) > 50:
+                            del shots_list[:-50]
+                        with stage_timer('upload.index'):
+                            get_shot_index().add(get_shot_index().build_record(
+                                filename, shot_data, machine_id, plugin_version, 'multipart',
+                                len(file_data), shot_id, timestamp, anomaly))
                     
-                    # 自动打印（如果启用）/ Auto print (if enabled)
-                    if PRINT_ENABLED and image_generated:
-                        print("🖨️ 开始在后台打印... / Starting background printing...")
-                        self.print_image(image_path)
+                        self.print_shot_info(shot_info)
                     
-                    print(f"✅ 后台处理完成 / Background processing completed: {filename}")
+                        # 自动打印（如果启用）/ Auto print (if enabled)
+                        if PRINT_ENABLED and image_generated:
+                            print("🖨️ 开始在后台打印... / Starting background printing...")
+                            self.print_image(image_path, shot=filename, raster=True, machine_id=machine_id,
+                                             received_at=received_at, rendered_at=rendered_at)
                     
-                except Exception as e:
-                    print(f"❌ 后台处理出错 / Background processing error: {e}")
+                        print(f"✅ 后台处理完成 / Background processing completed: {filename}")
+                    
+                    except Exception as e:
+                        print(f"❌ 后台处理出错 / Background processing error: {e}")
             
             threading.Thread(target=background_processing, args=(received_shots, machine_id, plugin_version), daemon=True).start()
                 
@@ -1786,6 +6607,7 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length)
             request_data = json.loads(post_data.decode('utf-8'))
+            status_code = 200
             
             if 'enabled' in request_data:
                 PRINT_ENABLED = request_data['enabled']
@@ -1802,12 +6624,25 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                     image_path = os.path.join(IMAGE_DIR, filename.replace('.json', '.png'))
                     
                     if os.path.exists(image_path):
-                        bmp_path = self.generate_print_image(image_path)
-                        success = self.print_image(bmp_path)
-                        response = {
-                            'success': success,
-                            'message': 'Print job sent' if success else 'Print failed'
-                        }
+                        # 手动打印优先于排队中的自动打印 / Manual prints go ahead of queued auto-prints
+                        machine_id = (get_shot_index().get(filename) or {}).get('machine_id')
+                        job = self.print_image(image_path, shot=filename, priority=PRINT_PRIORITY_MANUAL,
+                                               raster=True, machine_id=machine_id, received_at=time.time())
+                        if job:
+                            # 立即返回，进度通过 /api/print/jobs/<id> 和事件查看 / Reply at once; progress via the job endpoint and events
+                            status_code = 202
+                            response = {
+                                'success': True,
+                                'message': 'Print job queued',
+                                'job_id': job['id'],
+                                'status': job['status'],
+                                'status_url': f"/api/print/jobs/{job['id']}"
+                            }
+                        else:
+                            response = {
+                                'success': False,
+                                'message': 'Printing disabled'
+                            }
                     else:
                         response = {
                             'success': False,
@@ -1818,13 +6653,44 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
                         'success': False,
                         'message': 'No filename provided'
                     }
+            elif request_data.get('action') == 'print_batch':
+                # 多个冲泡合并为一张小票 / Several shots on one receipt
+                # 去重并保持顺序，同一冲泡不会在一张小票上打印两次 / Deduplicated in order so a shot never prints twice on one receipt
+                filenames = list(dict.fromkeys(os.path.basename(name) for name in request_data.get('filenames') or []))
+                image_paths = [os.path.join(IMAGE_DIR, name.replace('.json', '.png')) for name in filenames]
+                missing = [name for name, path in zip(filenames, image_paths) if not os.path.exists(path)]
+                if not filenames or missing:
+                    response = {
+                        'success': False,
+                        'message': f"Image file not found: {', '.join(missing)}" if missing else 'No filenames provided'
+                    }
+                elif not PRINT_ENABLED:
+                    response = {
+                        'success': False,
+                        'message': 'Printing disabled'
+                    }
+                else:
+                    digest = hashlib.sha1('\n'.join(filenames).encode('utf-8')).hexdigest()[:10]
+                    machine_id = (get_shot_index().get(filenames[0]) or {}).get('machine_id')
+                    job = get_print_scheduler().submit(image_paths[0], shot=f"batch:{digest}",
+                                                       priority=PRINT_PRIORITY_MANUAL, machine_id=machine_id,
+                                                       received_at=time.time(), batch=image_paths,
+                                                       cut_marks=bool(request_data.get('cut_marks', True)))
+                    status_code = 202
+                    response = {
+                        'success': True,
+                        'message': f'Batch print of {len(filenames)} shots queued',
+                        'job_id': job['id'],
+                        'status': job['status'],
+                        'status_url': f"/api/print/jobs/{job['id']}"
+                    }
             else:
                 response = {
                     'success': False,
                     'message': 'Invalid action'
                 }
             
-            self.send_response(200)
+            self.send_response(status_code)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
             self.wfile.write(json.dumps(response).encode('utf-8'))
@@ -1851,49 +6717,55 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(500, f"Clear queue error: {str(e)}")
 
     def get_print_queue_count(self):
-        """获取打印队列任务数量 / Get print queue task count"""
-        try:
-            result = subprocess.run(['lpstat', '-o'], capture_output=True, text=True)
-            if result.returncode == 0:
-                lines = [line for line in result.stdout.split('\n') if line.strip()]
-                return len(lines)
-            return 0
-        except:
-            return 0
+        """获取打印队列任务数量（来自缓存）/ Get print queue task count (from the cache)"""
+        return len(get_print_scheduler().cups_queue()[0])
 
     def get_print_queue_info(self):
-        """获取详细的打印队列信息 / Get detailed print queue information"""
+        """
+        获取详细的打印队列信息，CUPS任务关联到对应的冲泡
+        Get detailed print queue information, with CUPS jobs linked back to their shots
+        
+        读取后台线程缓存的CUPS任务，请求线程不运行lpstat；checked 为缓存时间
+        Reads the CUPS jobs cached by the background threads, so lpstat never runs on the request thread;
+        checked is when the cache was filled
+        """
+        cups_jobs, checked_at = get_print_scheduler().cups_queue()
+        checked = datetime.fromtimestamp(checked_at).strftime('%Y-%m-%d %H:%M:%S') if checked_at else None
         try:
-            result = subprocess.run(['lpstat', '-o'], capture_output=True, text=True)
             queue_items = []
-            
-            if result.returncode == 0:
-                lines = [line for line in result.stdout.split('\n') if line.strip()]
-                for line in lines:
-                    parts = line.split()
-                    if len(parts) >= 5:
-                        queue_items.append({
-                            'job_id': parts[0],
-                            'filename': parts[4] if len(parts) > 4 else 'Unknown',
-                            'status': 'Pending',
-                            'added_time': datetime.now().strftime('%H:%M:%S')
-                        })
+            for job_id, cups_job in cups_jobs.items():
+                tracked = get_print_scheduler().find_backend(job_id)
+                queue_items.append({
+                    'job_id': job_id,
+                    'filename': tracked['shot'] if tracked else 'Unknown',
+                    'printer': tracked['printer'] if tracked else None,
+                    'status': cups_job['status'],
+                    'added_time': tracked['submitted'] if tracked else cups_job['submitted']
+                })
             
             return {
                 'queue_count': len(queue_items),
-                'queue_items': queue_items
+                'queue_items': queue_items,
+                'checked': checked,
+                'scheduler': get_print_scheduler().snapshot()
             }
         except Exception as e:
             return {
                 'queue_count': 0,
                 'queue_items': [],
+                'checked': checked,
+                'scheduler': get_print_scheduler().snapshot(),
                 'error': str(e)
             }
 
     def clear_print_queue(self):
         """清空打印队列 / Clear print queue"""
+        cancelled = get_print_scheduler().cancel_all()
+        if cancelled:
+            print(f"🗑️ 已取消 {cancelled} 个排队中的打印任务 / Cancelled {cancelled} scheduled print jobs")
         try:
-            result = subprocess.run(['cancel', '-a', '-x'], capture_output=True, text=True)
+            result = subprocess.run(['cancel', '-a', '-x'], capture_output=True, text=True,
+                                    timeout=CUPS_QUERY_TIMEOUT)
             return result.returncode == 0
         except Exception as e:
             print(f"❌ 清空打印队列失败 / Failed to clear print queue: {e}")
@@ -1901,764 +6773,48 @@ class PrintTheShotHandler(http.server.SimpleHTTPRequestHandler):
           
     
 
-    def create_coffee_plot(self, input_file, output_file, machine_id='UNKNOWN'):
-        """
-        Create black and white bitmap suitable for receipt printer from Decent espresso machine JSON data
-        从Decent咖啡机JSON数据创建适合小票打印机的黑白位图
-        """
+    def create_coffee_plot(self, input_file, output_file, machine_id='UNKNOWN', anomaly=None, raster_file=None,
+                           data=None, series=None):
+        """生成冲泡图表 / Render the shot chart (see module-level create_coffee_plot)"""
+        metrics.inc('renders_in_progress')
+        started = time.perf_counter()
         try:
-            matplotlib.rcdefaults()
-            print(f"📊 Generating chart: {input_file}")
-            
-            # ============ 设置图表文本（根据当前语言） ============
-            # Set chart text (based on current language)
-            chart_texts = {
-                'pressure_label': f"{get_text('chart_pressure')} ({get_text('chart_pressure_unit')})",
-                'flow_label': f"{get_text('chart_flow')} ({get_text('chart_flow_unit')})",
-                'temp_label': f"{get_text('chart_temperature')} ({get_text('chart_temperature_unit')})",
-                'water_flow': get_text('chart_water_flow'),
-                'coffee_flow': get_text('chart_coffee_flow'),
-                'pressure': get_text('chart_pressure'),
-                'basket_temp': get_text('chart_temperature'),
-                'date_time_title': get_text('chart_date_time'),
-                'profile_title': get_text('chart_profile'),
-                'extraction_title': get_text('chart_extraction'),
-                'grinder_temp_title': get_text('chart_grinder_temp'),
-                'in_weight_label': get_text('chart_in_weight'),
-                'out_weight_label': get_text('chart_out_weight'),
-                'shot_time_label': get_text('chart_shot_time'),
-                'grind_label': get_text('chart_grind_setting'),
-                'initial_temp_label': get_text('chart_initial_temp'),
-                'unknown_profile': get_text('chart_unknown_profile'),
-                'na': get_text('chart_na'),
-                'time_label': f"{get_text('chart_time')} ({get_text('chart_time_unit')})",
-                'bean_info': get_text('chart_bean_info'),
-                'profile_info': get_text('chart_profile_info'),  # 新增
-                'tasting_note': get_text('chart_tasting_note'),
-            }
-            
-            # ============ 设置中文字体支持 ============
-            # Setup Chinese font support
-            import matplotlib.font_manager as fm
-            
-            # 尝试使用跨平台字体 / Try to use cross-platform fonts
-            font_found = False
-            font_path = None
-            
-            # 常见的中文字体在不同平台的路径 / Common Chinese font paths on different platforms
-            font_candidates = [
-                # Windows 字体 / Windows fonts
-                "C:\\Windows\\Fonts\\simhei.ttf",  # 黑体 / HeiTi
-                "C:\\Windows\\Fonts\\msyh.ttc",    # 微软雅黑 / Microsoft YaHei
-                "C:\\Windows\\Fonts\\simsun.ttc",  # 宋体 / SongTi
-                
-                # macOS 字体 / macOS fonts
-                "/System/Library/Fonts/PingFang.ttc",      # 苹方 / PingFang
-                "/System/Library/Fonts/STHeiti Light.ttc", # 黑体-简 / HeiTi Simplified
-                "/System/Library/Fonts/STHeiti Medium.ttc",
-                
-                # Linux 字体 / Linux fonts (usually install WenQuanYi)
-                "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",  # 文泉驿微米黑
-                "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",  # Noto Sans CJK
-                
-                # 尝试更通用的路径 / Try more general paths
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # 备用字体，至少显示方框 / Fallback font
-            ]
-            
-            # 首先尝试找到可用的中文字体 / First try to find available Chinese font
-            for candidate in font_candidates:
-                if os.path.exists(candidate):
-                    font_path = candidate
-                    font_found = True
-                    print(f"✅ Found font file: {candidate}")
-                    break
-            
-            # 如果没找到字体文件，尝试使用系统默认字体 / If no font found, try system default fonts
-            if not font_found:
-                try:
-                    # 查找系统中可用的中文字体 / Find available Chinese fonts in system
-                    fonts = [f for f in fm.findSystemFonts() if any(keyword in f.lower() for keyword in ['chinese', 'cjk', 'hei', 'song', 'msyh', 'pingfang', 'noto'])]
-                    if fonts:
-                        font_path = fonts[0]
-                        font_found = True
-                        print(f"✅ Found system font: {font_path}")
-                except:
-                    pass
-            
-            with open(input_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 数据提取和处理（保持不变） / Data extraction and processing (unchanged)
-            elapsed = list(map(float, data['elapsed']))
-            pressure = list(map(float, data['pressure']['pressure']))
-            flow = list(map(float, data['flow']['flow']))
-            flow_by_weight = list(map(float, data['flow']['by_weight']))
-            basket_temp = list(map(float, data['temperature']['basket']))
-            
-            min_length = min(len(elapsed), len(pressure), len(flow), len(flow_by_weight), len(basket_temp))
-            elapsed = elapsed[:min_length]
-            pressure = pressure[:min_length]
-            flow = flow[:min_length]
-            flow_by_weight = flow_by_weight[:min_length]
-            basket_temp = basket_temp[:min_length]
-            
-            # 在创建图表之前设置字体（重要！）/ Set font before creating chart (important!)
-            if font_found and font_path:
-                try:
-                    # 添加字体到matplotlib / Add font to matplotlib
-                    fm.fontManager.addfont(font_path)
-                    font_prop = fm.FontProperties(fname=font_path)
-                    font_name = font_prop.get_name()
-                    
-                    # 设置matplotlib使用这个字体 / Set matplotlib to use this font
-                    matplotlib.rcParams['font.sans-serif'] = [font_name]
-                    matplotlib.rcParams['axes.unicode_minus'] = False
-                    
-                    print(f"✅ Using font: {font_name}")
-                except Exception as e:
-                    print(f"⚠️ Font setup failed: {e}")
-                    # 设置回退方案 / Setup fallback
-                    matplotlib.rcParams['font.sans-serif'] = ['DejaVu Sans', 'Arial Unicode MS', 'SimHei', 'Microsoft YaHei']
-                    matplotlib.rcParams['axes.unicode_minus'] = False
-            else:
-                # 回退方案：设置常见的中文字体名称 / Fallback: set common Chinese font names
-                if is_windows():
-                    matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial']
-                elif platform.system() == 'Darwin':  # macOS
-                    matplotlib.rcParams['font.sans-serif'] = ['PingFang TC', 'Heiti SC', 'Arial Unicode MS']
-                else:  # Linux
-                    matplotlib.rcParams['font.sans-serif'] = ['WenQuanYi Micro Hei', 'DejaVu Sans', 'Arial']
-                matplotlib.rcParams['axes.unicode_minus'] = False
-            
-            print(f"  Data length: {min_length} samples")
-            
-            # 图表尺寸计算（保持不变） / Chart size calculation (unchanged)
-            multiplier = 1
-            width_px = 576 * multiplier
-            height_px = int(width_px * 180 / 80)
-            dpi = 203
-            fig_width = width_px / dpi
-            fig_height = height_px / dpi
-            
-            fig = plt.figure(figsize=(fig_height, fig_width), dpi=dpi)
-
-            font_m = 8 * multiplier
-            font_l = 10 * multiplier
-            
-            # ============ 智能判断是否显示豆子信息 ============
-            # Intelligent decision whether to display bean info
-            has_bean_info = False
-            bean_data = {}
-            
-            try:
-                bean_data = data.get('meta', {}).get('bean', {})
-                # 检查是否有有效的豆子信息（至少包含brand、type或notes字段）
-                # Check if valid bean info exists (at least contains brand, type or notes field)
-                if (bean_data and 
-                    (bean_data.get('brand') or bean_data.get('type') or bean_data.get('notes'))):
-                    has_bean_info = True
-                    print(f"✅ Found bean info in JSON: {bean_data.get('brand', 'Unknown')}")
-            except Exception as e:
-                print(f"⚠️ Error checking bean info: {e}")
-                has_bean_info = False
-            
-            # 只有当全局设置启用且有豆子信息时才显示豆子信息
-            # Only display bean info when global setting is enabled AND bean info exists
-            bean_info_enabled = BEAN_INFO_ENABLED and has_bean_info
-            
-            # 记录日志以便调试 / Log for debugging
-            if BEAN_INFO_ENABLED and not has_bean_info:
-                print(f"⚠️ Bean info setting is enabled but no bean data found in JSON")
-            elif has_bean_info and not BEAN_INFO_ENABLED:
-                print(f"ℹ️ Bean data exists but global setting is disabled")
-            elif bean_info_enabled:
-                print(f"✅ Will display bean info from JSON")
-            
-            # ============ 创建图表布局 ============
-            # Create chart layout
-            # 总是创建三列网格（即使不显示豆子信息，也保留空间）
-            # Always create three-column grid (reserve space even if not displaying bean info)
-            gs = plt.GridSpec(1, 3, width_ratios=[0.65, 0.12, 0.23], wspace=0.2)
-            
-            ax_left = fig.add_subplot(gs[0])
-            ax_right = ax_left.twinx()
-            ax_temp = ax_left.twinx()
-            
-            # 添加机器ID标签（如果存在）/ Add machine ID label (if exists)
-            if machine_id != 'UNKNOWN':
-                machine_label = get_text('chart_machine_id_label')
-                fig.text(0.03, 0.0, f"{machine_label}: {machine_id}",
-                        fontsize=font_m * 0.8,
-                        verticalalignment='bottom',
-                        horizontalalignment='left',
-                        bbox=dict(boxstyle='round,pad=0.2', 
-                                  facecolor='white', 
-                                  alpha=0.7,
-                                  edgecolor='black',
-                                  linewidth=0.5))
-            
-            ax_text1 = fig.add_subplot(gs[1])  # 第一列文本（冲煮信息）/ First column text (brew info)
-            ax_text1.axis('off')
-            
-            # 总是创建第二列区域（豆子信息或方案信息）
-            # Always create second column area (bean info or profile info)
-            ax_text2 = fig.add_subplot(gs[2])
-            ax_text2.axis('off')
-            
-            # 设置温度轴位置 / Set temperature axis position
-            ax_temp.spines['left'].set_position(('axes', -0.10))
-            ax_temp.yaxis.set_ticks_position('left')
-            ax_temp.yaxis.set_label_position('left')
-            
-            # 绘图线条设置 / Plot line settings
-            line_width = 1.25 * multiplier
-            
-            # 绘制曲线 / Draw curves
-            ax_left.plot(elapsed, pressure, linestyle='-', linewidth=line_width, 
-                        label=chart_texts['pressure'], color='black')
-            ax_right.plot(elapsed, flow, linestyle='--', linewidth=line_width, 
-                          label=chart_texts['water_flow'], color='black')
-            ax_right.plot(elapsed, flow_by_weight, linestyle=':', linewidth=line_width, 
-                          label=chart_texts['coffee_flow'], color='black')
-            ax_temp.plot(elapsed, basket_temp, 
-                        linestyle='-.', linewidth=line_width, 
-                        label=chart_texts['basket_temp'], color='black')
-            
-            # 设置坐标轴范围和标签 / Set axis ranges and labels
-            ax_left.set_ylim(0, 10)  # 压力固定在0-10 / Pressure fixed 0-10
-            ax_left.set_ylabel(chart_texts['pressure_label'], fontsize=font_m)
-            ax_left.yaxis.set_label_coords(-0.05, 0.5)
-
-            ax_right.set_ylim(0, 10)  # 流速固定在0-10 / Flow rate fixed 0-10
-            ax_right.set_ylabel(chart_texts['flow_label'], fontsize=font_m)
-            ax_right.yaxis.set_label_coords(1.06, 0.5)
-
-            ax_temp.set_ylim(0, 100)  # 温度固定在0-100度 / Temperature fixed 0-100
-            ax_temp.set_ylabel(chart_texts['temp_label'], fontsize=font_m)
-            ax_temp.yaxis.set_label_coords(-0.18, 0.5)
-
-            # 添加图例 / Add legend
-            legend_fontsize = font_m * 0.8
-            lines_left, labels_left = ax_left.get_legend_handles_labels()
-            lines_right, labels_right = ax_right.get_legend_handles_labels()
-            lines_temp, labels_temp = ax_temp.get_legend_handles_labels()
-            
-            all_lines = lines_left + lines_right + lines_temp
-            all_labels = labels_left + labels_right + labels_temp
-            
-            ax_left.legend(all_lines, all_labels, 
-              fontsize=legend_fontsize, loc='lower center', frameon=True, 
-              fancybox=False, framealpha=0.0,
-              ncol=4,
-              bbox_to_anchor=(0.5, -0.18))
-            
-            # 添加网格 / Add grid
-            ax_left.grid(True, linestyle='--', alpha=0.6, linewidth=line_width / 2, color='black')
-            
-            # 设置刻度标签大小 / Set tick label size
-            ax_left.tick_params(axis='both', which='major', labelsize=font_m)
-            ax_right.tick_params(axis='y', which='major', labelsize=font_m)
-            ax_temp.tick_params(axis='y', which='major', labelsize=font_m)
-            
-            # 设置边框线宽 / Set border line width
-            for spine in ax_left.spines.values():
-                spine.set_linewidth(line_width)
-            for spine in ax_right.spines.values():
-                spine.set_linewidth(line_width)
-            for spine in ax_temp.spines.values():
-                spine.set_linewidth(line_width)
-            def smart_wrap_text(text, column_num=1):
-                """
-                Simplified text wrapping based on character count - 基于字符数的简化换行
-                This is more reliable across different systems and fonts
-                这在不同系统和字体下更可靠
-                """
-                if not text:
-                    return []
-                
-                # ============ 配置参数 ============
-                # Configure parameters / 配置参数
-                # 针对小票打印机的优化值（576像素宽度）
-                # Optimized values for receipt printer (576px width)
-                if column_num == 2:  # 第二列（咖啡豆信息）
-                    # Second column (bean info) - narrower
-                    MAX_CHARS_PER_LINE_CHINESE = 12  # 中文字符每行限制
-                    MAX_CHARS_PER_LINE_ENGLISH = 25  # 英文字符每行限制
-                else:  # 第一列（冲煮信息）
-                    # First column (brew info) - wider
-                    MAX_CHARS_PER_LINE_CHINESE = 7  # 中文字符每行限制
-                    MAX_CHARS_PER_LINE_ENGLISH = 15  # 英文字符每行限制
-                
-                MAX_LINES = 12  # 最大行数限制
-                
-                # ============ 检测文本类型 ============
-                # Detect text type / 检测文本类型
-                def detect_text_type(text):
-                    """Detect if text is mostly Chinese or English / 检测文本主要是中文还是英文"""
-                    if not text:
-                        return 'unknown'
-                    
-                    # 统计中文字符 / Count Chinese characters
-                    chinese_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-                    total_chars = len(text)
-                    
-                    if total_chars == 0:
-                        return 'unknown'
-                    
-                    # 如果超过30%是中文字符，认为是中文文本 / If over 30% are Chinese, consider it Chinese text
-                    if chinese_count / total_chars > 0.3:
-                        return 'chinese'
-                    else:
-                        return 'english'
-                
-                text_type = detect_text_type(text)
-                
-                # ============ 使用textwrap进行智能换行 ============
-                # Use textwrap for smart line breaking / 使用textwrap进行智能换行
-                try:
-                    import textwrap
-                    
-                    # 根据文本类型选择每行最大字符数 / Select max chars per line based on text type
-                    if text_type == 'chinese':
-                        width = MAX_CHARS_PER_LINE_CHINESE
-                        # 中文处理：按字符换行 / Chinese processing: break by character
-                        lines = []
-                        current_line = ''
-                        
-                        for char in text:
-                            # 中文标点处理 / Chinese punctuation handling
-                            if char in '，。、；！？「」『』（）【】《》':
-                                # 标点不占行长度限制 / Punctuation doesn't count toward line length
-                                current_line += char
-                            elif len(current_line) >= width:
-                                lines.append(current_line)
-                                current_line = char
-                            else:
-                                current_line += char
-                        
-                        if current_line:
-                            lines.append(current_line)
-                            
-                    else:  # 英文或混合文本 / English or mixed text
-                        width = MAX_CHARS_PER_LINE_ENGLISH
-                        
-                        # 使用textwrap的智能换行（保留单词完整性）/ Use textwrap's smart wrapping (preserves word integrity)
-                        lines = textwrap.wrap(
-                            text,
-                            width=width,
-                            break_long_words=False,  # 不分割长单词 / Don't break long words
-                            break_on_hyphens=True,   # 在连字符处可以分割 / Can break at hyphens
-                            drop_whitespace=True,
-                            replace_whitespace=True
-                        )
-                        
-                        # 处理textwrap可能无法处理的极长单词 / Handle extremely long words that textwrap can't handle
-                        final_lines = []
-                        for line in lines:
-                            if len(line) > width * 1.5:  # 如果行仍然太长 / If line is still too long
-                                # 在合理位置分割 / Split at reasonable positions
-                                # 尝试在空格、连字符、逗号后分割 / Try to split after spaces, hyphens, commas
-                                split_points = [' ', '-', ',', ';', '.']
-                                for split_char in split_points:
-                                    if split_char in line:
-                                        parts = line.split(split_char)
-                                        if len(parts) > 1:
-                                            # 重建行，确保每部分不超过宽度 / Rebuild lines ensuring each part doesn't exceed width
-                                            for i, part in enumerate(parts):
-                                                if i > 0:
-                                                    part = split_char + part
-                                                if len(part) > width:
-                                                    # 实在不行就按字符分割 / As last resort, split by character
-                                                    for j in range(0, len(part), width):
-                                                        final_lines.append(part[j:j+width])
-                                                else:
-                                                    final_lines.append(part)
-                                            break
-                                else:
-                                    # 没有分割点，按字符分割 / No split points, split by character
-                                    for j in range(0, len(line), width):
-                                        final_lines.append(line[j:j+width])
-                            else:
-                                final_lines.append(line)
-                        
-                        lines = final_lines
-                    
-                    # ============ 限制最大行数 ============
-                    # Limit maximum lines / 限制最大行数
-                    if len(lines) > MAX_LINES:
-                        lines = lines[:MAX_LINES]
-                        lines.append("...")
-                    
-                    return lines
-                    
-                except ImportError:
-                    # 备用方案：简单的字符计数换行 / Fallback: simple character count wrapping
-                    print("⚠️ textwrap not available, using simple wrapping")
-                    
-                    width = MAX_CHARS_PER_LINE_ENGLISH if text_type == 'english' else MAX_CHARS_PER_LINE_CHINESE
-                    lines = []
-                    
-                    # 简单的换行逻辑 / Simple wrapping logic
-                    words = text.split()
-                    current_line = ''
-                    
-                    for word in words:
-                        if len(current_line) + len(word) + 1 <= width:
-                            if current_line:
-                                current_line += ' ' + word
-                            else:
-                                current_line = word
-                        else:
-                            if current_line:
-                                lines.append(current_line)
-                            # 检查单词本身是否太长 / Check if word itself is too long
-                            if len(word) > width:
-                                # 分割长单词 / Split long word
-                                for i in range(0, len(word), width):
-                                    lines.append(word[i:i+width])
-                                current_line = ''
-                            else:
-                                current_line = word
-                    
-                    if current_line:
-                        lines.append(current_line)
-                    
-                    # 限制行数 / Limit lines
-                    if len(lines) > MAX_LINES:
-                        lines = lines[:MAX_LINES]
-                        lines.append("...")
-                    
-                    return lines
-            # ============ 第一列文本处理（冲煮方案等） ============
-            # First column text processing (brew profile etc.)
-            # 获取冲煮方案名称 / Get profile name
-            profile_title = data['profile'].get('title', 'Unknown Profile')
-            # 使用智能换行 / Use smart wrapping
-            profile_lines = smart_wrap_text(profile_title, column_num=1)
-            
-            # 获取冲泡参数 / Get brew parameters
-            in_weight = data['meta'].get('in', 'N/A')
-            out_weight = data['meta'].get('out', 'N/A')
-            shot_time = data['meta'].get('time', 'N/A')
-            grinder_setting = data['meta'].get('grinder', {}).get('setting', 'N/A')
-            
-            # 日期时间处理 / Date time processing
-            date_str = data.get('date', '')
-            timestamp = data.get('timestamp', '')
-            
-            if timestamp:
-                try:
-                    date_obj = datetime.fromtimestamp(float(timestamp))
-                    formatted_date = date_obj.strftime('%Y-%m-%d')
-                    formatted_time = date_obj.strftime('%H:%M:%S')
-                except:
-                    formatted_date = 'N/A'
-                    formatted_time = 'N/A'
-            elif date_str:
-                try:
-                    date_obj = datetime.strptime(date_str, '%a %b %d %H:%M:%S %Y')
-                    formatted_date = date_obj.strftime('%Y-%m-%d')
-                    formatted_time = date_obj.strftime('%H:%M:%S')
-                except:
-                    formatted_date = 'N/A'
-                    formatted_time = 'N/A'
-            else:
-                formatted_date = 'N/A'
-                formatted_time = 'N/A'
-            
-            initial_basket_temp = basket_temp[0]
-            
-            # 构建第一列文本内容 / Build first column text content
-            text_content1 = []
-            text_content1.append(chart_texts['date_time_title'])
-            text_content1.append("──────")
-            text_content1.append(formatted_date)
-            text_content1.append(formatted_time)
-            text_content1.append("")
-            text_content1.append(chart_texts['profile_title'])
-            text_content1.append("──────")
-            
-            # 添加冲煮方案（可能有多行）/ Add profile (may have multiple lines)
-            if profile_lines:
-                for line in profile_lines:
-                    text_content1.append(line)
-            else:
-                text_content1.append(profile_title[:12])
-            text_content1.append("")
-            
-            text_content1.append(chart_texts['extraction_title'])
-            text_content1.append("──────")
-            text_content1.append(f"{chart_texts['in_weight_label']}: {in_weight}g")
-            text_content1.append(f"{chart_texts['out_weight_label']}: {out_weight}g")
-            text_content1.append(f"{chart_texts['shot_time_label']}: {shot_time}s")
-            text_content1.append("")
-            
-            text_content1.append(chart_texts['grinder_temp_title'])
-            text_content1.append("──────")
-            text_content1.append(f"{chart_texts['grind_label']}: {grinder_setting}")
-            text_content1.append(f"{chart_texts['initial_temp_label']}: {initial_basket_temp:.1f}°C")
-            
-            # 绘制第一列文本 / Draw first column text
-            y_position = 0.98
-            line_height = 0.05  # 行间距 / Line spacing
-            
-            for i, text in enumerate(text_content1):
-                if text in [chart_texts['date_time_title'], chart_texts['profile_title'], 
-                          chart_texts['extraction_title'], chart_texts['grinder_temp_title']]:
-                    fontsize = font_l
-                    weight = 'bold'
-                elif text == "──────":
-                    fontsize = font_m
-                    weight = 'normal'
-                    y_position -= line_height * 0.5  # 分隔线后的间距小一些 / Smaller spacing after separator
-                elif text == "":
-                    y_position -= line_height * 0.3  # 空行间距 / Empty line spacing
-                else:
-                    fontsize = font_m
-                    weight = 'normal'
-                
-                ax_text1.text(0.05, y_position, text, 
-                            fontsize=fontsize, ha='left', va='top',
-                            transform=ax_text1.transAxes,
-                            weight=weight)
-                y_position -= line_height
-            
-            # ============ 第二列文本处理（智能选择豆子信息或方案信息） ============
-            # Second column text processing (intelligent choice between bean info or profile info)
-            text_content2 = []
-
-            if has_bean_info:
-                # 有豆子信息：显示Bean Info / Has bean info: display Bean Info
-                title = chart_texts['bean_info']
-                print(f"📝 Displaying bean info: {bean_data.get('brand', 'Unknown')}")
-            else:
-                # 没有豆子信息：显示Profile Info / No bean info: display Profile Info
-                title = chart_texts['profile_info']
-                print(f"📝 No bean info found, displaying profile info")
-
-            text_content2.append(title)
-            text_content2.append("──────")
-
-            if has_bean_info:
-                # 构建豆子信息显示行 / Build bean info display lines
-                # 第一行：品牌和品种 / Line 1: Brand and type
-                brand = bean_data.get('brand', '')
-                bean_type = bean_data.get('type', '')
-                if brand and bean_type:
-                    line1 = f"{brand} - {bean_type}"
-                elif brand:
-                    line1 = brand
-                elif bean_type:
-                    line1 = bean_type
-                else:
-                    line1 = ""
-                
-                # 第二行：风味描述 / Line 2: Flavor notes
-                line2 = bean_data.get('notes', '')
-                
-                # 第三行：烘焙度和日期 / Line 3: Roast level and date
-                roast_info = []
-                if bean_data.get('roast_level'):
-                    roast_info.append(bean_data['roast_level'])
-                if bean_data.get('roast_date'):
-                    roast_date = bean_data['roast_date']
-                    # 格式化日期：YYYYMMDD -> YYYY-MM-DD / Format date: YYYYMMDD -> YYYY-MM-DD
-                    if len(roast_date) == 8 and roast_date.isdigit():
-                        formatted_date = f"{roast_date[:4]}-{roast_date[4:6]}-{roast_date[6:8]}"
-                        roast_info.append(formatted_date)
-                line3 = ' '.join(roast_info)
-                
-                # 处理每一行文本（使用智能换行）/ Process each line (using smart wrapping)
-                for line in [line1, line2, line3]:
-                    if line:  # 只处理非空行 / Only process non-empty lines
-                        wrapped_lines = smart_wrap_text(line, column_num=2)
-                        for wrapped_line in wrapped_lines:
-                            text_content2.append(wrapped_line)
-                        # text_content2.append("")  # 行间空行 / Empty line between lines
-                
-                # 检查是否有JSON提供的品尝笔记 / Check if there are tasting notes from JSON
-                shot_data = data.get('meta', {}).get('shot', {})
-                shot_notes = shot_data.get('notes', '')
-                
-                if shot_notes:
-                    # 如果有JSON提供的品尝笔记，也添加到豆子信息部分
-                    # If there are tasting notes from JSON, also add them to bean info section
-                    text_content2.append("Tasting Note (from JSON):")
-                    text_content2.append("──────")
-                    tasting_lines = smart_wrap_text(shot_notes, column_num=2,)
-                    for tasting_line in tasting_lines:
-                        text_content2.append(tasting_line)
-                    text_content2.append("")  # 空行分隔 / Empty line separator
-
+            if RENDER_WORKERS and series is not None:
+                # 渲染在其他进程中进行，本线程只有等待可剖析，因此不剖析
+                # The render runs in another process and this thread only waits, so it is not profiled
+                generated = render_shared(input_file, output_file, machine_id, anomaly, raster_file, data, series)
             else:
-                # 显示方案信息（profile notes）/ Display profile info (profile notes)
-                notes = data['profile'].get('notes', '')
-                
-                if notes:
-                    # 处理profile notes（使用智能换行）/ Process profile notes (using smart wrapping)
-                    notes_lines = smart_wrap_text(notes, column_num=2)
-                    
-                    for line in notes_lines:
-                        text_content2.append(line)
-                else:
-                    text_content2.append(chart_texts['na'])
-
-            # ============ 固定添加品尝笔记区域（供用户手写） ============
-            # Fixed add tasting note area (for user to write manually)
-            text_content2.append("")  # 空行分隔 / Empty line separator
-            text_content2.append(chart_texts['tasting_note'])
-            text_content2.append("──────")
-            # 留出空白行供用户填写 / Leave blank lines for user to fill in
-            text_content2.append("")  # 空白行1 / Blank line 1
-            text_content2.append("")  # 空白行2 / Blank line 2
-            text_content2.append("")  # 空白行3 / Blank line 3
-            text_content2.append("")  # 空白行4 / Blank line 4
-
-            # 绘制第二列文本 / Draw second column text
-            y_position2 = 0.98
-
-            for i, text in enumerate(text_content2):
-                if text in [chart_texts['bean_info'], chart_texts['profile_info'], 
-                          chart_texts['tasting_note'], "Tasting Note (from JSON):"]:
-                    fontsize = font_l
-                    weight = 'bold'
-                elif text == "──────":
-                    fontsize = font_m
-                    weight = 'normal'
-                    y_position2 -= line_height * 0.5
-                elif text == "":
-                    y_position2 -= line_height * 0.3
-                else:
-                    fontsize = font_m
-                    weight = 'normal'
-                
-                ax_text2.text(0.01, y_position2, text,
-                            fontsize=fontsize, ha='left', va='top',
-                            transform=ax_text2.transAxes,
-                            weight=weight)
-                y_position2 -= line_height
-            
-            # 保存图表 / Save chart
-            plt.tight_layout(pad=0.5)
-            plt.savefig(output_file, dpi=dpi, bbox_inches='tight', 
-                        facecolor='white', edgecolor='none',
-                        pad_inches=0.1)
-            plt.close(fig)
-            
-            print(f"✅ Chart generated: {output_file}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Chart generation failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return False
+                with profiler.profile('render', os.path.splitext(os.path.basename(input_file))[0]):
+                    generated = create_coffee_plot(input_file, output_file, machine_id, anomaly, raster_file,
+                                                   data=data, series=series)
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.inc('renders_in_progress', -1)
+            metrics.inc('render_busy_seconds_total', seconds)
+        if generated:
+            metrics.observe('render_seconds', seconds, renderer=RENDERER)
+        else:
+            metrics.inc('render_failures_total', renderer=RENDERER)
+        return generated
           
-    def generate_print_image(self, png_path):
-        """为打印生成专门的BMP文件 / Generate specialized BMP file for printing"""
-        try:
-            bmp_path = png_path.replace('.png', '_print.bmp')
-            
-            target_width = 576 * 4
-            target_height = int(target_width * 180 / 80)
-            
-            img = Image.open(png_path)
-            img = img.convert('L')
-            img = img.resize((target_height, target_width), Image.LANCZOS)
-            img_rotated = img.rotate(90, expand=True)
-            
-            threshold = 200
-            img_rotated = img_rotated.point(lambda p: 255 if p > threshold else 0)
-            img_rotated = img_rotated.convert('1')
-            
-            img_rotated.save(bmp_path, 'BMP')
-            
-            print(f"🖨️ Print image generated: {bmp_path}")
-            return bmp_path
-            
-        except Exception as e:
-            print(f"❌ Print image generation failed: {str(e)}")
-            return png_path
+    def generate_print_image(self, png_path, paper=None):
+        """为打印生成1位位图 / Generate the 1-bit print raster"""
+        return generate_print_image(png_path, paper)
 
-    def print_image(self, image_path):
+    def print_image(self, image_path, shot=None, priority=PRINT_PRIORITY_AUTO, raster=False, machine_id=None,
+                    received_at=None, rendered_at=None):
+        """
+        把图像交给打印调度器排队，按机器ID选择打印机 / Queue an image on the print scheduler, picking the printer by machine ID
+        
+        返回打印任务 / Returns the print job
+        """
         if not PRINT_ENABLED:
             print("🖨️ Printing disabled, skipping")
-            return False
-            
-        if not os.path.exists(image_path):
-            print(f"❌ 图像文件不存在: {image_path}")
-            return False
-            
-        try:
-            print("🖨️ Sending print job...")
-            
-            if is_windows():
-                # Windows打印 - 尝试多种方法
-                print("🪟 使用Windows打印方式")
-                
-                # 方法1: 使用高级Windows打印API
-                success = windows_print_image(image_path)
-                if success:
-                    return True
-                    
-                # 方法2: 使用简单系统打印
-                print("🔄 尝试简单打印方法...")
-                success = windows_simple_print(image_path)
-                if success:
-                    return True
-                    
-                # 方法3: 使用mspaint打印（备用方案）
-                print("🔄 尝试备用打印方法...")
-                success = self.windows_fallback_print(image_path)
-                if success:
-                    return True
-                    
-                print("❌ 所有Windows打印方法都失败了")
-                return False
-            else:
-                # 使用优化的打印命令减少走纸 / Use optimized print command to reduce paper feed
-                cmd = [
-                    'lpr', 
-                    image_path,
-                    '-o', 'media=Custom.80x180mm',
-                    '-o', 'fit-to-page',
-                    '-o', 'margin-top=0',
-                    '-o', 'margin-bottom=0'
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                
-                if result.returncode == 0:
-                    print("✅ Print job sent successfully")
-                    
-                    if image_path.endswith('_print.bmp') and os.path.exists(image_path):
-                        os.remove(image_path)
-                        
-                    return True
-                else:
-                    # 备用打印命令 / Alternative print command
-                    cmd = [
-                        'lp',
-                        image_path,
-                        '-o', 'media=Custom.80x180mm',
-                        '-o', 'fit-to-page',
-                        '-o', 'margin-top=0'
-                    ]
-                    
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    
-                    if result.returncode == 0:
-                        print("✅ Print job sent (using lp command)")
-                        if image_path.endswith('_print.bmp') and os.path.exists(image_path):
-                            os.remove(image_path)
-                        return True
-                    else:
-                        print(f"❌ Print failed: {result.stderr}")
-                        return False
-                        
-        except Exception as e:
-            print(f"❌ Print error: {str(e)}")
-            return False
+            return None
+        with stage_timer('print.enqueue'):
+            return get_print_scheduler().submit(image_path, shot=shot, priority=priority, raster=raster,
+                                                machine_id=machine_id, received_at=received_at,
+                                                rendered_at=rendered_at)
 
     def print_shot_info(self, shot_info):
         """打印接收信息 / Print reception info"""
@@ -2731,6 +6887,7 @@ def print_server_info(port):
     print(f"🍳  图片目录 / Image directory: {os.path.abspath(IMAGE_DIR)}")
     print(f"🍳  最大用户数 / Max users: {MAX_USERS}")
     print(f"🍳  打印功能 / Printing: {'启用 / Enabled' if PRINT_ENABLED else '禁用 / Disabled'}")
+    print(f"🍳  渲染引擎 / Renderer: {RENDERER}")
     print(f"🍳  启动时间 / Start time: {server_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"🍳  当前语言 / Current language: {current_language}")
     print(f"🍳  主机名 / Hostname: {hostname}")
@@ -2738,11 +6895,144 @@ def print_server_info(port):
     print("🍳  按 Ctrl+C 停止服务器 / Press Ctrl+C to stop server")
     print("")
 
+def parse_args(argv=None):
+    """解析命令行参数 / Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='PrintTheShot Server v' + VERSION)
+    parser.add_argument('--port', type=int, default=8000,
+                        help='监听端口 / Port to listen on (default: 8000)')
+    parser.add_argument('--paper', choices=sorted(PAPER_PROFILES), default=PAPER_PROFILE,
+                        help=f'默认纸张规格 / Default paper profile (default: {PAPER_PROFILE})')
+    parser.add_argument('--renderer', choices=RENDERERS, default=RENDERER,
+                        help=f'小票渲染引擎 / Receipt rendering engine (default: {RENDERER})')
+    parser.add_argument('--slow-stage', type=float, default=SLOW_STAGE_SECONDS, metavar='SECONDS',
+                        help='记录超过该秒数的阶段，0为关闭 / Log stages slower than this many seconds (0: off)')
+    parser.add_argument('--render-workers', type=int, default=RENDER_WORKERS, metavar='N',
+                        help='上传渲染进程数，0为在处理线程中渲染 / Render processes for uploads (0: render in the handler thread)')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    subparsers.add_parser('serve', help='启动服务器（默认）/ Run the server (default)')
+    
+    rerender = subparsers.add_parser('rerender',
+                                     help='批量重新渲染历史图表 / Re-render stored shot charts')
+    rerender.add_argument('files', nargs='*',
+                          help='要渲染的JSON文件名，留空为全部 / JSON filenames in DATA_DIR, all when omitted')
+    rerender.add_argument('--force', action='store_true',
+                          help='忽略指纹强制渲染 / Re-render even if the chart is up to date')
+    rerender.add_argument('--workers', type=int, default=None,
+                          help='工作进程数，默认为CPU核数 / Worker processes (default: all cores)')
+    rerender.add_argument('--language', choices=sorted(LANGUAGES), default=None,
+                          help='图表语言 / Chart language (default: %s)' % current_language)
+    rerender.add_argument('--no-bean-info', action='store_true',
+                          help='不在图表中显示豆子信息 / Do not print bean info on the charts')
+    
+    importer = subparsers.add_parser('import',
+                                     help='导入DE1历史冲泡数据 / Import existing DE1 shot history')
+    importer.add_argument('path',
+                          help='history目录、压缩包(.zip/.tar.gz)或单个文件 / History directory, archive (.zip/.tar.gz) or single file')
+    importer.add_argument('--machine-id', default='UNKNOWN',
+                          help='这些冲泡所属的机器ID / Machine ID the shots came from')
+    importer.add_argument('--no-render', action='store_true',
+                          help='只导入和索引，不生成图表 / Only import and index, skip chart rendering')
+    importer.add_argument('--workers', type=int, default=None,
+                          help='工作进程数，默认为CPU核数 / Worker processes (default: all cores)')
+    importer.add_argument('--language', choices=sorted(LANGUAGES), default=None,
+                          help='图表语言 / Chart language (default: %s)' % current_language)
+    return parser.parse_args(argv)
+
+def run_import_command(args):
+    """命令行导入入口 / Command line entry point for importing history"""
+    global current_language
+    if args.language:
+        current_language = args.language
+    ensure_directories()
+    print(f"📥 导入 / Importing: {args.path} (machine_id={args.machine_id}, workers={args.workers or os.cpu_count()})")
+    
+    def progress(done, imported, duplicates, failed_count, elapsed):
+        rate = done / elapsed if elapsed > 0 else 0.0
+        sys.stderr.write(f"\r📄 {done} files: {imported} imported, {duplicates} duplicates, "
+                         f"{failed_count} failed, {rate:.1f} shots/s")
+        sys.stderr.flush()
+    
+    try:
+        summary = import_shots(args.path, machine_id=args.machine_id, render=not args.no_render,
+                               workers=args.workers, progress=progress)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    
+    sys.stderr.write("\n")
+    print(f"✅ 导入完成 / Import done: {summary['imported']} imported, {summary['duplicates']} duplicates, "
+          f"{len(summary['failed'])} failed in {summary['elapsed']}s ({summary['shots_per_second']} shots/s)")
+    for name, error in summary['failed']:
+        print(f"❌ {name}: {error}")
+    if summary['render']:
+        render = summary['render']
+        print(f"🖼️  图表 / Charts: {render['rendered']} rendered in {render['elapsed']}s "
+              f"({render['shots_per_second']} shots/s)")
+    return 1 if summary['failed'] else 0
+
+def run_rerender_command(args):
+    """命令行批量渲染入口 / Command line entry point for batch re-rendering"""
+    global current_language, BEAN_INFO_ENABLED
+    if args.language:
+        current_language = args.language
+    if args.no_bean_info:
+        BEAN_INFO_ENABLED = False
+    ensure_directories()
+    
+    filenames = [os.path.basename(f) for f in args.files] or None
+    print(f"🔄 批量重新渲染 / Batch re-render: {len(filenames) if filenames else 'all'} shots, "
+          f"language={current_language}, workers={args.workers or os.cpu_count()}")
+    
+    def progress(done, total, rendered, failed_count, elapsed):
+        rate = rendered / elapsed if elapsed > 0 else 0.0
+        sys.stderr.write(f"\r🖼️  [{done}/{total}] {rendered} rendered, {failed_count} failed, {rate:.2f} shots/s")
+        sys.stderr.flush()
+    
+    try:
+        summary = rerender_shots(filenames, force=args.force, workers=args.workers, progress=progress)
+    except KeyboardInterrupt:
+        print("\n🛑 已中断，已完成的图表已记录，重新运行即可继续 / Interrupted, finished charts are recorded - rerun to resume")
+        return 130
+    
+    sys.stderr.write("\n")
+    print(f"✅ 完成 / Done: {summary['rendered']} rendered, {summary['skipped']} up to date, "
+          f"{len(summary['failed'])} failed in {summary['elapsed']}s "
+          f"({summary['shots_per_second']} shots/s)")
+    for filename in summary['missing']:
+        print(f"⚠️ 文件不存在 / File not found: {filename}")
+    for filename in summary['failed']:
+        print(f"❌ 渲染失败 / Render failed: {filename}")
+    return 1 if summary['failed'] else 0
+
 def main():
     """主函数 / Main function"""
-    port = 8000
+    global PAPER_PROFILE, RENDERER, SLOW_STAGE_SECONDS, RENDER_WORKERS
+    multiprocessing.freeze_support()
+    args = parse_args()
+    PAPER_PROFILE = args.paper
+    RENDERER = args.renderer
+    SLOW_STAGE_SECONDS = args.slow_stage
+    RENDER_WORKERS = max(0, args.render_workers)
+    if os.environ.get(PROFILE_ENV):
+        try:
+            profiler.configure_from(os.environ[PROFILE_ENV])
+        except ValueError as e:
+            print(f"⚠️ 忽略无效的剖析设置 / Ignoring invalid {PROFILE_ENV}: {e}")
+    if args.command == 'rerender':
+        sys.exit(run_rerender_command(args))
+    if args.command == 'import':
+        sys.exit(run_import_command(args))
+    
+    port = args.port
     setup_matplotlib_font()
     ensure_directories()
+    # 在后台为历史文件补建索引和曲线特征 / Index previously stored files and their curve features in the background
+    def build_indexes():
+        get_shot_index().sync()
+        get_feature_index().backfill()
+    threading.Thread(target=build_indexes, daemon=True).start()
+    get_print_scheduler().start_prober()
     print_server_info(port)
     
     def signal_handler(sig, frame):
@@ -2753,8 +7043,11 @@ def main():
     
     try:
         # 创建支持端口复用的服务器 / Create server with port reuse support
-        class ReuseTCPServer(socketserver.TCPServer):
+        # 每个连接一个线程：长时间的导出下载不会阻塞DE1上传和网页轮询
+        # One thread per connection, so a long export download does not hold up DE1 uploads and dashboard polls
+        class ReuseTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
             allow_reuse_address = True  # 关键设置 / Key setting
+            daemon_threads = True
             
         with ReuseTCPServer(("", port), PrintTheShotHandler) as httpd:
             print(f"✅ 服务器启动成功，监听端口 {port} / Server started successfully, listening on port {port}")
@@ -2766,6 +7059,10 @@ def main():
     except Exception as e:
         print(f"❌ 服务器错误 / Server error: {e}")
     finally:
+        # 写入尚未落盘的渲染清单和冲泡基线 / Write out a pending render manifest and shot baselines
+        for state in (render_manifest, profile_baselines):
+            if state is not None:
+                state.save()
         print("👋 服务器已停止 / Server stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+ESC/POS 直连打印的字节数和首行时间基准测试 / Byte-count and time-to-first-line benchmark for raw ESC/POS printing
+
+用伪终端模拟串口/蓝牙打印机：服务器的 send_escpos 像对待真实设备一样写入，模拟打印机按波特率读取、
+解析 ESC/POS 命令，记录第一条带可以开始打印的时间，并把收到的点阵还原后与原始位图逐点比较。
+A pseudo-terminal stands in for a serial/Bluetooth printer: the server's send_escpos writes to it like a
+real device, while the stand-in reads at the configured baud rate, parses the ESC/POS commands, records
+when the first band could start printing and checks the reconstructed dots against the original raster.
+
+用法 / Usage:
+    python scripts/bench_escpos.py --baud 115200 --paper 80mm --output escpos.json
+    python scripts/bench_escpos.py --image shots_images/shot_..._print_80mm.png --bands 8 24 64
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import print_the_shot_server as server  # noqa: E402
+from synthetic_shots import de1_shot  # noqa: E402
+from PIL import Image  # noqa: E402
+
+class StandInPrinter:
+    """
+    按波特率读取并解析 ESC/POS 的模拟打印机 / Stand-in printer that reads at a baud rate and parses ESC/POS
+    """
+    def __init__(self, fd, baud, width):
+        self.fd = fd
+        self.byte_time = 10.0 / baud  # 8N1：每字节10位 / 8N1: 10 bits per byte
+        self.stride = (width + 7) // 8
+        self.buffer = bytearray()
+        self.rows = []
+        self.received = 0
+        self.first_line_at = None
+        self.finished_at = None
+        self.cut = False
+        self.thread = threading.Thread(target=self._read, daemon=True)
+
+    def _read(self):
+        while not self.cut:
+            try:
+                data = os.read(self.fd, 256)
+            except OSError:
+                break
+            if not data:
+                break
+            # 模拟链路速率：读得越慢，发送端在内核缓冲区满后阻塞得越久
+            # Simulate the link rate: the slower we read, the longer the sender blocks once the kernel buffer fills
+            time.sleep(len(data) * self.byte_time)
+            self.received += len(data)
+            self.buffer += data
+            self._parse()
+        self.finished_at = time.perf_counter()
+
+    def _parse(self):
+        buf = self.buffer
+        while buf:
+            if buf[:2] == b'\x1b@':
+                del buf[:2]
+            elif buf[:2] == b'\x1dP' and len(buf) >= 4:
+                del buf[:4]
+            elif buf[:4] == b'\x1dv0\x00' and len(buf) >= 8:
+                xbytes = buf[4] + buf[5] * 256
+                lines = buf[6] + buf[7] * 256
+                if len(buf) < 8 + xbytes * lines:
+                    return
+                for line in range(lines):
+                    row = bytes(buf[8 + line * xbytes:8 + (line + 1) * xbytes])
+                    self.rows.append(row[:self.stride].ljust(self.stride, b'\x00'))
+                if self.first_line_at is None:
+                    self.first_line_at = time.perf_counter()
+                del buf[:8 + xbytes * lines]
+            elif buf[:2] == b'\x1bJ' and len(buf) >= 3:
+                self.rows.extend([b'\x00' * self.stride] * buf[2])
+                del buf[:3]
+            elif buf[:3] == b'\x1dVB' and len(buf) >= 4:
+                del buf[:4]
+                self.cut = True
+            elif buf[:2] == b'\x1bd' and len(buf) >= 3:
+                del buf[:3]
+                self.cut = True
+            elif len(buf) < 8:
+                return  # 命令尚未收全 / Command not complete yet
+            else:
+                raise ValueError(f"Unexpected ESC/POS bytes: {bytes(buf[:8])!r}")
+
+    def image(self, width):
+        data = b''.join(self.rows).translate(server.ESCPOS_INVERT)
+        return Image.frombytes('1', (self.stride * 8, len(self.rows)), data).crop((0, 0, width, len(self.rows)))
+
+def make_raster(args, workdir):
+    """使用指定位图，或由合成冲泡渲染一张 / Use the given raster, or render one from a synthetic shot"""
+    if args.image:
+        return args.image
+    shot_path = os.path.join(workdir, 'shot.json')
+    rng = random.Random(args.seed)
+    with open(shot_path, 'w') as f:
+        json.dump(de1_shot(rng, rng.uniform(25, 40)), f)
+    raster_path = os.path.join(workdir, 'shot_print.png')
+    server.setup_matplotlib_font()
+    if not server.create_coffee_plot(shot_path, None, 'BENCH', raster_file=raster_path, paper=args.paper):
+        sys.exit("Rendering the synthetic shot failed")
+    return raster_path
+
+def run_case(raster_path, args, compression, band_lines):
+    master, slave = os.openpty()
+    try:
+        original = Image.open(raster_path).convert('1')
+        printer = StandInPrinter(master, args.baud, original.width)
+        printer.thread.start()
+        started = time.perf_counter()
+        success, _ = server.send_escpos(raster_path, {'device': os.ttyname(slave), 'baud': args.baud,
+                                                      'compression': compression, 'band_lines': band_lines},
+                                        args.paper)
+        sent = time.perf_counter()
+        printer.thread.join(args.timeout)
+        if not success or printer.finished_at is None:
+            raise RuntimeError(f"Stand-in printer did not receive the whole job ({compression}, {band_lines})")
+        received = printer.image(original.width)
+        return {
+            'compression': compression,
+            'band_lines': band_lines,
+            'bytes': printer.received,
+            'raw_bitmap_bytes': len(original.tobytes()),
+            'ratio': round(printer.received / len(original.tobytes()), 4),
+            'time_to_first_line': round(printer.first_line_at - started, 4),
+            'send_seconds': round(sent - started, 4),
+            'total_seconds': round(printer.finished_at - started, 4),
+            'identical': received.size == original.size and received.tobytes() == original.tobytes()
+        }
+    finally:
+        os.close(slave)
+        os.close(master)
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix='bench_escpos_') as workdir:
+        raster_path = make_raster(args, workdir)
+        with Image.open(raster_path) as img:
+            size = img.size
+        print(f"⏱️ raster {size[0]}x{size[1]} at {args.baud} baud")
+        cases = [run_case(raster_path, args, compression, band_lines)
+                 for compression in args.compression for band_lines in args.bands]
+
+    print(f"{'mode':<8} {'band':>5} {'bytes':>8} {'ratio':>6} {'first':>7} {'total':>7} {'ok':>3}")
+    for case in cases:
+        print(f"{case['compression']:<8} {case['band_lines']:>5} {case['bytes']:>8} {case['ratio']:>6.2f} "
+              f"{case['time_to_first_line']:>7.3f} {case['total_seconds']:>7.3f} {'yes' if case['identical'] else 'NO':>3}")
+    results = {
+        'benchmark': 'escpos_raster',
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'config': {'baud': args.baud, 'paper': args.paper, 'raster': list(size), 'image': args.image or 'synthetic'},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'machine': platform.machine()},
+        'cases': cases
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 {args.output}")
+    return 0 if all(case['identical'] for case in cases) else 1
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='ESC/POS raster transmission benchmark for PrintTheShot')
+    parser.add_argument('--image', help='1位打印位图，默认渲染合成冲泡 / 1-bit print raster (renders a synthetic shot by default)')
+    parser.add_argument('--paper', choices=sorted(server.PAPER_PROFILES), default=server.PAPER_PROFILE)
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--compression', nargs='+', choices=('none', 'compact'), default=['none', 'compact'])
+    parser.add_argument('--bands', nargs='+', type=int, default=[server.ESCPOS_BAND_LINES],
+                        help='每条带的点行数 / Dot rows per band')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--output', help='JSON结果文件 / Write results as JSON to this file')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+模拟多台 DE1 的负载测试，用于估算一台服务器能带几台机器 / Simulated DE1 fleet load test for sizing a multi-machine café
+
+N 台模拟 DE1 按 plugin.tcl 的方式上传：JSON POST，带 machine_id、timestamp 和 plugin_version 查询参数，
+每次请求10秒超时，最多尝试3次，失败后等待2秒。同时 M 个模拟网页标签页按管理界面的间隔轮询
+/api/status、/api/shots、/api/queue、/api/print/jobs 和 /api/events。
+N simulated DE1s upload the way plugin.tcl does: a JSON POST with machine_id, timestamp and
+plugin_version query parameters, a 10 s timeout per request, up to 3 attempts and a 2 s pause after a
+failure. Meanwhile M simulated dashboard tabs poll /api/status, /api/shots, /api/queue, /api/print/jobs
+and /api/events at the management page's intervals.
+
+按 --machines 中的每个规模依次运行 --duration 秒，报告提交和确认的冲泡数/分钟、确认延迟的
+p50/p95/p99、重试和超时，以及通过 /metrics 统计的渲染是否跟得上。确认的 p99 低于 --ack-limit、
+没有超时或失败、且渲染在 --drain 秒内追上时，该规模视为可持续。
+Each fleet size in --machines runs for --duration seconds. The report gives offered and acknowledged
+shots per minute, p50/p95/p99 acknowledgement latency, retries and timeouts, and whether rendering kept
+up (counted through /metrics). A size is sustainable when the p99 acknowledgement stays under
+--ack-limit, nothing timed out or failed, and rendering catches up within --drain seconds.
+
+默认在临时目录中用假打印机启动服务器（同 bench_upload.py）；--url 指向已运行的服务器。
+By default the server is started in a temporary directory with fake printers (as in bench_upload.py);
+--url targets a running server instead.
+
+用法 / Usage:
+    python scripts/bench_fleet.py --machines 1 2 4 8 --interval 60 --dashboards 2 --output fleet.json
+    python scripts/bench_fleet.py --url http://raspberrypi.local:8000 --machines 4 --shots ~/shots_data
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_upload import SERVER, free_port, percentile, start_server  # noqa: E402
+from synthetic_shots import de1_shot  # noqa: E402
+
+PLUGIN_TIMEOUT = 10.0  # plugin.tcl: http::geturl -timeout 10000
+PLUGIN_ATTEMPTS = 3
+PLUGIN_RETRY_PAUSE = 2.0  # plugin.tcl: after 2000
+PLUGIN_VERSION = '1.2'
+# 管理界面的轮询间隔（秒）/ The management page's polling intervals in seconds
+DASHBOARD_POLLS = {'/api/status': 5, '/api/shots': 10, '/api/queue': 8, '/api/print/jobs': 8, '/api/events': 3}
+RENDER_COUNTERS = re.compile(r'^printtheshot_render_(?:seconds_count|failures_total)(?:\{[^}]*\})? (\S+)$', re.M)
+
+def load_payloads(args, rng):
+    """保存的冲泡，或时长25到45秒的合成冲泡 / Stored shots, or synthetic shots of 25 to 45 s"""
+    if args.shots:
+        paths = sorted(os.path.join(args.shots, name) for name in os.listdir(args.shots)
+                       if name.endswith('.json') and name.startswith('shot_'))
+        if not paths:
+            sys.exit(f"No shot_*.json files in {args.shots}")
+        payloads = []
+        for path in paths[:200]:
+            with open(path, 'rb') as f:
+                payloads.append(f.read())
+        return payloads
+    return [json.dumps(de1_shot(rng, rng.uniform(25, 45), args.language, index=i), ensure_ascii=False).encode('utf-8')
+            for i in range(50)]
+
+def plugin_upload(base_url, machine_id, body):
+    """像 plugin.tcl 一样上传一次冲泡 / Upload one shot the way plugin.tcl does"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    url = f"{base_url}/upload?machine_id={machine_id}&timestamp={timestamp}&plugin_version={PLUGIN_VERSION}"
+    record = {'machine': machine_id, 'bytes': len(body), 'attempts': 0, 'timeouts': 0, 'ok': False, 'errors': []}
+    started = time.perf_counter()
+    for attempt in range(PLUGIN_ATTEMPTS):
+        record['attempts'] += 1
+        sent = time.perf_counter()
+        try:
+            request = urllib.request.Request(url, body, {'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=PLUGIN_TIMEOUT) as response:
+                response.read()
+            record.update(ok=True, ack=time.perf_counter() - sent, total=time.perf_counter() - started)
+            return record
+        except urllib.error.HTTPError as e:
+            record['errors'].append(f"HTTP {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            reason = getattr(e, 'reason', e)
+            if isinstance(reason, TimeoutError) or 'timed out' in str(reason):
+                record['timeouts'] += 1
+            record['errors'].append(str(reason))
+        if attempt < PLUGIN_ATTEMPTS - 1:
+            time.sleep(PLUGIN_RETRY_PAUSE)
+    record['total'] = time.perf_counter() - started
+    return record
+
+def machine(index, base_url, payloads, args, started, stop_at, records):
+    """一台DE1：错开起点，约每 --interval 秒一杯 / One DE1: staggered start, a shot about every --interval seconds"""
+    rng = random.Random(args.seed * 1000 + index)
+    machine_id = f"DE1N{index + 1:02d}"
+    next_shot = started + rng.uniform(0, args.interval)
+    while next_shot < stop_at:
+        time.sleep(max(0.0, next_shot - time.time()))
+        records.append(plugin_upload(base_url, machine_id, rng.choice(payloads)))
+        next_shot += args.interval * rng.uniform(0.8, 1.2)
+
+def dashboard(base_url, stop, latencies):
+    """一个网页标签页：按管理界面的间隔轮询 / One dashboard tab polling at the management page's intervals"""
+    due = {path: time.time() + random.uniform(0, interval) for path, interval in DASHBOARD_POLLS.items()}
+    last_seq = 0
+    while not stop.is_set():
+        path = min(due, key=due.get)
+        if stop.wait(max(0.0, due[path] - time.time())):
+            break
+        url = base_url + (f"{path}?since={last_seq}" if path == '/api/events' else path)
+        sent = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=PLUGIN_TIMEOUT) as response:
+                data = response.read()
+            latencies.setdefault(path, []).append(time.perf_counter() - sent)
+            if path == '/api/events':
+                last_seq = json.loads(data).get('last_seq', last_seq)
+        except (urllib.error.URLError, OSError, ValueError):
+            latencies.setdefault(path, []).append(None)
+        due[path] += DASHBOARD_POLLS[path]
+
+def rendered_count(base_url):
+    """服务器已完成的渲染数（成功+失败），没有 /metrics 时为 None / Renders the server has finished, None without /metrics"""
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=PLUGIN_TIMEOUT) as response:
+            text = response.read().decode('utf-8')
+    except (urllib.error.URLError, OSError):
+        return None
+    return sum(float(value) for value in RENDER_COUNTERS.findall(text))
+
+def quantiles(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return {'count': 0}
+    return {'count': len(values), 'p50': round(percentile(values, 0.5), 3), 'p95': round(percentile(values, 0.95), 3),
+            'p99': round(percentile(values, 0.99), 3), 'max': round(max(values), 3)}
+
+def run_level(base_url, machines, payloads, args):
+    """以一个机队规模运行 --duration 秒 / Run one fleet size for --duration seconds"""
+    records, latencies, stop = [], {}, threading.Event()
+    rendered_before = rendered_count(base_url)
+    started = time.time()
+    stop_at = started + args.duration
+    tabs = [threading.Thread(target=dashboard, args=(base_url, stop, latencies), daemon=True)
+            for _ in range(args.dashboards)]
+    fleet = [threading.Thread(target=machine, args=(i, base_url, payloads, args, started, stop_at, records), daemon=True)
+             for i in range(machines)]
+    for thread in tabs + fleet:
+        thread.start()
+    for thread in fleet:
+        thread.join()
+    elapsed = time.time() - started
+    stop.set()
+
+    acked = [record for record in records if record['ok']]
+    # 等待已确认的冲泡全部渲染完 / Wait until every acknowledged shot has been rendered
+    backlog = None
+    if rendered_before is not None:
+        deadline = time.time() + args.drain
+        while True:
+            backlog = len(acked) - (rendered_count(base_url) - rendered_before)
+            if backlog <= 0 or time.time() >= deadline:
+                break
+            time.sleep(1)
+        backlog = max(0, int(backlog))
+    drained = time.time() - started
+    ack = quantiles([record['ack'] for record in acked])
+    failed = len(records) - len(acked)
+    timeouts = sum(record['timeouts'] for record in records)
+    dashboard_all = [value for values in latencies.values() for value in values]
+    level = {
+        'machines': machines,
+        'dashboards': args.dashboards,
+        'offered_per_minute': round(machines * 60 / args.interval, 2),
+        'uploads': len(records),
+        'acked_per_minute': round(len(acked) / elapsed * 60, 2),
+        'rendered_per_minute': round((len(acked) - (backlog or 0)) / drained * 60, 2) if backlog is not None else None,
+        'backlog': backlog,
+        'failed': failed,
+        'retries': sum(record['attempts'] - 1 for record in records),
+        'timeouts': timeouts,
+        'payload_bytes': quantiles([record['bytes'] for record in records]),
+        'ack': ack,
+        'dashboard': {path: quantiles(values) for path, values in sorted(latencies.items())},
+        'dashboard_errors': sum(1 for value in dashboard_all if value is None)
+    }
+    level['sustainable'] = (failed == 0 and timeouts == 0 and bool(acked) and ack['p99'] < args.ack_limit
+                            and not backlog)
+    return level
+
+def run(args):
+    rng = random.Random(args.seed)
+    payloads = load_payloads(args, rng)
+    workdir = process = None
+    base_url = args.url.rstrip('/') if args.url else None
+    if not base_url:
+        workdir = tempfile.mkdtemp(prefix='bench_fleet_')
+        port = free_port()
+        process = start_server(workdir, port, args)
+        base_url = f"http://127.0.0.1:{port}"
+    print(f"⏱️ {base_url}: fleets {args.machines}, a shot every ~{args.interval:g}s per machine, "
+          f"{args.dashboards} dashboard tab(s), {args.duration:g}s per fleet")
+    levels = []
+    try:
+        print(f"{'DE1s':>4} {'offer/m':>8} {'ack/m':>7} {'rend/m':>7} {'p50':>6} {'p95':>6} {'p99':>6} {'max':>6} "
+              f"{'retry':>5} {'t/o':>4} {'fail':>4} {'ok':>4}")
+        for machines in args.machines:
+            level = run_level(base_url, machines, payloads, args)
+            levels.append(level)
+            ack = level['ack']
+            print(f"{machines:>4} {level['offered_per_minute']:>8.1f} {level['acked_per_minute']:>7.1f} "
+                  f"{level['rendered_per_minute'] if level['rendered_per_minute'] is not None else '-':>7} "
+                  f"{ack.get('p50', 0):>6.2f} {ack.get('p95', 0):>6.2f} {ack.get('p99', 0):>6.2f} {ack.get('max', 0):>6.2f} "
+                  f"{level['retries']:>5} {level['timeouts']:>4} {level['failed']:>4} "
+                  f"{'yes' if level['sustainable'] else 'NO':>4}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait(10)
+        if workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    sustainable = [level for level in levels if level['sustainable']]
+    best = max(sustainable, key=lambda level: level['acked_per_minute']) if sustainable else None
+    if best:
+        print(f"📈 sustainable: {best['machines']} DE1(s), {best['acked_per_minute']:.1f} shots/min, "
+              f"ack p99 {best['ack']['p99']:.2f}s (limit {args.ack_limit:g}s)")
+    else:
+        print("❌ no fleet size was sustainable")
+    results = {
+        'benchmark': 'de1_fleet',
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'config': {'url': args.url or 'local', 'interval': args.interval, 'duration': args.duration,
+                   'dashboards': args.dashboards, 'ack_limit': args.ack_limit, 'drain': args.drain,
+                   'source': args.shots or 'synthetic', 'paper': args.paper, 'printers': args.printers,
+                   'print_time': args.print_time, 'seed': args.seed},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'levels': levels,
+        'sustainable': {'machines': best['machines'], 'shots_per_minute': best['acked_per_minute']} if best else None
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 {args.output}")
+    return 0 if best else 1
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated DE1 fleet load test for PrintTheShot')
+    parser.add_argument('--url', help='已运行的服务器，默认在本地启动 / A running server (default: start one locally)')
+    parser.add_argument('--machines', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='依次测试的DE1数量 / Fleet sizes to run in turn')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='每台DE1两杯之间的平均秒数 / Mean seconds between shots on one DE1')
+    parser.add_argument('--duration', type=float, default=120, help='每个规模的秒数 / Seconds per fleet size')
+    parser.add_argument('--dashboards', type=int, default=1, help='轮询的网页标签页数 / Dashboard tabs polling')
+    parser.add_argument('--ack-limit', type=float, default=PLUGIN_TIMEOUT,
+                        help='确认延迟p99上限（秒），默认为插件超时 / p99 acknowledgement limit, the plugin timeout by default')
+    parser.add_argument('--drain', type=float, default=60,
+                        help='每个规模结束后等待渲染追上的秒数 / Seconds to let rendering catch up after each fleet size')
+    parser.add_argument('--shots', help='目录中的 shot_*.json 用于回放 / Directory of shot_*.json to replay (synthetic if omitted)')
+    parser.add_argument('--language', choices=('en', 'zh'), default='en', help='合成冲泡的文字语言 / Text language of synthetic shots')
+    parser.add_argument('--server', default=SERVER, help='本地启动的 print_the_shot_server.py / Server script to start locally')
+    parser.add_argument('--printers', type=int, default=1, help='假打印机数量 / Number of fake printers')
+    parser.add_argument('--print-time', type=float, default=0.0,
+                        help='假打印机每张耗时（秒）/ Seconds the fake printer keeps each job')
+    parser.add_argument('--paper', default='80mm')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON结果文件 / Write results as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help='保留临时工作目录 / Keep the temporary work directory')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+热点函数的微基准测试，与保存的基线对比 / Micro-benchmarks of the hot functions, checked against a stored baseline
+
+每个用例在 synthetic_shots.VARIANTS 的每种冲泡上运行（时长、中文/拉丁文字、豆子信息、方案说明长度）：
+Each case runs on every shot variant in synthetic_shots.VARIANTS (duration, CJK/Latin text, bean info,
+profile note length):
+
+    render.<引擎>  create_coffee_plot：图表PNG + 打印位图 / chart PNG + print raster
+    print_image    generate_print_image：没有冲泡数据时由图表PNG生成打印位图
+                   print raster from the chart PNG, the path taken without shot data
+    multipart      parse_multipart_form_data
+    json_ingest    与 handle_json_upload 相同的单次解析（parse_shot_upload）和原样写入
+                   the single parse (parse_shot_upload) and verbatim write of handle_json_upload
+    wrap           TextLayout.wrap（清空记忆后）/ TextLayout.wrap with the memo cleared
+
+每个用例预热一次后计时 --repeat 次；峰值内存由 tracemalloc 单独运行一次测得（只统计Python分配，
+包括 NumPy，不含 matplotlib/Pillow 的C缓冲区）。
+Each case is timed --repeat times after one warm-up run; peak memory comes from one separate run under
+tracemalloc (Python allocations including NumPy, not matplotlib/Pillow C buffers).
+
+基线按CPU架构保存在 scripts/baselines/ 中。最快一次比基线慢超过 --max-regression（且至少1毫秒），
+或峰值内存超过 --max-memory-regression（且至少64 KiB）时返回非零，可在部署到树莓派前运行。
+最快一次比中位数更不受其他进程干扰。
+Baselines are kept per CPU architecture in scripts/baselines/. Exits non-zero when the fastest run is more
+than --max-regression slower than the baseline (and by at least 1 ms), or peak memory grows by more than
+--max-memory-regression (and by at least 64 KiB), so it can gate a deploy to the Pis. The fastest run is
+less disturbed by other processes than the median.
+
+用法 / Usage:
+    python scripts/bench_micro.py --update-baseline
+    python scripts/bench_micro.py --cases render.pillow wrap --variants 30s-en 180s-en
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import print_the_shot_server as server  # noqa: E402
+from bench_upload import multipart_body, percentile  # noqa: E402
+from synthetic_shots import VARIANTS, variant_shot  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+CASES = tuple(f"render.{engine}" for engine in server.RENDERERS) + ('print_image', 'multipart', 'json_ingest', 'wrap')
+WRAP_WIDTH = 300  # 约为80mm小票第二列的像素宽度 / About the second column's width in pixels on an 80mm receipt
+
+def default_baseline():
+    return os.path.join(BASELINE_DIR, f"micro_{platform.machine() or 'unknown'}.json")
+
+def prepare(case, shot, body, workdir, args):
+    """返回该用例一次调用的函数 / Return a callable that runs the case once"""
+    shot_path = os.path.join(workdir, 'shot.json')
+    with open(shot_path, 'wb') as f:
+        f.write(body)
+    if case.startswith('render.'):
+        engine = case.split('.', 1)[1]
+        return lambda: server.create_coffee_plot(shot_path, os.path.join(workdir, 'chart.png'), args.machine,
+                                                 raster_file=os.path.join(workdir, 'chart_print.png'),
+                                                 paper=args.paper, renderer=engine)
+    if case == 'print_image':
+        png_path = os.path.join(workdir, 'fallback.png')
+        server.create_coffee_plot(shot_path, png_path, args.machine, paper=args.paper)
+        return lambda: server.generate_print_image(png_path, args.paper)
+    if case == 'multipart':
+        data, content_type = multipart_body(body)
+        return lambda: server.parse_multipart_form_data(data, content_type)
+    if case == 'json_ingest':
+        stored = os.path.join(workdir, 'ingest.json')
+        def ingest():
+            server.parse_shot_upload(body)
+            with open(stored, 'wb') as f:
+                f.write(body)
+        return ingest
+    if case == 'wrap':
+        layout = server.get_text_layout(server.receipt_font_paths()[0], 24)
+        texts = [shot['profile']['title'], shot['profile']['notes'],
+                 shot['meta'].get('bean', {}).get('notes', ''), shot['meta'].get('shot', {}).get('notes', '')]
+        def wrap():
+            layout.wraps.clear()
+            for text in texts:
+                layout.wrap(text, WRAP_WIDTH, 2, server.current_language)
+        return wrap
+    raise ValueError(f"Unknown case: {case}")
+
+def summarize(values):
+    """微秒精度的统计 / Summary at microsecond resolution"""
+    return {'count': len(values), 'min': round(min(values), 6), 'mean': round(sum(values) / len(values), 6),
+            'p50': round(percentile(values, 0.5), 6), 'p95': round(percentile(values, 0.95), 6),
+            'max': round(max(values), 6)}
+
+def measure(call, repeat):
+    """预热一次后计时，再在 tracemalloc 下运行一次 / Time after one warm-up call, then run once under tracemalloc"""
+    if call() is False:
+        raise RuntimeError("case returned failure")
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(summarize(times), peak_kib=round(peak / 1024, 1))
+
+def compare(results, baseline, args):
+    """与基线对比，返回回归列表 / Compare with the baseline; returns the regressions"""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        result['baseline_min'] = reference['min']
+        result['change'] = round(result['min'] / reference['min'] - 1, 3) if reference['min'] else None
+        if result['min'] > reference['min'] * (1 + args.max_regression) and result['min'] - reference['min'] > 0.001:
+            regressions.append(f"{key}: min {reference['min'] * 1000:.1f} -> {result['min'] * 1000:.1f} ms")
+        if (result['peak_kib'] > reference['peak_kib'] * (1 + args.max_memory_regression)
+                and result['peak_kib'] - reference['peak_kib'] > 64):
+            regressions.append(f"{key}: peak {reference['peak_kib']:.0f} -> {result['peak_kib']:.0f} KiB")
+    return regressions
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench_micro_') as workdir, open(os.devnull, 'w') as devnull:
+        # 冲泡数据和打印位图都写在临时目录中 / Shot data and print rasters stay in the work directory
+        server.DATA_DIR = os.path.join(workdir, 'shots_data')
+        server.IMAGE_DIR = os.path.join(workdir, 'shots_images')
+        os.makedirs(server.DATA_DIR)
+        server.setup_matplotlib_font()
+        print(f"{'case':<18} {'variant':<20} {'min ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'peak KiB':>9}")
+        for variant in args.variants:
+            # 每个变体单独播种，结果不受所选变体和顺序影响
+            # Seeded per variant, so a result doesn't depend on which variants run or in what order
+            shot = variant_shot(variant, random.Random(f"{args.seed}:{variant}"))
+            body = json.dumps(shot, ensure_ascii=False).encode('utf-8')
+            server.current_language = VARIANTS[variant][1]
+            for case in args.cases:
+                # 渲染日志和缺字警告会淹没结果 / Render logging and missing-glyph warnings would drown the results
+                with contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+                    warnings.simplefilter('ignore', UserWarning)
+                    result = measure(prepare(case, shot, body, workdir, args), args.repeat)
+                result['bytes'] = len(body)
+                results[f"{case}/{variant}"] = result
+                print(f"{case:<18} {variant:<20} {result['min'] * 1000:>9.2f} {result['p50'] * 1000:>9.2f} "
+                      f"{result['p95'] * 1000:>9.2f} {result['peak_kib']:>9.0f}")
+
+    baseline_path = args.baseline or default_baseline()
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args) if baseline and not args.update_baseline else []
+    report = {
+        'benchmark': 'micro',
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'config': {'repeat': args.repeat, 'paper': args.paper, 'seed': args.seed, 'font': server.find_chart_font()},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'results': results,
+        'regressions': regressions
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 {args.output}")
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        # 只更新本次运行的用例 / Only the cases in this run are replaced
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, results=dict(baseline, **results), regressions=[]), f, indent=2)
+        print(f"📌 baseline updated: {baseline_path}")
+        return 0
+    if not baseline:
+        print(f"ℹ️ no baseline at {baseline_path}; run with --update-baseline to record one")
+        return 0
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if not regressions:
+        print(f"✅ no regressions against {baseline_path}")
+    return 1 if regressions else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the PrintTheShot hot paths')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的计时次数 / Timed runs per case')
+    parser.add_argument('--paper', choices=sorted(server.PAPER_PROFILES), default=server.PAPER_PROFILE)
+    parser.add_argument('--machine', default='BENCH', help='机器ID标签 / Machine ID label')
+    parser.add_argument('--baseline', help='基线文件 / Baseline file (default: scripts/baselines/micro_<arch>.json)')
+    parser.add_argument('--update-baseline', action='store_true', help='把本次结果写入基线 / Record this run as the baseline')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='允许的变慢比例 / Largest allowed slowdown of the fastest run (default: 0.2)')
+    parser.add_argument('--max-memory-regression', type=float, default=0.2,
+                        help='允许的峰值内存增长比例 / Largest allowed peak memory growth (default: 0.2)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON结果文件 / Write results as JSON to this file')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
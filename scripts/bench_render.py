@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+matplotlib 与 Pillow 小票渲染引擎的并排基准测试和视觉对比 / Side-by-side benchmark and visual diff of the matplotlib and Pillow receipt renderers
+
+两个引擎渲染同一批保存的或合成的冲泡（图表PNG + 打印位图，与上传时相同），统计每张的渲染时间，
+并逐点比较两者的1位打印位图：
+Both engines render the same stored or synthetic shots (chart PNG + print raster, as on upload), the
+render time per shot is summarized, and the 1-bit print rasters are compared dot by dot:
+
+    mismatch   不同的点占整张位图的比例 / share of all dots that differ
+    unmatched  在另一张位图 --tolerance 点范围内找不到墨点的墨点比例，容忍抗锯齿和半点偏移
+               share of inked dots with no ink within --tolerance dots in the other raster,
+               which tolerates anti-aliasing and half-dot offsets
+
+任一冲泡的 unmatched 超过 --max-diff 时返回非零，可作为视觉回归检查。--diff-dir 写出对比图：
+黑色为两者都有，红色只在 matplotlib，蓝色只在 Pillow。
+Exits non-zero when any shot's unmatched share exceeds --max-diff, so it doubles as a visual regression
+check. --diff-dir writes overlays: black in both, red only in matplotlib, blue only in Pillow.
+
+默认使用英文，任何安装都能通过；图表字体缺少某些字形时（如没有中文字体却选择 --language zh），
+两个引擎画出的占位方框不同，对比结果会偏大。
+English is the default so a stock install passes; when the chart font lacks glyphs (e.g. --language zh
+without a CJK font), the engines draw different placeholder boxes and the diff grows accordingly.
+
+用法 / Usage:
+    python scripts/bench_render.py --count 10 --repeat 3 --output render.json
+    python scripts/bench_render.py --shots ~/shots_data --paper 58mm --diff-dir /tmp/render_diff
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import print_the_shot_server as server  # noqa: E402
+from bench_upload import summarize  # noqa: E402
+from synthetic_shots import de1_shot  # noqa: E402
+from PIL import Image, ImageChops, ImageFilter  # noqa: E402
+
+ENGINES = server.RENDERERS
+
+def load_shots(args, workdir):
+    """保存的冲泡路径，或写出合成冲泡 / Stored shot paths, or synthetic shots written to the work directory"""
+    if args.shots:
+        paths = sorted(os.path.join(args.shots, name) for name in os.listdir(args.shots)
+                       if name.endswith('.json') and name.startswith('shot_'))
+        if not paths:
+            sys.exit(f"No shot_*.json files in {args.shots}")
+        return paths[:args.count] if args.count else paths
+    rng = random.Random(args.seed)
+    paths = []
+    for i in range(args.count or 5):
+        path = os.path.join(workdir, f'shot_{i:03d}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(de1_shot(rng, rng.uniform(25, 40), 'zh' if args.language == 'zh' else 'en', index=i), f,
+                      ensure_ascii=False)
+        paths.append(path)
+    return paths
+
+def render(engine, shot_path, workdir, args):
+    """用一个引擎渲染图表和打印位图，返回 (秒, 位图路径) / Render chart and raster with one engine; returns (seconds, raster path)"""
+    base = os.path.join(workdir, f"{os.path.basename(shot_path)[:-len('.json')]}_{engine}")
+    anomaly = ['short'] if args.anomaly else None
+    started = time.perf_counter()
+    if not server.create_coffee_plot(shot_path, base + '.png', args.machine, anomaly,
+                                     raster_file=base + '_print.png', paper=args.paper, renderer=engine):
+        raise RuntimeError(f"{engine} failed to render {shot_path}")
+    return time.perf_counter() - started, base + '_print.png'
+
+def ink(path):
+    """位图中的墨点，墨点为255 / Inked dots of a raster, ink as 255"""
+    with Image.open(path) as img:
+        return img.convert('L').point(lambda v: 255 if v < 128 else 0)
+
+def compare(reference_path, candidate_path, tolerance, diff_path=None):
+    """逐点比较两张打印位图 / Compare two print rasters dot by dot"""
+    a, b = ink(reference_path), ink(candidate_path)
+    if a.size != b.size:
+        return {'size': [list(a.size), list(b.size)], 'mismatch': 1.0, 'unmatched': 1.0}
+    area = a.width * a.height
+    grow = ImageFilter.MaxFilter(2 * tolerance + 1)
+    only_a = ImageChops.subtract(a, b.filter(grow))
+    only_b = ImageChops.subtract(b, a.filter(grow))
+    inked = a.histogram()[255] + b.histogram()[255]
+    if diff_path:
+        both = ImageChops.multiply(a, b)
+        overlay = Image.merge('RGB', [ImageChops.invert(ImageChops.add(both, only_b)),
+                                      ImageChops.invert(ImageChops.lighter(ImageChops.add(both, only_a), only_b)),
+                                      ImageChops.invert(ImageChops.add(both, only_a))])
+        overlay.rotate(-90, expand=True).save(diff_path)
+    return {
+        'size': list(a.size),
+        'mismatch': round(ImageChops.difference(a, b).histogram()[255] / area, 5),
+        'unmatched': round((only_a.histogram()[255] + only_b.histogram()[255]) / max(inked, 1), 5),
+    }
+
+def run(args):
+    server.current_language = args.language
+    server.setup_matplotlib_font()
+    with tempfile.TemporaryDirectory(prefix='bench_render_') as workdir:
+        shots = load_shots(args, workdir)
+        times = {engine: [] for engine in ENGINES}
+        first = {}
+        diffs = []
+        for shot_path in shots:
+            rasters = {}
+            for engine in ENGINES:
+                for _ in range(args.repeat):
+                    seconds, rasters[engine] = render(engine, shot_path, workdir, args)
+                    first.setdefault(engine, seconds)
+                    times[engine].append(seconds)
+            diff_path = None
+            if args.diff_dir:
+                os.makedirs(args.diff_dir, exist_ok=True)
+                diff_path = os.path.join(args.diff_dir, os.path.basename(shot_path)[:-len('.json')] + '_diff.png')
+            diffs.append(dict(compare(rasters['matplotlib'], rasters['pillow'], args.tolerance, diff_path),
+                              shot=os.path.basename(shot_path)))
+
+    engines = {engine: dict(summarize(times[engine]), first=round(first[engine], 4)) for engine in ENGINES}
+    speedup = engines['matplotlib']['p50'] / engines['pillow']['p50']
+    print(f"{'engine':<11} {'first':>7} {'p50':>7} {'p95':>7} {'max':>7}")
+    for engine, summary in engines.items():
+        print(f"{engine:<11} {summary['first']:>7.3f} {summary['p50']:>7.3f} {summary['p95']:>7.3f} {summary['max']:>7.3f}")
+    print(f"⚡ pillow p50 speedup: {speedup:.1f}x")
+    print(f"{'shot':<40} {'mismatch':>9} {'unmatched':>10}")
+    for diff in diffs:
+        print(f"{diff['shot']:<40} {diff['mismatch']:>9.4f} {diff['unmatched']:>10.4f}")
+
+    failed = [diff['shot'] for diff in diffs if diff['unmatched'] > args.max_diff]
+    results = {
+        'benchmark': 'render_engines',
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'config': {'paper': args.paper, 'shots': len(diffs), 'repeat': args.repeat, 'language': server.current_language,
+                   'tolerance': args.tolerance, 'max_diff': args.max_diff, 'font': server.find_chart_font()},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'machine': platform.machine()},
+        'engines': engines,
+        'speedup_p50': round(speedup, 2),
+        'diffs': diffs,
+        'failed': failed
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 {args.output}")
+    if failed:
+        print(f"❌ {len(failed)} shot(s) differ by more than {args.max_diff:.2%}")
+        return 1
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Receipt renderer benchmark and visual diff for PrintTheShot')
+    parser.add_argument('--shots', help='目录中的 shot_*.json，默认合成冲泡 / Directory of shot_*.json (synthetic if omitted)')
+    parser.add_argument('--count', type=int, help='冲泡数量 / Number of shots (default: 5, or all stored shots)')
+    parser.add_argument('--repeat', type=int, default=3, help='每个引擎每张渲染次数 / Renders per shot and engine')
+    parser.add_argument('--paper', choices=sorted(server.PAPER_PROFILES), default=server.PAPER_PROFILE)
+    parser.add_argument('--language', choices=sorted(server.LANGUAGES), default='en',
+                        help='图表语言 / Chart language (default: en)')
+    parser.add_argument('--machine', default='BENCH', help='机器ID标签 / Machine ID label')
+    parser.add_argument('--anomaly', action='store_true', help='同时画异常标记 / Also draw the unusual shot flag')
+    parser.add_argument('--tolerance', type=int, default=2, help='对比容差（点）/ Diff tolerance in dots')
+    parser.add_argument('--max-diff', type=float, default=0.05,
+                        help='允许的 unmatched 比例 / Largest allowed unmatched share (default: 0.05)')
+    parser.add_argument('--diff-dir', help='写出对比图的目录 / Write diff overlays to this directory')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON结果文件 / Write results as JSON to this file')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+上传到出纸的端到端基准测试 / End-to-end upload-to-paper benchmark
+
+在本地端口启动服务器，用假的 lp/lpr/lpstat 替换真实打印机，把保存的或合成的冲泡数据
+以 JSON 和 multipart 两种方式并发上传到 /upload，并统计各阶段的 p50/p95/p99 延迟和吞吐量。
+Starts the server on a local port with fake lp/lpr/lpstat commands on PATH, replays stored or
+synthetic shots into /upload as JSON and multipart at a given concurrency, and reports throughput
+and p50/p95/p99 latency per stage.
+
+阶段 / Stages:
+    ack      上传请求到收到响应 / upload request until the response arrives (client side)
+    render   收到上传到图表和打印位图生成 / upload received until chart and print raster are rendered
+    queue    在打印队列中等待 / waiting in the print queue
+    raster   取出或合成打印位图 / fetching or composing the print raster
+    submit   提交给 lp / handing the job to lp
+    printer  假打印机"打印"所需时间 / time the fake printer takes to "print"
+    total    收到上传到出纸 / upload received until paper out
+
+用法 / Usage:
+    python scripts/bench_upload.py --count 50 --concurrency 4 --printers 2 --output bench.json
+    python scripts/bench_upload.py --shots ~/shots_data --mode multipart
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from synthetic_shots import de1_shot
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'print_the_shot_server.py')
+STAGES = ('ack', 'render', 'queue', 'raster', 'submit', 'printer', 'total')
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 假的 lp/lpr：记录提交的文件并生成任务ID / Fake lp/lpr: records the submitted file and hands out a job ID
+LP_STUB = '''#!{python}
+import json, os, sys, time, uuid
+spool = os.environ['BENCH_SPOOL']
+job_id = 'bench-' + uuid.uuid4().hex[:8]
+with open(os.path.join(spool, 'jobs', job_id), 'w') as f:
+    f.write(str(time.time()))
+with open(os.path.join(spool, 'spool.jsonl'), 'a') as f:
+    f.write(json.dumps({{'time': time.time(), 'argv': sys.argv, 'bytes': os.path.getsize(sys.argv[1])}}) + '\\n')
+if os.path.basename(sys.argv[0]) == 'lp':
+    print(f"request id is {{job_id}} (1 file(s))")
+'''
+
+# 假的 lpstat：任务在 BENCH_PRINT_TIME 秒内保持未完成 / Fake lpstat: jobs stay unfinished for BENCH_PRINT_TIME seconds
+LPSTAT_STUB = '''#!{python}
+import os, sys, time
+jobs_dir = os.path.join(os.environ['BENCH_SPOOL'], 'jobs')
+print_time = float(os.environ.get('BENCH_PRINT_TIME', '0'))
+if '-o' in sys.argv:
+    for job_id in os.listdir(jobs_dir):
+        path = os.path.join(jobs_dir, job_id)
+        with open(path) as f:
+            spooled = float(f.read() or 0)
+        if time.time() - spooled < print_time:
+            print(f"{{job_id}} bench 1024 Mon 19 Oct 2026 10:00:00 AM UTC")
+        else:
+            os.remove(path)
+'''
+
+def load_shots(args):
+    """读取保存的冲泡或生成合成冲泡，返回原始字节列表 / Load stored shots or generate synthetic ones, as raw bytes"""
+    if args.shots:
+        paths = sorted(os.path.join(args.shots, name) for name in os.listdir(args.shots)
+                       if name.endswith('.json') and name.startswith('shot_'))
+        if not paths:
+            sys.exit(f"No shot_*.json files in {args.shots}")
+        shots = []
+        for i in range(args.count or len(paths)):
+            with open(paths[i % len(paths)], 'rb') as f:
+                shots.append(f.read())
+        return shots
+    rng = random.Random(args.seed)
+    return [json.dumps(de1_shot(rng, rng.uniform(25, 40), index=i)).encode('utf-8') for i in range(args.count or 20)]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def write_stubs(bin_dir):
+    for name, template in (('lp', LP_STUB), ('lpr', LP_STUB), ('lpstat', LPSTAT_STUB)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(template.format(python=sys.executable))
+        os.chmod(path, 0o755)
+
+def start_server(workdir, port, args):
+    """在临时目录中启动服务器并等待就绪 / Start the server in the work directory and wait until it answers"""
+    bin_dir = os.path.join(workdir, 'bin')
+    spool = os.path.join(workdir, 'spool')
+    os.makedirs(os.path.join(spool, 'jobs'))
+    os.makedirs(bin_dir)
+    write_stubs(bin_dir)
+    printers = [{'name': f"bench{i + 1}", 'destination': f"BENCH_{i + 1}"} for i in range(args.printers)]
+    with open(os.path.join(workdir, 'printers.json'), 'w') as f:
+        json.dump({'printers': printers}, f)
+
+    env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+               BENCH_SPOOL=spool, BENCH_PRINT_TIME=str(args.print_time), PYTHONUNBUFFERED='1')
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.abspath(args.server), '--port', str(port),
+                                '--paper', args.paper],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Server exited early, see {log.name}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/status", timeout=1).read()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit("Server did not start within 60s")
+
+def multipart_body(body):
+    """把冲泡包装成 multipart 上传，返回 (正文, Content-Type) / Wrap a shot as a multipart upload; returns (body, Content-Type)"""
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"shot.json\"\r\n"
+            f"Content-Type: application/json\r\n\r\n").encode('utf-8') + body + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def upload(port, index, body, mode):
+    """上传一次冲泡，返回 (文件名, 确认延迟) / Upload one shot, returns (filename, ack latency)"""
+    if mode == 'mixed':
+        mode = 'json' if index % 2 == 0 else 'multipart'
+    url = f"http://127.0.0.1:{port}/upload?machine_id=BENCH-{index % 4}&plugin_version=bench"
+    if mode == 'json':
+        headers = {'Content-Type': 'application/json'}
+    else:
+        body, content_type = multipart_body(body)
+        headers = {'Content-Type': content_type}
+    started = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, body, headers), timeout=60) as response:
+        result = json.loads(response.read())
+    return result['filename'], time.perf_counter() - started
+
+def parse_stamp(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f').timestamp() if value else None
+
+def read_jobs(workdir):
+    """读取服务器写入的已完成打印任务 / Read the finished print jobs written by the server"""
+    path = os.path.join(workdir, 'shots_data', 'print_jobs.jsonl')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        jobs = [json.loads(line) for line in f if line.strip()]
+    return {job['shot']: job for job in jobs}
+
+def percentile(values, q):
+    """线性插值分位数 / Linearly interpolated quantile"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def summarize(values):
+    summary = {'count': len(values)}
+    if values:
+        summary['mean'] = round(sum(values) / len(values), 4)
+        for q in QUANTILES:
+            summary[f"p{int(q * 100)}"] = round(percentile(values, q), 4)
+        summary['max'] = round(max(values), 4)
+    return summary
+
+def run(args):
+    shots = load_shots(args)
+    workdir = tempfile.mkdtemp(prefix='bench_upload_')
+    port = args.port or free_port()
+    print(f"⏱️ {len(shots)} shots, mode={args.mode}, concurrency={args.concurrency}, "
+          f"printers={args.printers}, workdir={workdir}")
+    process = start_server(workdir, port, args)
+    try:
+        started = time.time()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            uploads = list(pool.map(lambda item: upload(port, item[0], item[1], args.mode), enumerate(shots)))
+        uploaded = time.time()
+        # 同一文件名被返回两次说明有冲泡被覆盖；按上传计数，不按文件名去重
+        # A filename returned twice means a shot was overwritten; count uploads, never dedupe them by filename
+        filenames = [filename for filename, _ in uploads]
+        duplicates = sorted({filename for filename in filenames if filenames.count(filename) > 1})
+        unique = list(dict.fromkeys(filenames))
+
+        # 等待所有任务出纸 / Wait until every job is out of the printer
+        deadline = time.time() + args.timeout
+        jobs = {}
+        while time.time() < deadline:
+            jobs = read_jobs(workdir)
+            if all(filename in jobs for filename in unique):
+                break
+            time.sleep(0.5)
+
+        stages = {stage: [] for stage in STAGES}
+        stages['ack'] = [ack for _, ack in uploads]
+        finished = []
+        for filename in unique:
+            job = jobs.get(filename)
+            if not job or job['status'] != 'done':
+                continue
+            stamps = {key: parse_stamp(job.get(key)) for key in
+                      ('received', 'rendered', 'queued', 'started', 'rasterized', 'submitted', 'completed')}
+            finished.append(stamps['completed'])
+            for stage, begin, end in (('render', 'received', 'rendered'), ('queue', 'queued', 'started'),
+                                      ('raster', 'started', 'rasterized'), ('submit', 'rasterized', 'submitted'),
+                                      ('printer', 'submitted', 'completed'), ('total', 'received', 'completed')):
+                if stamps[begin] is not None and stamps[end] is not None:
+                    stages[stage].append(max(0.0, stamps[end] - stamps[begin]))
+
+        spool_path = os.path.join(workdir, 'spool', 'spool.jsonl')
+        with open(spool_path) if os.path.exists(spool_path) else open(os.devnull) as f:
+            spooled = sum(1 for _ in f)
+        elapsed = (max(finished) - started) if finished else None
+        results = {
+            'benchmark': 'upload_to_paper',
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'config': {
+                'shots': len(shots), 'source': args.shots or 'synthetic', 'mode': args.mode,
+                'concurrency': args.concurrency, 'printers': args.printers, 'paper': args.paper,
+                'print_time': args.print_time, 'seed': args.seed
+            },
+            'environment': {
+                'python': platform.python_version(), 'platform': platform.platform(),
+                'machine': platform.machine(), 'cpus': os.cpu_count()
+            },
+            'throughput': {
+                'uploads_per_second': round(len(shots) / max(uploaded - started, 1e-9), 3),
+                'shots_per_minute': round(len(finished) / elapsed * 60, 3) if elapsed else None,
+                'elapsed_seconds': round(elapsed, 3) if elapsed else None
+            },
+            'printed': len(finished),
+            'failed': sum(1 for filename in unique if jobs.get(filename, {}).get('status') == 'failed'),
+            'duplicates': duplicates,
+            'spooled': spooled,
+            'stages': {stage: summarize(values) for stage, values in stages.items()}
+        }
+        # 上传了但没有打印也没有失败的冲泡，包括被同名文件覆盖的 / Shots neither printed nor failed, overwritten ones included
+        results['missing'] = len(shots) - results['printed'] - results['failed']
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'stage':<8} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for stage, summary in results['stages'].items():
+        if summary['count']:
+            print(f"{stage:<8} {summary['count']:>6} {summary['p50']:>8.3f} {summary['p95']:>8.3f} "
+                  f"{summary['p99']:>8.3f} {summary['max']:>8.3f}")
+    print(f"📈 {results['throughput']['uploads_per_second']} uploads/s, "
+          f"{results['throughput']['shots_per_minute']} shots/min printed, "
+          f"{results['failed']} failed, {results['missing']} missing")
+    if results['duplicates']:
+        print(f"❌ 文件名被返回多次，冲泡被覆盖 / Filenames returned more than once, shots were overwritten: "
+              f"{', '.join(results['duplicates'])}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 {args.output}")
+    return 0 if results['printed'] == len(shots) and not results['duplicates'] else 1
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Upload-to-paper benchmark for PrintTheShot')
+    parser.add_argument('--server', default=SERVER, help='print_the_shot_server.py to benchmark')
+    parser.add_argument('--shots', help='目录中的 shot_*.json 用于回放 / Directory of shot_*.json to replay (synthetic if omitted)')
+    parser.add_argument('--count', type=int, help='上传次数 / Number of uploads (default: 20, or all stored shots)')
+    parser.add_argument('--mode', choices=('json', 'multipart', 'mixed'), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--printers', type=int, default=1, help='假打印机数量 / Number of fake printers')
+    parser.add_argument('--print-time', type=float, default=0.0,
+                        help='假打印机每张耗时（秒）/ Seconds the fake printer keeps each job')
+    parser.add_argument('--paper', default='80mm')
+    parser.add_argument('--port', type=int, help='默认随机空闲端口 / A free port by default')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=600, help='等待全部出纸的时间 / Seconds to wait for paper out')
+    parser.add_argument('--output', help='JSON结果文件 / Write results as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help='保留临时工作目录 / Keep the temporary work directory')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
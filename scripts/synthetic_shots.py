@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+合成 DE1 冲泡数据 / Synthetic DE1 shot generator
+
+生成的冲泡与 DE1 插件上传的 JSON 结构相同（曲线、目标曲线、温度、总量、方案和 meta），
+可以改变时长（30秒到3分钟，按 DE1 的采样率）、中文或拉丁文字、是否有豆子信息以及方案说明的长度。
+Shots have the same JSON layout the DE1 plugin uploads (curves, goal curves, temperatures, totals,
+profile and meta). Duration (30 s to 3 min at the DE1 sample rate), CJK or Latin text, bean info and
+profile note length can be varied.
+
+用法 / Usage:
+    python scripts/synthetic_shots.py --output /tmp/shots --count 20 --seconds 30 180 --language zh
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+SAMPLE_INTERVAL = 0.25  # DE1 历史文件中约每秒4个采样 / About 4 samples per second, as in DE1 history files
+NOTE_LENGTHS = {'none': 0, 'short': 40, 'long': 400}  # 方案说明的字符数 / Profile note length in characters
+
+# 命名的冲泡变体：(时长秒数, 语言, 豆子信息, 方案说明长度) / Named shot variants: (seconds, language, bean info, note length)
+VARIANTS = {
+    '30s-en': (30, 'en', True, 'short'),
+    '60s-en': (60, 'en', True, 'short'),
+    '120s-en': (120, 'en', True, 'short'),
+    '180s-en': (180, 'en', True, 'short'),
+    '30s-zh': (30, 'zh', True, 'short'),
+    '30s-en-nobean-long': (30, 'en', False, 'long'),
+    '30s-zh-nobean-long': (30, 'zh', False, 'long'),
+}
+
+LATIN_WORDS = ('bright', 'citrus', 'caramel', 'syrupy', 'body', 'jasmine', 'finish', 'stone', 'fruit', 'cocoa',
+               'balanced', 'sweetness', 'acidity', 'clean', 'long', 'bloom', 'pressure', 'declining', 'ramp')
+CJK_WORDS = ('明亮', '柑橘', '焦糖', '糖浆感', '醇厚', '茉莉花', '回甘', '核果', '可可', '平衡', '甜感',
+             '酸质', '干净', '余韵', '闷蒸', '压力', '递减', '升压', '，', '。')
+TITLES = {'en': ('Default', 'Blooming espresso', 'Adaptive (for medium roasts)', 'Londinium', 'Turbo shot'),
+          'zh': ('默认', '闷蒸意式', '自适应（中烘）', '伦敦杠杆', '快速萃取')}
+BEANS = {'en': [('Bench Roasters', 'Ethiopia Guji'), ('Square Mile', 'Red Brick'), ('Local Roastery', 'House Blend')],
+         'zh': [('基准烘焙', '埃塞俄比亚 古吉'), ('方里', '红砖拼配'), ('本地烘焙坊', '招牌拼配')]}
+
+def note_text(rng, language, length):
+    """大约 length 个字符的说明文字 / Note text of about length characters"""
+    words = CJK_WORDS if language == 'zh' else LATIN_WORDS
+    separator = '' if language == 'zh' else ' '
+    text = ''
+    while len(text) < length:
+        text += (separator if text else '') + rng.choice(words)
+    return text[:length]
+
+def curves(rng, seconds):
+    """压力、流量、出液和温度曲线 / Pressure, flow, weight and temperature curves"""
+    samples = int(seconds / SAMPLE_INTERVAL)
+    elapsed = [i * SAMPLE_INTERVAL for i in range(samples)]
+    peak = rng.uniform(6, 9.5)
+    preinfusion = rng.uniform(4, 10)
+    # 长时间的冲泡用更低的流量，使出液量保持合理 / Longer shots flow slower so the yield stays plausible
+    target_flow = min(rng.uniform(1.5, 2.5), 40 / max(seconds - preinfusion, 1))
+    pressure, goal, flow, flow_goal = [], [], [], []
+    for t in elapsed:
+        if t < preinfusion:
+            wanted = 2.0 * t / preinfusion
+        else:
+            wanted = peak - (peak - 6) * min(1.0, (t - preinfusion) / max(seconds - preinfusion, 1))
+        goal.append(wanted)
+        pressure.append(max(0.0, wanted + rng.gauss(0, 0.1)))
+        wanted_flow = target_flow * min(1.0, t / preinfusion)
+        flow_goal.append(wanted_flow)
+        flow.append(max(0.0, wanted_flow + rng.gauss(0, 0.05)))
+    by_weight = [max(0.0, f - 0.2) if t > preinfusion else 0.0 for t, f in zip(elapsed, flow)]
+    weight, water, total, dispensed = [], [], 0.0, 0.0
+    for f, w in zip(flow, by_weight):
+        total += w * SAMPLE_INTERVAL
+        dispensed += f * SAMPLE_INTERVAL
+        weight.append(total)
+        water.append(dispensed)
+    basket = [92 + rng.gauss(0, 0.2) - 0.01 * t for t in elapsed]
+    return {
+        'elapsed': elapsed, 'pressure': pressure, 'pressure_goal': goal, 'flow': flow, 'flow_goal': flow_goal,
+        'by_weight': by_weight, 'weight': weight, 'water': water, 'basket': basket,
+        'mix': [b + 1.5 + rng.gauss(0, 0.1) for b in basket], 'resistance': [p / max(f, 0.3) for p, f in zip(pressure, flow)]
+    }
+
+def de1_shot(rng, seconds=30, language='en', bean_info=True, note_length='short', index=0):
+    """
+    合成一次 DE1 冲泡 / Synthesize one DE1 shot
+
+    note_length 为 NOTE_LENGTHS 中的名称或字符数 / note_length is a NOTE_LENGTHS name or a character count
+    """
+    length = NOTE_LENGTHS.get(note_length, note_length)
+    series = curves(rng, seconds)
+    started = datetime(2026, 1, 1, 8, 0) + timedelta(minutes=7 * index)
+    fmt = lambda values, digits=2: [f"{value:.{digits}f}" for value in values]  # noqa: E731
+    brand, bean_type = rng.choice(BEANS[language])
+    dose = rng.choice((16, 18, 20))
+    return {
+        'clock': str(int(started.timestamp())),
+        'timestamp': str(int(started.timestamp())),
+        'date': started.strftime('%a %b %d %H:%M:%S %Y'),
+        'elapsed': fmt(series['elapsed']),
+        'pressure': {'pressure': fmt(series['pressure']), 'goal': fmt(series['pressure_goal'])},
+        'flow': {'flow': fmt(series['flow']), 'by_weight': fmt(series['by_weight']),
+                 'by_weight_raw': fmt(series['by_weight']), 'goal': fmt(series['flow_goal'])},
+        'temperature': {'basket': fmt(series['basket'], 1), 'mix': fmt(series['mix'], 1),
+                        'goal': fmt([92.0] * len(series['elapsed']), 1)},
+        'totals': {'weight': fmt(series['weight'], 1), 'water_dispensed': fmt(series['water'], 1)},
+        'resistance': {'resistance': fmt(series['resistance'])},
+        'profile': {'title': rng.choice(TITLES[language]), 'author': 'Decent',
+                    'notes': note_text(rng, language, length), 'beverage_type': 'espresso'},
+        'meta': {
+            'in': str(dose), 'out': f"{series['weight'][-1]:.1f}", 'time': round(seconds),
+            'bean': {'brand': brand, 'type': bean_type, 'notes': note_text(rng, language, 30),
+                     'roast_level': 'Medium', 'roast_date': '20251215'} if bean_info else {},
+            'shot': {'notes': note_text(rng, language, 24), 'enjoyment': rng.randint(50, 90)} if bean_info else {},
+            'grinder': {'model': 'Bench', 'setting': str(rng.randint(8, 20))}
+        },
+        'app': {'app_name': 'DE1App', 'settings': {'plugin': 'print_the_shot'}}
+    }
+
+def variant_shot(name, rng, index=0):
+    """VARIANTS 中命名的冲泡 / The shot for a named variant in VARIANTS"""
+    seconds, language, bean_info, note_length = VARIANTS[name]
+    return de1_shot(rng, seconds, language, bean_info, note_length, index)
+
+def run(args):
+    os.makedirs(args.output, exist_ok=True)
+    rng = random.Random(args.seed)
+    for i in range(args.count):
+        shot = de1_shot(rng, rng.uniform(*args.seconds), args.language, not args.no_bean, args.notes, i)
+        path = os.path.join(args.output, f"shot_20260101_{i:06d}_synthetic.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(shot, f, ensure_ascii=False)
+    print(f"💾 {args.count} shots in {args.output}")
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Synthetic DE1 shot generator for PrintTheShot benchmarks')
+    parser.add_argument('--output', required=True, help='输出目录 / Directory to write shot_*.json into')
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--seconds', type=float, nargs=2, default=(30, 180), metavar=('MIN', 'MAX'),
+                        help='时长范围 / Shot duration range in seconds')
+    parser.add_argument('--language', choices=('en', 'zh'), default='en', help='文字语言 / Text language')
+    parser.add_argument('--no-bean', action='store_true', help='不含豆子信息 / Leave out bean info')
+    parser.add_argument('--notes', choices=sorted(NOTE_LENGTHS), default='short', help='方案说明长度 / Profile note length')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -0,0 +1,34 @@
+"""
+matplotlib 与 Pillow 引擎的打印位图对比（英文、80mm 和 58mm），使用固定种子的合成冲泡，任何安装都能运行
+Print raster comparison of the matplotlib and Pillow engines (English, 80mm and 58mm) on seeded synthetic
+shots, runnable on any install
+
+用法 / Usage:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import bench_render  # noqa: E402
+from bench_render import server  # noqa: E402
+
+@pytest.fixture
+def english():
+    language = server.current_language
+    server.current_language = 'en'
+    server.setup_matplotlib_font()
+    yield
+    server.current_language = language
+
+@pytest.mark.parametrize('paper', ['80mm', '58mm'])
+def test_engines_match(english, tmp_path, paper):
+    args = bench_render.parse_args(['--count', '2', '--repeat', '1', '--paper', paper, '--language', 'en'])
+    for shot_path in bench_render.load_shots(args, str(tmp_path)):
+        rasters = {engine: bench_render.render(engine, shot_path, str(tmp_path), args)[1]
+                   for engine in bench_render.ENGINES}
+        diff = bench_render.compare(rasters['matplotlib'], rasters['pillow'], args.tolerance)
+        assert diff['size'][0] == server.PAPER_PROFILES[paper]['dots']
+        assert diff['unmatched'] <= args.max_diff, f"{os.path.basename(shot_path)} on {paper}: {diff}"